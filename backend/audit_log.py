@@ -0,0 +1,254 @@
+"""用户操作日志 - 后台批量写入
+
+操作记录先放入内存队列，由后台写入线程按批写入当天的日志文件（data/logs/YYYY-MM-DD.log，
+每行一条JSON），写入线程保持文件句柄打开，跨天时自动切换到新文件，可选将已结束日期的日志压缩为.gz。
+磁盘太慢导致队列满时丢弃新记录并计数，不阻塞事件循环。
+"""
+import gzip
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, IO, List, Optional
+
+from database import LOGS_DIR
+from serializer import dumps
+from log_index import LogIndex
+
+
+def get_log_file_path(day: Optional[str] = None) -> str:
+    """获取某天（默认今天）的日志文件路径"""
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    return str(LOGS_DIR / f"{day}.log")
+
+
+class AuditLogger:
+    """用户操作日志的后台批量写入器"""
+
+    def __init__(self):
+        # 待写入的日志记录
+        self.queue: Deque[Dict] = deque()
+        # 队列容量，超出时丢弃新记录
+        self.max_queue = 10000
+        # 批量写入间隔（秒）
+        self.flush_interval = 0.5
+        # 是否压缩已结束日期的日志文件
+        self.compress = False
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+        # 当前打开的日志文件: (日期, 文件句柄)
+        self.current_day: Optional[str] = None
+        self.handle: Optional[IO[bytes]] = None
+        # 最近写入的日期，时钟回拨等原因产生的较早记录写入此日期的文件，不再打开已结束（可能已压缩）的日期
+        self.last_day = datetime.now().strftime("%Y-%m-%d")
+        # 日志索引（写入时同步维护），索引写入失败后下次写入时从日志文件补齐
+        self.index = LogIndex()
+        self.index_stale = False
+        # 统计信息
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_write_ms = 0.0
+
+    def start(self, max_queue: int = 10000, flush_interval: float = 0.5, compress: bool = False):
+        """启动后台写入线程"""
+        if self.thread is not None:
+            return
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止写入线程（写完队列中剩余的记录）"""
+        if self.thread is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+        self._close()
+        self.index.close()
+
+    def log(self, entry: Dict) -> bool:
+        """放入一条日志记录，队列已满时丢弃并返回False"""
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self.queue.append(entry)
+            if self.thread is None:
+                # 写入线程未启动（例如脚本中直接调用），同步写入
+                batch = list(self.queue)
+                self.queue.clear()
+                self._write_batch(batch)
+        return True
+
+    def _run(self):
+        self._catch_up_index()
+        if self.compress:
+            self.compress_closed_days()
+        while True:
+            with self.condition:
+                if self.running and not self.queue:
+                    self.condition.wait(self.flush_interval)
+                batch = list(self.queue)
+                self.queue.clear()
+                running = self.running
+            if batch:
+                self._write_batch(batch)
+            if not running:
+                with self.condition:
+                    if not self.queue:
+                        break
+
+    def _write_batch(self, batch: List[Dict]):
+        """按日期分组写入一批日志记录"""
+        start = time.perf_counter()
+        entries: List[Dict] = []
+        lines: List[bytes] = []
+        day = None
+        for entry in batch:
+            entry_day = max(entry["timestamp"][:10], self.last_day)
+            if entry_day != day and lines:
+                self._write_lines(day, entries, lines)
+                entries, lines = [], []
+            day = entry_day
+            entries.append(entry)
+            lines.append(dumps(entry) + b"\n")
+        if lines:
+            self._write_lines(day, entries, lines)
+
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_write_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def _write_lines(self, day: str, entries: List[Dict], lines: List[bytes]):
+        try:
+            handle = self._open(day)
+            offset = handle.tell()
+            handle.write(b"".join(lines))
+            handle.flush()
+            self.written += len(lines)
+        except Exception as e:
+            self.failed += len(lines)
+            print(f"写入日志失败: {e}")
+            return
+
+        if self.index_stale:
+            self._catch_up_index()
+            return
+        try:
+            self.index.add(day, offset, entries, lines)
+        except Exception as e:
+            self.index_stale = True
+            print(f"写入日志索引失败: {e}")
+
+    def _catch_up_index(self):
+        """从日志文件补齐索引"""
+        try:
+            self.index.catch_up()
+            self.index_stale = False
+        except Exception as e:
+            self.index_stale = True
+            print(f"补建日志索引失败: {e}")
+
+    def _open(self, day: str) -> IO[bytes]:
+        """获取某天日志文件的句柄，跨天时关闭前一天的文件"""
+        if self.handle is not None and self.current_day == day:
+            return self.handle
+        previous = self.current_day
+        self._close()
+        self.handle = open(get_log_file_path(day), "ab")
+        self.current_day = self.last_day = day
+        if self.compress and previous and previous < day:
+            self.compress_day(previous)
+        return self.handle
+
+    def _close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+            self.current_day = None
+
+    def compress_day(self, day: str):
+        """将某天的日志文件压缩为.log.gz并删除原文件
+
+        压缩结果先完整写入临时文件再替换，已存在同一天的压缩文件时解压后与日志文件合并，
+        合并后原日志文件中记录的偏移改变，重建这一天的索引。
+        """
+        path = get_log_file_path(day)
+        if not os.path.exists(path):
+            return
+        gz_path = path + ".gz"
+        temp_path = gz_path + ".tmp"
+        merged = os.path.exists(gz_path)
+        try:
+            with gzip.open(temp_path, "wb") as dst:
+                if merged:
+                    with gzip.open(gz_path, "rb") as old:
+                        shutil.copyfileobj(old, dst)
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+            os.replace(temp_path, gz_path)
+            os.remove(path)
+        except Exception as e:
+            print(f"压缩日志失败: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        if merged:
+            try:
+                self.index.reindex_day(day, gz_path, True)
+            except Exception as e:
+                self.index_stale = True
+                print(f"重建日志索引失败: {e}")
+
+    def compress_closed_days(self):
+        """压缩今天以前所有未压缩的日志文件"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        for path in sorted(LOGS_DIR.glob("*.log")):
+            if path.stem < today:
+                self.compress_day(path.stem)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取日志写入状态（队列深度、丢弃数等）"""
+        return {
+            "running": self.thread is not None,
+            "queue_depth": len(self.queue),
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_write_ms": self.last_write_ms,
+            "compress": self.compress,
+            "index_stale": self.index_stale,
+        }
+
+
+# 全局日志写入器
+audit_logger = AuditLogger()
+
+
+def log_user_action(user_id: str, display_name: str, sheet_key: str,
+                    action_type: str, details: dict):
+    """记录用户操作（放入队列，由后台线程写入日志文件）"""
+    audit_logger.log({
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+        "user_id": user_id,
+        "display_name": display_name,
+        "sheet_key": sheet_key,
+        "action": action_type,
+        "details": details
+    })
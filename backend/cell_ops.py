@@ -0,0 +1,98 @@
+"""单元格操作 - 单元格修改和列宽行高修改的校验
+
+WebSocket消息和修改操作格式（行列均为0索引）：
+    cell_update       {"row", "col", "value"?, "style"?}
+    batch_update      {"updates": [{"row", "col", "value"?, "style"?}, ...]}
+    dimension_update  {"col_widths"?: {列: 像素}, "row_heights"?: {行: 像素}}
+
+修改操作先写入journal再应用到内存模型，格式错误的操作必须在写入journal之前拒绝，
+否则内存模型只应用了一部分，崩溃恢复时重放同一条操作也会失败。
+"""
+from typing import Any, Dict, Optional
+
+# 表格的最大行数和列数（与Excel一致）
+MAX_ROWS = 1048576
+MAX_COLS = 16384
+# 单次批量修改最多的单元格数
+MAX_BATCH_UPDATES = 200000
+# 单元格文本的最大长度（与Excel一致）
+MAX_TEXT_LENGTH = 32767
+# 列宽行高的最大像素
+MAX_DIMENSION_SIZE = 5000
+
+
+def non_negative_int(op: Dict, name: str, limit: Optional[int] = None) -> int:
+    """取出op中的非负整数字段，limit为上限（不含）"""
+    value = op.get(name)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError(f"{name} 必须是非负整数")
+    if limit is not None and value >= limit:
+        raise ValueError(f"{name} 必须小于{limit}")
+    return value
+
+
+def cell_value(value: Any) -> Any:
+    """校验单元格的值（空、文本、数字或布尔值）"""
+    if value is None or isinstance(value, (bool, float)):
+        return value
+    if isinstance(value, int):
+        if not -2 ** 63 <= value < 2 ** 63:
+            raise ValueError("数值超出范围")
+        return value
+    if isinstance(value, str):
+        if len(value) > MAX_TEXT_LENGTH:
+            raise ValueError(f"文本超过{MAX_TEXT_LENGTH}个字符")
+        return value
+    raise ValueError("单元格的值必须是文本或数字")
+
+
+def cell_style(style: Any) -> Optional[Dict]:
+    if style is None or isinstance(style, dict):
+        return style
+    raise ValueError("style 必须是对象")
+
+
+def normalize_update(data: Dict) -> Dict:
+    """校验一个单元格的修改: {"row", "col", "value", "style"}"""
+    if not isinstance(data, dict):
+        raise ValueError("单元格修改格式无效")
+    row = non_negative_int(data, "row", MAX_ROWS)
+    col = non_negative_int(data, "col", MAX_COLS)
+    return {"row": row, "col": col, "value": cell_value(data.get("value")), "style": cell_style(data.get("style"))}
+
+
+def normalize_sizes(sizes: Any, limit: int) -> Optional[Dict[str, int]]:
+    """校验列宽或行高: {索引: 像素}"""
+    if sizes is None:
+        return None
+    if not isinstance(sizes, dict):
+        raise ValueError("列宽行高格式无效")
+    result = {}
+    for index, size in sizes.items():
+        if not str(index).isdigit() or int(index) >= limit:
+            raise ValueError(f"行列号无效: {index}")
+        if not isinstance(size, (int, float)) or isinstance(size, bool) or not 0 <= size <= MAX_DIMENSION_SIZE:
+            raise ValueError(f"列宽行高必须在0到{MAX_DIMENSION_SIZE}之间")
+        result[str(int(index))] = int(size)
+    return result
+
+
+def normalize_cell_op(op: Dict) -> Dict:
+    """校验单元格操作并转换为规范格式，格式错误时抛出ValueError"""
+    op_type = op.get("type")
+    if op_type == "cell_update":
+        return dict(normalize_update(op), type=op_type)
+    if op_type == "batch_update":
+        updates = op.get("updates")
+        if not isinstance(updates, list) or not updates:
+            raise ValueError("updates 必须是非空数组")
+        if len(updates) > MAX_BATCH_UPDATES:
+            raise ValueError(f"单次修改超过{MAX_BATCH_UPDATES}个单元格")
+        return {"type": op_type, "updates": [normalize_update(update) for update in updates]}
+    if op_type == "dimension_update":
+        return {
+            "type": op_type,
+            "col_widths": normalize_sizes(op.get("col_widths"), MAX_COLS),
+            "row_heights": normalize_sizes(op.get("row_heights"), MAX_ROWS),
+        }
+    raise ValueError(f"未知操作类型: {op_type}")
@@ -0,0 +1,346 @@
+"""SQLite单元格存储 - 表格的另一种存储引擎
+
+每个表格一个SQLite文件（data/sheets/{key}.sqlite），单元格按(行, 列)为主键存放，样式去重后单独存放，
+合并单元格、列宽、行高各一张表。保存修改只更新涉及的行（一次保存一个事务），
+不再像xlsx那样每次重写整个文件；导出时再根据表格数据生成xlsx。
+
+数据库使用默认的回滚日志模式：写入直接修改数据库文件，文件修改时间和大小随之变化，
+与xlsx文件一样可用于生成模型标识和ETag。同一表格的读写由工作池串行执行。
+"""
+import json
+import sqlite3
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import Cell
+
+from database import SHEETS_DIR
+from excel_handler import KEEP_VALUE, extract_cell_style, next_cell_state
+from range_ops import STRUCTURE_OP_TYPES, iter_range_values, shift_merges, shift_sizes, structure_axis
+from table_ops import iter_sorted_positions
+
+CELL_STORE_SUFFIX = ".sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS styles (
+    id INTEGER PRIMARY KEY,
+    style TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cells (
+    row INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    value,
+    type TEXT,
+    style_id INTEGER,
+    PRIMARY KEY (row, col)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS merges (
+    start_row INTEGER NOT NULL,
+    end_row INTEGER NOT NULL,
+    start_col INTEGER NOT NULL,
+    end_col INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS col_widths (
+    col INTEGER PRIMARY KEY,
+    width INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS row_heights (
+    row INTEGER PRIMARY KEY,
+    height INTEGER NOT NULL
+);
+"""
+
+
+def is_cell_store(file_path: str) -> bool:
+    """文件是否为SQLite单元格存储"""
+    return str(file_path).endswith(CELL_STORE_SUFFIX)
+
+
+def connect(file_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(file_path)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def style_text(style: Dict) -> str:
+    """样式字典的规范JSON（用于去重）"""
+    return json.dumps(style, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def db_value(value: Any) -> Any:
+    """转换为SQLite可存储的值（日期时间存为ISO字符串）"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+class StyleTable:
+    """样式表：样式JSON与编号互相转换，同一连接内缓存"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.ids: Dict[str, int] = {}
+        self.styles: Dict[int, Dict] = {}
+        for style_id, text in conn.execute("SELECT id, style FROM styles"):
+            self.ids[text] = style_id
+            self.styles[style_id] = json.loads(text)
+
+    def get_id(self, style: Dict) -> Optional[int]:
+        if not style:
+            return None
+        text = style_text(style)
+        style_id = self.ids.get(text)
+        if style_id is None:
+            style_id = self.conn.execute("INSERT INTO styles (style) VALUES (?)", (text,)).lastrowid
+            self.ids[text] = style_id
+            self.styles[style_id] = json.loads(text)
+        return style_id
+
+    def get_style(self, style_id: Optional[int]) -> Dict:
+        return self.styles.get(style_id, {}) if style_id is not None else {}
+
+
+def row_to_cell(value: Any, cell_type: Optional[str], style: Dict) -> Dict:
+    cell = dict(style)
+    if value is not None:
+        cell["v"] = bool(value) if cell_type == "b" else value
+        cell["t"] = cell_type
+    return cell
+
+
+def read_meta(conn: sqlite3.Connection) -> Dict[str, Any]:
+    return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+
+
+def write_meta(conn: sqlite3.Connection, values: Dict[str, Any]):
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [(key, json.dumps(value, ensure_ascii=False)) for key, value in values.items()]
+    )
+
+
+def load_cell_store(file_path: str) -> Dict[str, Any]:
+    """读取表格数据，格式与load_sheet_data一致"""
+    conn = connect(file_path)
+    try:
+        meta = read_meta(conn)
+        styles = StyleTable(conn)
+        cell_data = {}
+        for row, col, value, cell_type, style_id in conn.execute(
+            "SELECT row, col, value, type, style_id FROM cells ORDER BY row, col"
+        ):
+            cell_data[f"{row}_{col}"] = row_to_cell(value, cell_type, styles.get_style(style_id))
+
+        merges = [
+            {"startRow": r0, "endRow": r1, "startColumn": c0, "endColumn": c1}
+            for r0, r1, c0, c1 in conn.execute("SELECT start_row, end_row, start_col, end_col FROM merges")
+        ]
+        col_widths = dict(conn.execute("SELECT col, width FROM col_widths ORDER BY col"))
+        row_heights = dict(conn.execute("SELECT row, height FROM row_heights ORDER BY row"))
+    finally:
+        conn.close()
+
+    return {
+        "id": meta.get("id"),
+        "name": meta.get("name", "Sheet1"),
+        "cellData": cell_data,
+        "mergeData": merges,
+        "columnData": col_widths,
+        "rowData": row_heights,
+        "rowCount": meta.get("rowCount", 100),
+        "columnCount": meta.get("columnCount", 26),
+        "defaultStyle": meta.get("defaultStyle"),
+        "journalSeq": meta.get("journalSeq", 0),
+    }
+
+
+def write_cell_store(data: Dict[str, Any], file_path: str):
+    """将表格数据（load_sheet_data格式）批量写入新的单元格存储"""
+    conn = connect(file_path)
+    try:
+        with conn:
+            styles = StyleTable(conn)
+            rows = []
+            for cell_key, cell in data.get("cellData", {}).items():
+                row, col = cell_key.split("_")
+                style = {k: v for k, v in cell.items() if k not in ("v", "t")}
+                rows.append((int(row), int(col), db_value(cell.get("v")), cell.get("t"), styles.get_id(style)))
+            conn.executemany("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO merges VALUES (?, ?, ?, ?)",
+                [(m["startRow"], m["endRow"], m["startColumn"], m["endColumn"]) for m in data.get("mergeData", [])]
+            )
+            conn.executemany("INSERT OR REPLACE INTO col_widths VALUES (?, ?)",
+                             [(int(k), int(v)) for k, v in data.get("columnData", {}).items()])
+            conn.executemany("INSERT OR REPLACE INTO row_heights VALUES (?, ?)",
+                             [(int(k), int(v)) for k, v in data.get("rowData", {}).items()])
+            write_meta(conn, {
+                "id": data.get("id"),
+                "name": data.get("name", "Sheet1"),
+                "rowCount": data.get("rowCount", 100),
+                "columnCount": data.get("columnCount", 26),
+                "defaultStyle": data.get("defaultStyle"),
+                "journalSeq": data.get("journalSeq") or 0,
+            })
+    finally:
+        conn.close()
+
+
+def create_empty_cell_store(file_name: str) -> str:
+    """创建空白表格"""
+    file_path = str(SHEETS_DIR / f"{file_name}{CELL_STORE_SUFFIX}")
+    # 默认样式与新建Excel文件一致
+    default_style = extract_cell_style(Cell(Workbook().active))
+    write_cell_store({"id": file_name, "name": "Sheet1", "defaultStyle": default_style}, file_path)
+    return file_path
+
+
+def read_cell_store_journal_seq(file_path: str) -> int:
+    """单元格存储记录的已写入journal序号"""
+    conn = connect(file_path)
+    try:
+        return read_meta(conn).get("journalSeq", 0)
+    finally:
+        conn.close()
+
+
+def apply_cell_store_operations(file_path: str, ops: List[Dict], journal_seq: Optional[int] = None):
+    """将一组修改操作在一个事务中写入单元格存储（只更新涉及的单元格），journal_seq与修改在同一事务中记录"""
+    conn = connect(file_path)
+    try:
+        with conn:
+            meta = read_meta(conn)
+            default_style = meta.get("defaultStyle") or {}
+            row_count = meta.get("rowCount", 100)
+            column_count = meta.get("columnCount", 26)
+            styles = StyleTable(conn)
+
+            for op in ops:
+                op_type = op.get("type")
+                if op_type == "cell_update":
+                    updates = [(op["row"], op["col"], op.get("value"), op.get("style"))]
+                elif op_type in ("batch_update", "find_replace"):
+                    updates = [(u["row"], u["col"], u.get("value"), u.get("style")) for u in op.get("updates", [])]
+                elif op_type == "range_set":
+                    updates = [(row, col, value, op.get("style")) for row, col, value in iter_range_values(op)]
+                elif op_type == "range_style":
+                    updates = [(row, col, KEEP_VALUE, op["style"])
+                               for row in range(op["r0"], op["r1"] + 1) for col in range(op["c0"], op["c1"] + 1)]
+                elif op_type == "range_clear":
+                    _clear_range(conn, styles, default_style, op)
+                    continue
+                elif op_type in STRUCTURE_OP_TYPES:
+                    row_count, column_count = _shift_cells(conn, op, row_count, column_count)
+                    continue
+                elif op_type == "sort_range":
+                    _sort_cells(conn, op)
+                    continue
+                elif op_type == "dimension_update":
+                    conn.executemany("INSERT OR REPLACE INTO col_widths VALUES (?, ?)",
+                                     [(int(k), int(v)) for k, v in (op.get("col_widths") or {}).items()])
+                    conn.executemany("INSERT OR REPLACE INTO row_heights VALUES (?, ?)",
+                                     [(int(k), int(v)) for k, v in (op.get("row_heights") or {}).items()])
+                    continue
+                else:
+                    continue
+
+                for row, col, value, style in updates:
+                    _set_cell(conn, styles, default_style, row, col, value, style)
+                    row_count = max(row_count, row + 1)
+                    column_count = max(column_count, col + 1)
+
+            values = {"rowCount": row_count, "columnCount": column_count}
+            if journal_seq is not None:
+                values["journalSeq"] = journal_seq
+            write_meta(conn, values)
+    finally:
+        conn.close()
+
+
+def _clear_range(conn: sqlite3.Connection, styles: StyleTable, default_style: Dict, op: Dict):
+    """清除区域内的值（formats为真时连同格式删除单元格）"""
+    bounds = (op["r0"], op["r1"], op["c0"], op["c1"])
+    where = "row BETWEEN ? AND ? AND col BETWEEN ? AND ?"
+    if op.get("formats"):
+        conn.execute(f"DELETE FROM cells WHERE {where}", bounds)
+        return
+    rows = conn.execute(f"SELECT row, col FROM cells WHERE {where} AND value IS NOT NULL", bounds).fetchall()
+    for row, col in rows:
+        _set_cell(conn, styles, default_style, row, col, None, None)
+
+
+def _sort_cells(conn: sqlite3.Connection, op: Dict):
+    """排序：按op["order"]移动区域内的单元格"""
+    r0, c0, c1 = op["r0"], op["c0"], op["c1"]
+    r1 = r0 + len(op["order"]) - 1
+    positions = conn.execute(
+        "SELECT row, col FROM cells WHERE row BETWEEN ? AND ? AND col BETWEEN ? AND ? ORDER BY row, col",
+        (r0, r1, c0, c1)
+    ).fetchall()
+    # 与插入/删除行列相同，先移到负数区间再取反，避免移动过程中主键冲突
+    conn.executemany("UPDATE cells SET row = ? WHERE row = ? AND col = ?",
+                     [(-new_row - 1, row, col) for row, col, new_row in iter_sorted_positions(op, positions)])
+    conn.execute("UPDATE cells SET row = -row - 1 WHERE row < 0")
+
+
+def _shift_cells(conn: sqlite3.Connection, op: Dict, row_count: int, column_count: int):
+    """插入/删除行列，返回新的 (行数, 列数)"""
+    axis, insert = structure_axis(op["type"])
+    at, count = op["at"], op["count"]
+    if not insert:
+        conn.execute(f"DELETE FROM cells WHERE {axis} BETWEEN ? AND ?", (at, at + count - 1))
+    # 主键逐行检查唯一性，先移到负数区间再取反，避免移动过程中与未移动的单元格冲突
+    delta = count if insert else -count
+    first = at if insert else at + count
+    conn.execute(f"UPDATE cells SET {axis} = -({axis} + ?) - 1 WHERE {axis} >= ?", (delta, first))
+    conn.execute(f"UPDATE cells SET {axis} = -{axis} - 1 WHERE {axis} < 0")
+
+    merges = [
+        {"startRow": r0, "endRow": r1, "startColumn": c0, "endColumn": c1}
+        for r0, r1, c0, c1 in conn.execute("SELECT start_row, end_row, start_col, end_col FROM merges")
+    ]
+    conn.execute("DELETE FROM merges")
+    conn.executemany(
+        "INSERT INTO merges VALUES (?, ?, ?, ?)",
+        [(m["startRow"], m["endRow"], m["startColumn"], m["endColumn"]) for m in shift_merges(merges, op)]
+    )
+
+    table = "row_heights" if axis == "row" else "col_widths"
+    size_column = "height" if axis == "row" else "width"
+    sizes = dict(conn.execute(f"SELECT {axis}, {size_column} FROM {table}"))
+    conn.execute(f"DELETE FROM {table}")
+    conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", list(shift_sizes(sizes, op).items()))
+
+    if axis == "row":
+        row_count = row_count + count if insert else max(row_count - count, 1)
+    else:
+        column_count = column_count + count if insert else max(column_count - count, 1)
+    return row_count, column_count
+
+
+def _set_cell(conn: sqlite3.Connection, styles: StyleTable, default_style: Dict,
+              row: int, col: int, value: Any, style: Optional[Dict]):
+    """按内存模型的规则更新一个单元格（读取原单元格，计算新状态后写入或删除）"""
+    current = conn.execute(
+        "SELECT value, type, style_id FROM cells WHERE row = ? AND col = ?", (row, col)
+    ).fetchone()
+    old = row_to_cell(current[0], current[1], styles.get_style(current[2])) if current else None
+    cell = next_cell_state(old, default_style, value, style)
+
+    if cell is None:
+        if current:
+            conn.execute("DELETE FROM cells WHERE row = ? AND col = ?", (row, col))
+        return
+    cell_style = {k: v for k, v in cell.items() if k not in ("v", "t")}
+    conn.execute(
+        "INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?)",
+        (row, col, db_value(cell.get("v")), cell.get("t"), styles.get_id(cell_style))
+    )
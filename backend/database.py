@@ -1,7 +1,12 @@
 """数据库连接和初始化模块"""
 import aiosqlite
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
 
 # 数据目录
 DATA_DIR = Path(__file__).parent.parent / "data"
@@ -9,22 +14,156 @@ SYSTEM_NAME = os.getenv("SYSTEM_NAME", "共享表格")
 DB_PATH = DATA_DIR / f"{SYSTEM_NAME}.db"
 SHEETS_DIR = DATA_DIR / "sheets"
 LOGS_DIR = DATA_DIR / "logs"
+EXPORTS_DIR = DATA_DIR / "exports"
 
 # 确保目录存在
 DATA_DIR.mkdir(exist_ok=True)
 SHEETS_DIR.mkdir(exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
+EXPORTS_DIR.mkdir(exist_ok=True)
 
 
-async def get_db():
-    """获取数据库连接"""
-    db = await aiosqlite.connect(DB_PATH)
-    db.row_factory = aiosqlite.Row
-    return db
+# 连接参数：WAL模式读写互不阻塞，NORMAL同步级别在WAL下仍保证数据库一致
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
 
 
-async def init_db():
-    """初始化数据库表"""
+class ConnectionPool:
+    """长连接池：启动时打开固定数量的连接，请求之间复用"""
+
+    def __init__(self):
+        self.size = 4
+        self.connections: List[aiosqlite.Connection] = []
+        self.idle: Optional[asyncio.Queue] = None
+        # 首次打开时创建（Python 3.8/3.9中模块导入时创建的Lock会绑定到当时的事件循环）
+        self.open_lock: Optional[asyncio.Lock] = None
+
+    async def open(self, size: Optional[int] = None):
+        """打开连接池（已打开时忽略）"""
+        if self.open_lock is None:
+            self.open_lock = asyncio.Lock()
+        async with self.open_lock:
+            if self.idle is not None:
+                return
+            if size:
+                self.size = max(1, size)
+            idle: asyncio.Queue = asyncio.Queue()
+            for _ in range(self.size):
+                db = await aiosqlite.connect(DB_PATH)
+                db.row_factory = aiosqlite.Row
+                for pragma in CONNECTION_PRAGMAS:
+                    await db.execute(pragma)
+                self.connections.append(db)
+                idle.put_nowait(db)
+            self.idle = idle
+
+    async def close(self):
+        """关闭所有连接"""
+        connections, self.connections, self.idle = self.connections, [], None
+        for db in connections:
+            await db.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """借出一个连接，用完归还（未提交的修改回滚，与关闭连接时一致）"""
+        if self.idle is None:
+            await self.open()
+        idle = self.idle
+        db = await idle.get()
+        try:
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            finally:
+                idle.put_nowait(db)
+
+
+# 全局连接池
+db_pool = ConnectionPool()
+
+
+def get_db():
+    """获取数据库连接: async with get_db() as db: ..."""
+    return db_pool.acquire()
+
+
+class SheetKeyCache:
+    """表格密钥缓存: {key: {"name": 表格名称, "file_path": 文件路径}}
+
+    启动时加载全部密钥，未命中时查询数据库（read-through），创建和删除密钥时同步更新。
+    无效密钥在一段时间内直接返回不存在（负缓存），避免暴力猜测密钥时反复查询数据库。
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, str]] = {}
+        # 无效密钥: {key: 过期时间}，按加入顺序排列，超出容量时丢弃最早的
+        self.missing: "OrderedDict[str, float]" = OrderedDict()
+        # 负缓存有效期（秒）和容量
+        self.negative_ttl = 60.0
+        self.max_missing = 10000
+
+    async def load_all(self):
+        """从数据库加载全部密钥"""
+        async with get_db() as db:
+            cursor = await db.execute("SELECT key, name, file_path FROM sheet_keys")
+            rows = await cursor.fetchall()
+        self.entries = {row["key"]: {"name": row["name"], "file_path": row["file_path"]} for row in rows}
+        self.missing.clear()
+
+    async def get(self, key: str) -> Optional[Dict[str, str]]:
+        """获取密钥对应的表格信息，密钥不存在时返回None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+
+        expires = self.missing.get(key)
+        if expires is not None:
+            if expires > time.monotonic():
+                return None
+            del self.missing[key]
+
+        async with get_db() as db:
+            cursor = await db.execute("SELECT name, file_path FROM sheet_keys WHERE key = ?", (key,))
+            row = await cursor.fetchone()
+        if row:
+            return self.put(key, row["name"], row["file_path"])
+
+        self.missing[key] = time.monotonic() + self.negative_ttl
+        if len(self.missing) > self.max_missing:
+            self.missing.popitem(last=False)
+        return None
+
+    def put(self, key: str, name: str, file_path: str) -> Dict[str, str]:
+        """新增或更新密钥（创建密钥后调用）"""
+        entry = {"name": name, "file_path": file_path}
+        self.entries[key] = entry
+        self.missing.pop(key, None)
+        return entry
+
+    def invalidate(self, key: str):
+        """移除密钥（删除密钥后调用）"""
+        self.entries.pop(key, None)
+        self.missing.pop(key, None)
+
+
+# 全局密钥缓存
+sheet_key_cache = SheetKeyCache()
+
+
+async def close_db():
+    """关闭数据库连接池"""
+    await db_pool.close()
+
+
+async def init_db(pool_size: int = 4):
+    """初始化数据库表，打开连接池并加载密钥缓存"""
     async with aiosqlite.connect(DB_PATH) as db:
         # 密钥表
         await db.execute("""
@@ -75,3 +214,6 @@ async def init_db():
             )
             await db.commit()
             print("默认管理员已创建: admin / admin123")
+
+    await db_pool.open(pool_size)
+    await sheet_key_cache.load_all()
@@ -4,10 +4,18 @@ from pathlib import Path
 from typing import Any, List, Dict, Optional, Tuple
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Fill, PatternFill, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
+from openpyxl.cell.cell import Cell, MergedCell, WriteOnlyCell
+from openpyxl.packaging.custom import IntProperty
+from openpyxl.utils import get_column_letter, column_index_from_string
 import json
+from functools import lru_cache
 
 from database import SHEETS_DIR
+from range_ops import STRUCTURE_OP_TYPES, iter_range_values, shift_merges, shift_sizes, structure_axis
+from table_ops import iter_sorted_positions
+
+# 记录已写入表格文件的最后一条journal序号的自定义文档属性
+JOURNAL_SEQ_PROPERTY = "journal_seq"
 
 
 def create_empty_sheet(file_name: str) -> str:
@@ -40,32 +48,36 @@ def load_sheet_data(file_path: str) -> Dict[str, Any]:
     max_row = max(ws.max_row, 100)
     max_col = max(ws.max_column, 26)
 
-    # 读取单元格数据
+    # 默认样式：未设置过格式的单元格（含工作表中不存在的单元格）都使用此样式，
+    # 前端将其作为表格默认样式，不再为每个空单元格单独生成条目
+    style_cache = {}
+    default_style = extract_cell_style(Cell(ws), style_cache)
+
+    # 读取单元格数据：只遍历工作表中实际存在的单元格，耗时与已填充单元格数成正比
     cell_data = {}
-    styles = {}
     merges = []
 
-    for row in range(1, max_row + 1):
-        for col in range(1, max_col + 1):
-            cell = ws.cell(row=row, column=col)
+    for (row, col), cell in sorted(ws._cells.items()):
+        # 获取样式（先获取样式，因为空单元格也可能有边框等样式）
+        style = extract_cell_style(cell, style_cache)
+
+        # 获取值
+        value = cell.value
+        # 空值且为默认样式的单元格与不存在的单元格等价，无需输出
+        if value is None and style == default_style:
+            continue
+        # 修复：即使单元格为空，只要有样式（如边框），也要创建单元格条目
+        if value is not None or (style and len(style) > 0):
             cell_key = f"{row-1}_{col-1}"  # 转为0索引
+            cell_data[cell_key] = {}
 
-            # 获取样式（先获取样式，因为空单元格也可能有边框等样式）
-            style = extract_cell_style(cell)
-
-            # 获取值
-            value = cell.value
-            # 修复：即使单元格为空，只要有样式（如边框），也要创建单元格条目
-            if value is not None or (style and len(style) > 0):
-                cell_data[cell_key] = {}
-
-                if value is not None:
-                    cell_data[cell_key]["v"] = value
-                    cell_data[cell_key]["t"] = get_cell_type(value)  # type: s=string, n=number, b=boolean
+            if value is not None:
+                cell_data[cell_key]["v"] = value
+                cell_data[cell_key]["t"] = get_cell_type(value)  # type: s=string, n=number, b=boolean
 
-                # 添加样式（包括边框）
-                if style:
-                    cell_data[cell_key].update(style)
+            # 添加样式（包括边框）
+            if style:
+                cell_data[cell_key].update(style)
 
     # 获取合并单元格信息
     for merge_range in ws.merged_cells.ranges:
@@ -76,22 +88,19 @@ def load_sheet_data(file_path: str) -> Dict[str, Any]:
             "endColumn": merge_range.max_col - 1,
         })
 
-    # 获取列宽
+    # 获取列宽（只遍历已设置的列）
     col_widths = {}
-    for col in range(1, max_col + 1):
-        col_letter = get_column_letter(col)
-        if col_letter in ws.column_dimensions:
-            width = ws.column_dimensions[col_letter].width
-            if width:
-                col_widths[col - 1] = int(width * 7)  # 转换为像素
-
-    # 获取行高
+    for col_letter, dimension in sorted(ws.column_dimensions.items(),
+                                        key=lambda item: column_index_from_string(item[0])):
+        col = column_index_from_string(col_letter)
+        if col <= max_col and dimension.width:
+            col_widths[col - 1] = int(dimension.width * 7)  # 转换为像素
+
+    # 获取行高（只遍历已设置的行）
     row_heights = {}
-    for row in range(1, max_row + 1):
-        if row in ws.row_dimensions:
-            height = ws.row_dimensions[row].height
-            if height:
-                row_heights[row - 1] = int(height)
+    for row, dimension in sorted(ws.row_dimensions.items()):
+        if row <= max_row and dimension.height:
+            row_heights[row - 1] = int(dimension.height)
 
     return {
         "id": Path(file_path).stem,
@@ -102,6 +111,8 @@ def load_sheet_data(file_path: str) -> Dict[str, Any]:
         "rowData": row_heights,
         "rowCount": max_row,
         "columnCount": max_col,
+        "defaultStyle": default_style,
+        "journalSeq": read_journal_seq(wb),
     }
 
 
@@ -115,8 +126,22 @@ def get_cell_type(value: Any) -> str:
         return "s"
 
 
-def extract_cell_style(cell) -> Optional[Dict]:
-    """提取单元格样式（完整版：字体、颜色、对齐、边框等）"""
+def extract_cell_style(cell, cache: Optional[Dict] = None) -> Optional[Dict]:
+    """提取单元格样式（完整版：字体、颜色、对齐、边框等）
+
+    cache为同一工作簿内的样式缓存，以单元格的字体/填充/边框/对齐样式索引为键，
+    每种样式组合只转换一次（返回的字典被多个单元格共享，调用方不应修改）。
+    """
+    if cache is not None:
+        style_array = cell._style
+        if style_array:
+            cache_key = (style_array.fontId, style_array.fillId, style_array.borderId, style_array.alignmentId)
+        else:
+            cache_key = (0, 0, 0, 0)  # 未设置样式，使用工作簿默认样式
+        if cache_key not in cache:
+            cache[cache_key] = extract_cell_style(cell)
+        return cache[cache_key]
+
     style = {}
 
     # 字体
@@ -204,6 +229,101 @@ def extract_cell_style(cell) -> Optional[Dict]:
     return style if style else None
 
 
+FONT_STYLE_KEYS = ("bl", "it", "ul", "st", "fs", "ff", "cl")
+ALIGNMENT_STYLE_KEYS = ("ht", "vt", "tb")
+
+
+def merge_cell_style(current: Optional[Dict], style: Dict) -> Dict:
+    """按apply_cell_style的覆盖规则合并样式（用于内存模型，与写入Excel后的效果一致）"""
+    merged = dict(current) if current else {}
+
+    # 字体：任一字体属性变化时整体替换Font
+    font = {}
+    if style.get("bl"):
+        font["bl"] = 1
+    if style.get("it"):
+        font["it"] = 1
+    if "ul" in style:
+        font["ul"] = {"s": 1}
+    if style.get("st"):
+        font["st"] = 1
+    if "fs" in style:
+        font["fs"] = style["fs"]
+    if "ff" in style:
+        font["ff"] = style["ff"]
+    if "cl" in style and "rgb" in style["cl"]:
+        font["cl"] = {"rgb": style["cl"]["rgb"]}
+    if font:
+        for key in FONT_STYLE_KEYS:
+            merged.pop(key, None)
+        merged.update(font)
+
+    # 背景色
+    if "bg" in style and "rgb" in style["bg"]:
+        merged["bg"] = {"rgb": style["bg"]["rgb"]}
+
+    # 对齐方式：整体替换Alignment
+    alignment = {}
+    if "ht" in style:
+        alignment["ht"] = style["ht"]
+    if "vt" in style:
+        alignment["vt"] = style["vt"]
+    if "tb" in style and style["tb"] == "2":
+        alignment["tb"] = "2"
+    if alignment:
+        for key in ALIGNMENT_STYLE_KEYS:
+            merged.pop(key, None)
+        merged.update(alignment)
+
+    # 边框：整体替换Border
+    if "bd" in style:
+        border_style = {}
+        for side_key in ("t", "b", "l", "r"):
+            if side_key in style["bd"]:
+                border_info = style["bd"][side_key]
+                border_style[side_key] = {
+                    "s": 1 if border_info.get("s") == 1 else 2,
+                    "cl": {"rgb": border_info.get("cl", {}).get("rgb", "000000")}
+                }
+        if border_style:
+            merged["bd"] = border_style
+
+    return merged
+
+
+# next_cell_state的value参数：只修改样式，保留原来的值
+KEEP_VALUE = object()
+
+
+def next_cell_state(old: Optional[Dict], default_style: Dict, value: Any,
+                    style: Optional[Dict] = None) -> Optional[Dict]:
+    """计算单元格写入值和样式后的状态，空值且为默认样式时返回None（与不存在的单元格等价）
+
+    old为原单元格（不存在时为None），返回新的字典，不修改old。value为KEEP_VALUE时保留原值。
+    """
+    cell = dict(old) if old else dict(default_style)
+
+    if style:
+        cell_style = {k: v for k, v in cell.items() if k not in ("v", "t")}
+        if value is KEEP_VALUE and "v" in cell:
+            value = cell["v"]
+        cell = merge_cell_style(cell_style, style)
+
+    if value is KEEP_VALUE:
+        pass
+    # 空字符串写入Excel后读回为空单元格，这里保持一致
+    elif value is None or value == "":
+        cell.pop("v", None)
+        cell.pop("t", None)
+    else:
+        cell["v"] = value
+        cell["t"] = get_cell_type(value)
+
+    if cell and cell != default_style:
+        return cell
+    return None
+
+
 def update_cell(file_path: str, row: int, col: int, value: Any, style: Optional[Dict] = None):
     """更新单个单元格并保存"""
     wb = load_workbook(file_path)
@@ -221,7 +341,24 @@ def update_cell(file_path: str, row: int, col: int, value: Any, style: Optional[
 
 def apply_cell_style(cell, style: Dict):
     """应用样式到单元格（完整版：字体、颜色、对齐、边框等）"""
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    # 相同的样式字典复用同一组样式对象，不再为每个单元格重新构造
+    font, fill, alignment, border = build_style_objects(json.dumps(style, sort_keys=True))
+    if font:
+        cell.font = font
+    if fill:
+        cell.fill = fill
+    if alignment:
+        cell.alignment = alignment
+    if border:
+        cell.border = border
+
+
+@lru_cache(maxsize=1024)
+def build_style_objects(style_key: str) -> Tuple[Optional[Font], Optional[PatternFill],
+                                                 Optional[Alignment], Optional[Border]]:
+    """根据样式字典（JSON字符串）构造openpyxl样式对象: (Font, PatternFill, Alignment, Border)"""
+    style = json.loads(style_key)
+    font = fill = alignment = border = None
 
     # 字体样式
     font_kwargs = {}
@@ -240,12 +377,12 @@ def apply_cell_style(cell, style: Dict):
     if "cl" in style and "rgb" in style["cl"]:
         font_kwargs["color"] = style["cl"]["rgb"]
     if font_kwargs:
-        cell.font = Font(**font_kwargs)
+        font = Font(**font_kwargs)
 
     # 背景色
     if "bg" in style and "rgb" in style["bg"]:
         rgb = style["bg"]["rgb"]
-        cell.fill = PatternFill(start_color=rgb, end_color=rgb, fill_type="solid")
+        fill = PatternFill(start_color=rgb, end_color=rgb, fill_type="solid")
 
     # 对齐方式
     alignment_kwargs = {}
@@ -256,7 +393,7 @@ def apply_cell_style(cell, style: Dict):
     if "tb" in style and style["tb"] == "2":  # 文字换行
         alignment_kwargs["wrap_text"] = True
     if alignment_kwargs:
-        cell.alignment = Alignment(**alignment_kwargs)
+        alignment = Alignment(**alignment_kwargs)
 
     # 边框
     if "bd" in style:
@@ -269,7 +406,9 @@ def apply_cell_style(cell, style: Dict):
                 border_color = border_info.get("cl", {}).get("rgb", "000000")
                 sides[side_name] = Side(style=border_style, color=border_color)
         if sides:
-            cell.border = Border(**sides)
+            border = Border(**sides)
+
+    return font, fill, alignment, border
 
 
 def batch_update_cells(file_path: str, updates: List[Dict]):
@@ -328,14 +467,68 @@ def save_sheet_from_univer(file_path: str, sheet_data: Dict):
     wb.save(file_path)
 
 
-def import_excel(source_path: str, target_name: str) -> str:
-    """导入外部Excel文件"""
-    target_path = SHEETS_DIR / f"{target_name}.xlsx"
+def write_sheet_data(data: Dict[str, Any], file_path: str):
+    """将表格数据（load_sheet_data格式）写入新的Excel文件"""
+    cells = []
+    for cell_key, cell_info in data.get("cellData", {}).items():
+        row, col = cell_key.split("_")
+        cells.append(((int(row), int(col)), cell_info))
+    write_sheet_cells(data, cells, file_path)
+
+
+def write_sheet_cells(fields: Dict[str, Any], cells: List[Tuple[Tuple[int, int], Dict]], file_path: str):
+    """使用只写模式的工作簿逐行写入Excel文件（不在内存中构建完整的工作表）
+
+    fields为表格数据中除cellData以外的字段（名称、合并单元格、列宽行高），
+    cells为[((row, col), 单元格)]，0索引，顺序不限。
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(fields.get("name") or "Sheet1")
+
+    # 只写模式下列宽行高、合并单元格须在写入行之前设置
+    for col_idx, width in (fields.get("columnData") or {}).items():
+        ws.column_dimensions[get_column_letter(int(col_idx) + 1)].width = width / 7  # 像素转为Excel单位
+    for row_idx, height in (fields.get("rowData") or {}).items():
+        ws.row_dimensions[int(row_idx) + 1].height = height
+    for merge in fields.get("mergeData") or []:
+        ws.merged_cells.add(
+            f"{get_column_letter(merge['startColumn'] + 1)}{merge['startRow'] + 1}:"
+            f"{get_column_letter(merge['endColumn'] + 1)}{merge['endRow'] + 1}"
+        )
+
+    next_row = 0
+    row_values: List[Any] = []
+    current_row = None
+    for (row, col), cell_info in sorted(cells, key=lambda item: item[0]):
+        if row != current_row:
+            if current_row is not None:
+                ws.append(row_values)
+                next_row = current_row + 1
+            # 中间没有单元格的行写入空行
+            for _ in range(row - next_row):
+                ws.append([])
+            current_row, row_values = row, []
+        row_values.extend([None] * (col - len(row_values)))
+        style = {k: v for k, v in cell_info.items() if k not in ("v", "t")}
+        if style:
+            cell = WriteOnlyCell(ws, cell_info.get("v"))
+            apply_cell_style(cell, style)
+            row_values.append(cell)
+        else:
+            row_values.append(cell_info.get("v"))
+    if current_row is not None:
+        ws.append(row_values)
+
+    if fields.get("journalSeq"):
+        set_journal_seq(wb, fields["journalSeq"])
+    wb.save(file_path)
+    wb.close()
 
-    # 直接复制文件
-    import shutil
-    shutil.copy(source_path, target_path)
 
+def import_excel(source_path: str, target_name: str) -> str:
+    """导入外部Excel文件（上传的临时文件与表格在同一目录，直接移动，不再复制）"""
+    target_path = SHEETS_DIR / f"{target_name}.xlsx"
+    os.replace(source_path, target_path)
     return str(target_path)
 
 
@@ -378,3 +571,140 @@ def batch_update_dimensions(file_path: str, col_widths: Dict = None, row_heights
 
     wb.save(file_path)
     wb.close()
+
+
+def apply_operations(file_path: str, ops: List[Dict], journal_seq: Optional[int] = None):
+    """将一组修改操作一次性写入Excel文件（只加载和保存一次），journal_seq为最后一条操作的journal序号"""
+    wb = load_workbook(file_path)
+    ws = wb.active
+
+    for op in ops:
+        op_type = op.get("type")
+        if op_type == "cell_update":
+            updates = [op]
+        elif op_type in ("batch_update", "find_replace"):
+            updates = op.get("updates", [])
+        elif op_type == "range_set":
+            updates = [{"row": row, "col": col, "value": value, "style": op.get("style")}
+                       for row, col, value in iter_range_values(op)]
+        elif op_type == "range_clear":
+            for row in ws.iter_rows(min_row=op["r0"] + 1, max_row=op["r1"] + 1,
+                                    min_col=op["c0"] + 1, max_col=op["c1"] + 1):
+                for cell in row:
+                    if isinstance(cell, MergedCell):
+                        continue
+                    cell.value = None
+                    if op.get("formats"):
+                        cell.style = "Normal"
+            continue
+        elif op_type == "range_style":
+            for row in ws.iter_rows(min_row=op["r0"] + 1, max_row=op["r1"] + 1,
+                                    min_col=op["c0"] + 1, max_col=op["c1"] + 1):
+                for cell in row:
+                    apply_cell_style(cell, op["style"])
+            continue
+        elif op_type in STRUCTURE_OP_TYPES:
+            shift_worksheet(ws, op)
+            continue
+        elif op_type == "sort_range":
+            sort_worksheet(ws, op)
+            continue
+        elif op_type == "dimension_update":
+            if op.get("col_widths"):
+                for col_idx, width in op["col_widths"].items():
+                    col_letter = get_column_letter(int(col_idx) + 1)
+                    ws.column_dimensions[col_letter].width = width / 7  # 像素转为Excel单位
+            if op.get("row_heights"):
+                for row_idx, height in op["row_heights"].items():
+                    ws.row_dimensions[int(row_idx) + 1].height = height
+            continue
+        else:
+            continue
+
+        for update in updates:
+            cell = ws.cell(row=update["row"] + 1, column=update["col"] + 1)
+            if isinstance(cell, MergedCell):
+                # 合并单元格中除左上角以外的单元格不能写入值
+                continue
+            cell.value = update.get("value")
+            style = update.get("style")
+            if style:
+                apply_cell_style(cell, style)
+
+    if journal_seq is not None:
+        set_journal_seq(wb, journal_seq)
+    wb.save(file_path)
+    wb.close()
+
+
+def sort_worksheet(ws, op: Dict):
+    """排序：按op["order"]移动区域内的单元格（值和样式）"""
+    r0, c0, c1 = op["r0"], op["c0"], op["c1"]
+    r1 = r0 + len(op["order"]) - 1
+    # 只遍历已有的单元格（0索引位置），避免为空白位置创建单元格
+    positions = sorted(
+        (row - 1, col - 1) for row, col in ws._cells
+        if r0 + 1 <= row <= r1 + 1 and c0 + 1 <= col <= c1 + 1
+    )
+    moves = [(ws._cells.pop((row + 1, col + 1)), new_row, col)
+             for row, col, new_row in iter_sorted_positions(op, positions)]
+    for cell, new_row, col in moves:
+        moved = ws.cell(row=new_row + 1, column=col + 1)
+        moved.value = cell.value
+        moved._style = cell._style
+
+
+def shift_worksheet(ws, op: Dict):
+    """插入/删除行列：移动单元格，并按range_ops的规则调整合并单元格和行高列宽"""
+    axis, insert = structure_axis(op["type"])
+    merges = [
+        {"startRow": r.min_row - 1, "endRow": r.max_row - 1, "startColumn": r.min_col - 1, "endColumn": r.max_col - 1}
+        for r in ws.merged_cells.ranges
+    ]
+    # 先取消合并，移动完成后按新位置重新合并
+    for merge_range in list(ws.merged_cells.ranges):
+        ws.unmerge_cells(str(merge_range))
+
+    at, count = op["at"] + 1, op["count"]
+    if axis == "row":
+        heights = {row - 1: dim.height for row, dim in ws.row_dimensions.items() if dim.height}
+        (ws.insert_rows if insert else ws.delete_rows)(at, count)
+        for row in list(ws.row_dimensions):
+            del ws.row_dimensions[row]
+        for row, height in shift_sizes(heights, op).items():
+            ws.row_dimensions[row + 1].height = height
+    else:
+        widths = {column_index_from_string(letter) - 1: dim.width
+                  for letter, dim in ws.column_dimensions.items() if dim.width}
+        (ws.insert_cols if insert else ws.delete_cols)(at, count)
+        for letter in list(ws.column_dimensions):
+            del ws.column_dimensions[letter]
+        for col, width in shift_sizes(widths, op).items():
+            ws.column_dimensions[get_column_letter(col + 1)].width = width
+
+    for merge in shift_merges(merges, op):
+        ws.merge_cells(start_row=merge["startRow"] + 1, start_column=merge["startColumn"] + 1,
+                       end_row=merge["endRow"] + 1, end_column=merge["endColumn"] + 1)
+
+
+def read_journal_seq(wb) -> int:
+    """工作簿中记录的已写入journal序号（自定义文档属性），没有时为0"""
+    for prop in wb.custom_doc_props.props:
+        if prop.name == JOURNAL_SEQ_PROPERTY:
+            return int(prop.value)
+    return 0
+
+
+def set_journal_seq(wb, journal_seq: int):
+    if JOURNAL_SEQ_PROPERTY in wb.custom_doc_props.names:
+        del wb.custom_doc_props[JOURNAL_SEQ_PROPERTY]
+    wb.custom_doc_props.append(IntProperty(name=JOURNAL_SEQ_PROPERTY, value=journal_seq))
+
+
+def read_file_journal_seq(file_path: str) -> int:
+    """读取Excel文件记录的journal序号（只读模式打开，不解析单元格）"""
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return read_journal_seq(wb)
+    finally:
+        wb.close()
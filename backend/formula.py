@@ -0,0 +1,866 @@
+"""公式计算 - 服务端计算公式单元格的结果，修改后只重算受影响的公式
+
+以"="开头的单元格值为公式（表格文件中保存公式文本，计算结果只在内存中）。支持常用函数
+（SUM、AVERAGE、MIN、MAX、COUNT、COUNTA、IF、IFERROR、AND、OR、NOT、ROUND、ABS、INT、MOD、
+POWER、SQRT、CONCATENATE、LEN、LEFT、RIGHT、MID、UPPER、LOWER、TRIM），单元格引用和区域引用，
+四则运算、乘方、百分号、文本连接和比较运算。
+
+每个公式记录引用的单元格和区域，反向建立依赖关系：单元格引用按位置索引，区域引用按
+(列, 行块) 索引。修改单元格后从被修改的位置出发找出所有受影响的公式，按拓扑顺序重算，
+形成循环引用的公式（及依赖它们的公式）结果为 #CIRC!，只返回计算结果有变化的公式。
+
+前端写入的值都是文本，数字形式的文本按数字参与计算。插入/删除行列不改写公式中的引用
+（与表格文件中保存的公式保持一致），之后整体重建依赖关系并重算。
+"""
+import math
+import re
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+Position = Tuple[int, int]
+Range = Tuple[int, int, int, int]
+
+# 区域引用索引的行块大小（行号右移位数）
+ROW_BLOCK_SHIFT = 8
+# 结果保持为整数的范围（超出时转为浮点数，与JavaScript的安全整数范围一致，序列化时不会溢出）
+MAX_SAFE_INTEGER = 2 ** 53
+# ROUND的小数位数范围（浮点数的精度之外没有意义，也避免计算过大的10的幂）
+MAX_ROUND_DIGITS = 308
+
+_MISSING = object()
+
+
+class FormulaError(str):
+    """公式错误值（#DIV/0!、#VALUE!等），作为计算结果直接序列化为字符串"""
+
+
+DIV_ZERO = FormulaError("#DIV/0!")
+VALUE_ERROR = FormulaError("#VALUE!")
+NUM_ERROR = FormulaError("#NUM!")
+NAME_ERROR = FormulaError("#NAME?")
+REF_ERROR = FormulaError("#REF!")
+PARSE_ERROR = FormulaError("#ERROR!")
+CYCLE_ERROR = FormulaError("#CIRC!")
+
+
+class EvalError(Exception):
+    """计算中遇到错误值，中止当前公式的计算"""
+
+    def __init__(self, error: FormulaError):
+        super().__init__(error)
+        self.error = error
+
+
+def is_formula(value: Any) -> bool:
+    return value.__class__ is str and len(value) > 1 and value[0] == "="
+
+
+# ==================== 解析 ====================
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<ref>(?P<col_abs>\$?)(?P<letters>[A-Za-z]{1,3})(?P<row_abs>\$?)(?P<digits>\d+))(?![A-Za-z0-9_.(])
+  | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%(),:])
+)""", re.X)
+
+# 引用: (行是否绝对引用, 行, 列是否绝对引用, 列)，相对引用的行列为相对公式所在位置的偏移
+RefSpec = Tuple[bool, int, bool, int]
+
+
+class FormulaSyntaxError(ValueError):
+    pass
+
+
+def column_index(letters: str) -> int:
+    """列字母转为列号，0索引"""
+    col = 0
+    for letter in letters.upper():
+        col = col * 26 + ord(letter) - 64
+    return col - 1
+
+
+def tokenize(text: str, row: int, col: int) -> Tuple:
+    """公式文本（不含开头的"="）分解为符号，引用转为相对(row, col)的形式
+
+    同一列向下填充的公式（如每行的 =A{i}*B{i}）得到相同的符号序列，共用一份编译结果。
+    """
+    tokens = []
+    pos, end = 0, len(text.rstrip())
+    while pos < end:
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            raise FormulaSyntaxError(f"无法识别的内容: {text[pos:pos + 10]}")
+        kind = match.lastgroup
+        if kind == "ref":
+            row_abs, ref_row = match.group("row_abs") == "$", int(match.group("digits")) - 1
+            col_abs, ref_col = match.group("col_abs") == "$", column_index(match.group("letters"))
+            if ref_row < 0:
+                raise FormulaSyntaxError(f"无效的引用: {match.group(kind)}")
+            tokens.append((kind, (row_abs, ref_row if row_abs else ref_row - row,
+                                  col_abs, ref_col if col_abs else ref_col - col)))
+        else:
+            tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tuple(tokens)
+
+
+def resolve_ref(spec: RefSpec, row: int, col: int) -> Position:
+    """引用在(row, col)处的公式中指向的位置"""
+    row_abs, ref_row, col_abs, ref_col = spec
+    return (ref_row if row_abs else row + ref_row), (ref_col if col_abs else col + ref_col)
+
+
+def resolve_range(start: RefSpec, end: RefSpec, row: int, col: int) -> Range:
+    (r0, c0), (r1, c1) = resolve_ref(start, row, col), resolve_ref(end, row, col)
+    return min(r0, r1), max(r0, r1), min(c0, c1), max(c0, c1)
+
+
+class Parser:
+    """递归下降解析，生成语法树并记录引用的单元格和区域
+
+    语法树节点: ("const", 值) / ("ref", 引用) / ("range", 起始引用, 结束引用) /
+    ("call", 函数名, [参数]) / ("binary", 运算符, 左, 右) / ("neg", x) / ("percent", x)
+    """
+
+    def __init__(self, tokens: Tuple):
+        self.tokens = tokens
+        self.index = 0
+        self.refs: Set[RefSpec] = set()
+        self.ranges: Set[Tuple[RefSpec, RefSpec]] = set()
+
+    def parse(self):
+        node = self.comparison()
+        if self.index != len(self.tokens):
+            raise FormulaSyntaxError(f"多余的内容: {self.tokens[self.index][1]}")
+        return node
+
+    def peek(self) -> Optional[str]:
+        if self.index < len(self.tokens):
+            kind, value = self.tokens[self.index]
+            return value if kind == "op" else None
+        return None
+
+    def next(self) -> Tuple[str, str]:
+        if self.index >= len(self.tokens):
+            raise FormulaSyntaxError("公式不完整")
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, op: str):
+        kind, value = self.next()
+        if kind != "op" or value != op:
+            raise FormulaSyntaxError(f"缺少 {op}")
+
+    def binary(self, operand, operators):
+        node = operand()
+        while self.peek() in operators:
+            op = self.next()[1]
+            node = ("binary", op, node, operand())
+        return node
+
+    def comparison(self):
+        return self.binary(self.concat, ("=", "<>", "<", ">", "<=", ">="))
+
+    def concat(self):
+        return self.binary(self.additive, ("&",))
+
+    def additive(self):
+        return self.binary(self.multiplicative, ("+", "-"))
+
+    def multiplicative(self):
+        return self.binary(self.power, ("*", "/"))
+
+    def power(self):
+        return self.binary(self.unary, ("^",))
+
+    def unary(self):
+        op = self.peek()
+        if op == "-":
+            self.next()
+            return ("neg", self.unary())
+        if op == "+":
+            self.next()
+            return self.unary()
+        node = self.primary()
+        while self.peek() == "%":
+            self.next()
+            node = ("percent", node)
+        return node
+
+    def primary(self):
+        kind, value = self.next()
+        if kind == "number":
+            number = float(value)
+            return ("const", int(number) if number.is_integer() and abs(number) < 1e15 else number)
+        if kind == "string":
+            return ("const", value[1:-1].replace('""', '"'))
+        if kind == "ref":
+            if self.peek() != ":":
+                self.refs.add(value)
+                return ("ref", value)
+            self.next()
+            kind, end = self.next()
+            if kind != "ref":
+                raise FormulaSyntaxError("区域引用不完整")
+            self.ranges.add((value, end))
+            return ("range", value, end)
+        if kind == "name":
+            name = value.upper()
+            if self.peek() == "(":
+                self.next()
+                args = []
+                if self.peek() != ")":
+                    args.append(self.comparison())
+                    while self.peek() == ",":
+                        self.next()
+                        args.append(self.comparison())
+                self.expect(")")
+                return ("call", name, args)
+            if name in ("TRUE", "FALSE"):
+                return ("const", name == "TRUE")
+            return ("const", NAME_ERROR)
+        if value == "(":
+            node = self.comparison()
+            self.expect(")")
+            return node
+        raise FormulaSyntaxError(f"意外的符号: {value}")
+
+
+# ==================== 值转换 ====================
+
+# 数字形式的文本可能的首字符（其他文本不尝试转换，避免抛出异常的开销）
+_NUMBER_START = frozenset("0123456789+-. \t")
+
+
+def text_number(text: str) -> Any:
+    """数字形式的文本转为数字，其他文本原样返回"""
+    if not text or text[0] not in _NUMBER_START:
+        return text
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    if not math.isfinite(number):
+        return text
+    return int(number) if number.is_integer() and abs(number) < 1e15 else number
+
+
+def to_number(value: Any) -> Any:
+    if value is None:
+        return 0
+    if isinstance(value, FormulaError):
+        raise EvalError(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        number = text_number(value.strip()) if value.strip() else 0
+        if isinstance(number, str):
+            raise EvalError(VALUE_ERROR)
+        return number
+    raise EvalError(VALUE_ERROR)
+
+
+def to_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, FormulaError):
+        raise EvalError(value)
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    if isinstance(value, list):
+        raise EvalError(VALUE_ERROR)
+    return str(value)
+
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, str) and not isinstance(value, FormulaError):
+        upper = value.upper()
+        if upper in ("TRUE", "FALSE"):
+            return upper == "TRUE"
+    return to_number(value) != 0
+
+
+def scalar(value: Any) -> Any:
+    """单个参数的值（区域引用不能作为单个值）"""
+    if isinstance(value, list):
+        raise EvalError(VALUE_ERROR)
+    return value
+
+
+def normalize_result(value: Any) -> Any:
+    """公式的最终结果：空引用为0，整数值的浮点数转为整数，超出安全范围的整数转为浮点数"""
+    if value is None:
+        return 0
+    if isinstance(value, list):
+        return VALUE_ERROR
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) > MAX_SAFE_INTEGER:
+        try:
+            return float(value)
+        except OverflowError:
+            return NUM_ERROR
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return NUM_ERROR
+        if value.is_integer() and abs(value) < 1e15:
+            return int(value)
+    return value
+
+
+# ==================== 运算符 ====================
+
+_TYPE_RANK = {int: 0, float: 0, str: 1, bool: 2}
+
+
+def _compare_key(value: Any, other: Any) -> Tuple[int, Any]:
+    if value is None:
+        # 空单元格与另一侧同类型的空值比较
+        value = "" if isinstance(other, str) else (False if isinstance(other, bool) else 0)
+    if isinstance(value, FormulaError):
+        raise EvalError(value)
+    rank = _TYPE_RANK.get(type(value))
+    if rank is None:
+        raise EvalError(VALUE_ERROR)
+    return rank, value.lower() if rank == 1 else value
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    left, right = scalar(left), scalar(right)
+    a, b = _compare_key(left, right), _compare_key(right, left)
+    if op == "=":
+        return a == b
+    if op == "<>":
+        return a != b
+    if op == "<":
+        return a < b
+    if op == ">":
+        return a > b
+    if op == "<=":
+        return a <= b
+    return a >= b
+
+
+def _divide(left: Any, right: Any) -> Any:
+    divisor = to_number(scalar(right))
+    dividend = to_number(scalar(left))
+    if divisor == 0:
+        raise EvalError(DIV_ZERO)
+    return dividend / divisor
+
+
+def _power(left: Any, right: Any) -> Any:
+    """乘方按浮点数计算（整数的大指数乘方结果位数不受限制，计算会阻塞很久）"""
+    base, exponent = to_number(scalar(left)), to_number(scalar(right))
+    if base == 0 and exponent < 0:
+        raise EvalError(DIV_ZERO)
+    try:
+        return math.pow(base, exponent)
+    except (OverflowError, ValueError):
+        # 结果溢出，或负数的非整数次方
+        raise EvalError(NUM_ERROR)
+
+
+_BINARY_OPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "+": lambda a, b: to_number(scalar(a)) + to_number(scalar(b)),
+    "-": lambda a, b: to_number(scalar(a)) - to_number(scalar(b)),
+    "*": lambda a, b: to_number(scalar(a)) * to_number(scalar(b)),
+    "/": _divide,
+    "^": _power,
+    "&": lambda a, b: to_text(scalar(a)) + to_text(scalar(b)),
+}
+for _op in ("=", "<>", "<", ">", "<=", ">="):
+    _BINARY_OPS[_op] = (lambda op: lambda a, b: _compare(op, a, b))(_op)
+
+
+# ==================== 函数 ====================
+
+def _numbers(args: List[Any]) -> List[Any]:
+    """参数中的数字：区域中忽略非数字的单元格，单个参数转换为数字"""
+    result = []
+    for arg in args:
+        if isinstance(arg, list):
+            for value in arg:
+                if isinstance(value, FormulaError):
+                    raise EvalError(value)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    result.append(value)
+        else:
+            result.append(to_number(arg))
+    return result
+
+
+def _values(args: List[Any]) -> Iterable[Any]:
+    for arg in args:
+        if isinstance(arg, list):
+            yield from arg
+        else:
+            yield arg
+
+
+def _average(args):
+    numbers = _numbers(args)
+    if not numbers:
+        raise EvalError(DIV_ZERO)
+    return sum(numbers) / len(numbers)
+
+
+def _count(args):
+    count = 0
+    for value in _values(args):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            count += 1
+    return count
+
+
+def _round(args):
+    number = to_number(scalar(args[0]))
+    digits = int(to_number(scalar(args[1]))) if len(args) > 1 else 0
+    digits = max(-MAX_ROUND_DIGITS, min(MAX_ROUND_DIGITS, digits))
+    # 四舍五入（远离0），与Excel一致
+    factor = 10.0 ** digits
+    scaled = abs(number) * factor
+    if not math.isfinite(scaled) or scaled >= MAX_SAFE_INTEGER:
+        # 位数超出浮点数的精度，原值不变
+        return number
+    return math.copysign(math.floor(scaled + 0.5) / factor, number)
+
+
+def _mod(args):
+    number, divisor = to_number(scalar(args[0])), to_number(scalar(args[1]))
+    if divisor == 0:
+        raise EvalError(DIV_ZERO)
+    return number - divisor * math.floor(number / divisor)
+
+
+def _sqrt(args):
+    number = to_number(scalar(args[0]))
+    if number < 0:
+        raise EvalError(NUM_ERROR)
+    return math.sqrt(number)
+
+
+def _mid(args):
+    text = to_text(scalar(args[0]))
+    start, length = int(to_number(scalar(args[1]))), int(to_number(scalar(args[2])))
+    if start < 1 or length < 0:
+        raise EvalError(VALUE_ERROR)
+    return text[start - 1:start - 1 + length]
+
+
+def _left(args):
+    count = int(to_number(scalar(args[1]))) if len(args) > 1 else 1
+    if count < 0:
+        raise EvalError(VALUE_ERROR)
+    return to_text(scalar(args[0]))[:count]
+
+
+def _right(args):
+    count = int(to_number(scalar(args[1]))) if len(args) > 1 else 1
+    if count < 0:
+        raise EvalError(VALUE_ERROR)
+    text = to_text(scalar(args[0]))
+    return text[len(text) - count:] if count else ""
+
+
+def _bools(args) -> List[bool]:
+    result = []
+    for value in _values(args):
+        if value is None or (isinstance(value, str) and not isinstance(value, FormulaError)
+                             and value.upper() not in ("TRUE", "FALSE")):
+            continue
+        result.append(to_bool(value))
+    return result
+
+
+# 函数: 名称 -> (最少参数个数, 最多参数个数（None为不限）, 实现)
+FUNCTIONS: Dict[str, Tuple[int, Optional[int], Callable[[List[Any]], Any]]] = {
+    "SUM": (1, None, lambda args: sum(_numbers(args))),
+    "AVERAGE": (1, None, _average),
+    "MIN": (1, None, lambda args: min(_numbers(args), default=0)),
+    "MAX": (1, None, lambda args: max(_numbers(args), default=0)),
+    "COUNT": (1, None, _count),
+    "COUNTA": (1, None, lambda args: sum(1 for value in _values(args) if value is not None and value != "")),
+    "AND": (1, None, lambda args: all(_bools(args))),
+    "OR": (1, None, lambda args: any(_bools(args))),
+    "NOT": (1, 1, lambda args: not to_bool(scalar(args[0]))),
+    "ROUND": (1, 2, _round),
+    "ABS": (1, 1, lambda args: abs(to_number(scalar(args[0])))),
+    "INT": (1, 1, lambda args: math.floor(to_number(scalar(args[0])))),
+    "MOD": (2, 2, _mod),
+    "POWER": (2, 2, lambda args: _power(args[0], args[1])),
+    "SQRT": (1, 1, _sqrt),
+    "CONCATENATE": (1, None, lambda args: "".join(to_text(value) for value in _values(args))),
+    "CONCAT": (1, None, lambda args: "".join(to_text(value) for value in _values(args))),
+    "LEN": (1, 1, lambda args: len(to_text(scalar(args[0])))),
+    "LEFT": (1, 2, _left),
+    "RIGHT": (1, 2, _right),
+    "MID": (3, 3, _mid),
+    "UPPER": (1, 1, lambda args: to_text(scalar(args[0])).upper()),
+    "LOWER": (1, 1, lambda args: to_text(scalar(args[0])).lower()),
+    "TRIM": (1, 1, lambda args: " ".join(to_text(scalar(args[0])).split())),
+}
+
+
+# ==================== 编译 ====================
+
+# 求值函数: (公式引擎, 公式所在行, 列) -> 值，公式引擎用于读取单元格的值
+Evaluator = Callable[["FormulaEngine", int, int], Any]
+
+
+def _compile(node) -> Evaluator:
+    """语法树编译为求值函数（相对引用在求值时按公式所在位置换算）"""
+    kind = node[0]
+    if kind == "const":
+        value = node[1]
+        return lambda engine, row, col: value
+    if kind == "ref":
+        row_abs, ref_row, col_abs, ref_col = node[1]
+        if row_abs and col_abs:
+            pos = (ref_row, ref_col)
+            return lambda engine, row, col: engine.cell_value(pos)
+        # 相对引用：位置 = 偏移 + 公式所在位置 * (0或1)
+        row_rel, col_rel = int(not row_abs), int(not col_abs)
+        return lambda engine, row, col: engine.cell_value((ref_row + row * row_rel, ref_col + col * col_rel))
+    if kind == "range":
+        start, end = node[1], node[2]
+        return lambda engine, row, col: engine.range_values(*resolve_range(start, end, row, col))
+    if kind == "neg":
+        operand = _compile(node[1])
+        return lambda engine, row, col: -to_number(scalar(operand(engine, row, col)))
+    if kind == "percent":
+        operand = _compile(node[1])
+        return lambda engine, row, col: to_number(scalar(operand(engine, row, col))) / 100
+    if kind == "binary":
+        func = _BINARY_OPS[node[1]]
+        left, right = _compile(node[2]), _compile(node[3])
+        return lambda engine, row, col: func(left(engine, row, col), right(engine, row, col))
+    return _compile_call(node[1], [_compile(arg) for arg in node[2]])
+
+
+def _compile_call(name: str, args: List[Evaluator]) -> Evaluator:
+    # IF和IFERROR只计算需要的参数
+    if name == "IF" and 2 <= len(args) <= 3:
+        condition, then = args[0], args[1]
+        otherwise = args[2] if len(args) > 2 else (lambda engine, row, col: False)
+
+        def if_(engine, row, col):
+            if to_bool(scalar(condition(engine, row, col))):
+                return then(engine, row, col)
+            return otherwise(engine, row, col)
+        return if_
+    if name == "IFERROR" and len(args) == 2:
+        value, fallback = args
+
+        def iferror(engine, row, col):
+            try:
+                result = value(engine, row, col)
+            except EvalError:
+                return fallback(engine, row, col)
+            return fallback(engine, row, col) if isinstance(result, FormulaError) else result
+        return iferror
+
+    spec = FUNCTIONS.get(name)
+    if spec is None:
+        return lambda engine, row, col: NAME_ERROR
+    min_args, max_args, func = spec
+    if len(args) < min_args or (max_args is not None and len(args) > max_args):
+        return lambda engine, row, col: VALUE_ERROR
+    return lambda engine, row, col: func([arg(engine, row, col) for arg in args])
+
+
+class Template(NamedTuple):
+    """相对引用形式相同的公式共用的编译结果"""
+    evaluate: Evaluator
+    refs: Tuple[RefSpec, ...]
+    ranges: Tuple[Tuple[RefSpec, RefSpec], ...]
+
+
+class Formula(NamedTuple):
+    source: str
+    template: Template
+    # 引用的单元格和区域（已换算为绝对位置）
+    refs: frozenset
+    ranges: Tuple[Range, ...]
+
+
+_PARSE_ERROR_TEMPLATE = Template(lambda engine, row, col: PARSE_ERROR, (), ())
+
+# 编译结果缓存: {符号序列: Template}
+_template_cache: Dict[Tuple, Template] = {}
+TEMPLATE_CACHE_SIZE = 10000
+
+
+def compile_formula(source: str, row: int, col: int) -> Formula:
+    """编译(row, col)处的公式文本（含开头的"="），语法错误的公式计算结果为 #ERROR!"""
+    try:
+        tokens = tokenize(source[1:], row, col)
+    except FormulaSyntaxError:
+        return Formula(source, _PARSE_ERROR_TEMPLATE, frozenset(), ())
+    template = _template_cache.get(tokens)
+    if template is None:
+        try:
+            parser = Parser(tokens)
+            template = Template(_compile(parser.parse()), tuple(parser.refs), tuple(parser.ranges))
+        except (FormulaSyntaxError, RecursionError):
+            template = _PARSE_ERROR_TEMPLATE
+        if len(_template_cache) >= TEMPLATE_CACHE_SIZE:
+            _template_cache.clear()
+        _template_cache[tokens] = template
+    refs = frozenset(resolve_ref(spec, row, col) for spec in template.refs)
+    ranges = tuple(sorted({resolve_range(start, end, row, col) for start, end in template.ranges}))
+    return Formula(source, template, refs, ranges)
+
+
+# ==================== 依赖关系和重算 ====================
+
+def find_cycles(nodes: Set[Position], edges: Dict[Position, List[Position]]) -> Set[Position]:
+    """nodes构成的子图中处于循环中的节点（Tarjan强连通分量算法，非递归实现）"""
+    index: Dict[Position, int] = {}
+    low: Dict[Position, int] = {}
+    stack: List[Position] = []
+    on_stack: Set[Position] = set()
+    cycles: Set[Position] = set()
+    counter = 0
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(edges.get(root, ())))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in nodes:
+                    continue
+                if successor not in index:
+                    index[successor] = low[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(edges.get(successor, ()))))
+                    break
+                if successor in on_stack:
+                    low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in edges.get(node, ()):
+                        cycles.update(component)
+    return cycles
+
+
+class FormulaEngine:
+    """单个表格的公式：计算结果、依赖关系和增量重算（单元格数据读自所属的SheetModel）"""
+
+    def __init__(self, model):
+        self.model = model
+        self.formulas: Dict[Position, Formula] = {}
+        # 计算结果: {(row, col): 值}
+        self.values: Dict[Position, Any] = {}
+        # 单元格引用的反向索引: {被引用的位置: {公式位置}}
+        self.dependents: Dict[Position, Set[Position]] = {}
+        # 区域引用的反向索引: {(列, 行块): {引用的区域与该块相交的公式位置}}
+        self.range_index: Dict[Tuple[int, int], Set[Position]] = {}
+        # 统计信息
+        self.last_recalc_count = 0
+
+    def rebuild(self):
+        """从表格的全部单元格重建公式和依赖关系，并全部重算"""
+        self.formulas.clear()
+        self.values.clear()
+        self.dependents.clear()
+        self.range_index.clear()
+        for pos, cell in self.model.cells.items():
+            value = cell.get("v")
+            if is_formula(value):
+                self._register(pos, value)
+        self._recalculate(list(self.formulas))
+
+    def update(self, positions: Iterable[Position]) -> Dict[Position, Any]:
+        """单元格的值被修改后重算受影响的公式，返回计算结果有变化的位置（不再是公式的位置值为None）"""
+        positions = list(positions)
+        changed = {}
+        for pos in positions:
+            cell = self.model.cells.get(pos)
+            value = cell.get("v") if cell else None
+            old = self.formulas.get(pos)
+            if old is not None and old.source == value:
+                continue
+            if old is not None:
+                self._unregister(pos, old)
+                if not is_formula(value):
+                    self.values.pop(pos, None)
+                    changed[pos] = None
+            if is_formula(value):
+                self._register(pos, value)
+        changed.update(self._recalculate(positions))
+        return changed
+
+    def _register(self, pos: Position, source: str):
+        formula = self.formulas[pos] = compile_formula(source, *pos)
+        for ref in formula.refs:
+            self.dependents.setdefault(ref, set()).add(pos)
+        for block in self._range_blocks(formula):
+            self.range_index.setdefault(block, set()).add(pos)
+
+    def _unregister(self, pos: Position, formula: Formula):
+        del self.formulas[pos]
+        for ref in formula.refs:
+            dependents = self.dependents[ref]
+            dependents.discard(pos)
+            if not dependents:
+                del self.dependents[ref]
+        for block in self._range_blocks(formula):
+            members = self.range_index[block]
+            members.discard(pos)
+            if not members:
+                del self.range_index[block]
+
+    @staticmethod
+    def _range_blocks(formula: Formula) -> Set[Tuple[int, int]]:
+        blocks = set()
+        for r0, r1, c0, c1 in formula.ranges:
+            for col in range(c0, c1 + 1):
+                for block in range(r0 >> ROW_BLOCK_SHIFT, (r1 >> ROW_BLOCK_SHIFT) + 1):
+                    blocks.add((col, block))
+        return blocks
+
+    def dependents_of(self, pos: Position) -> List[Position]:
+        """直接引用某位置（单元格引用或包含它的区域引用）的公式"""
+        result = list(self.dependents.get(pos, ()))
+        members = self.range_index.get((pos[1], pos[0] >> ROW_BLOCK_SHIFT))
+        if members:
+            row, col = pos
+            for member in members:
+                for r0, r1, c0, c1 in self.formulas[member].ranges:
+                    if r0 <= row <= r1 and c0 <= col <= c1:
+                        result.append(member)
+                        break
+        return result
+
+    def _recalculate(self, sources: List[Position]) -> Dict[Position, Any]:
+        """重算sources中的公式及所有直接或间接依赖sources的公式（拓扑顺序），返回结果有变化的位置"""
+        formulas = self.formulas
+        # 找出受影响的位置，同时记录依赖边
+        edges: Dict[Position, List[Position]] = {}
+        seen = set(sources)
+        stack = list(seen)
+        while stack:
+            pos = stack.pop()
+            dependents = self.dependents_of(pos)
+            if dependents:
+                edges[pos] = dependents
+                for dependent in dependents:
+                    if dependent not in seen:
+                        seen.add(dependent)
+                        stack.append(dependent)
+
+        affected = [pos for pos in seen if pos in formulas]
+        pending = dict.fromkeys(affected, 0)
+        for pos in affected:
+            for dependent in edges.get(pos, ()):
+                pending[dependent] += 1
+
+        # 拓扑排序（Kahn算法）：所有前驱都计算完成的公式才计算
+        ready = [pos for pos, count in pending.items() if count == 0]
+        changed: Dict[Position, Any] = {}
+        evaluated = self._evaluate_ready(ready, pending, edges, changed)
+
+        # 剩余的公式在循环引用中，或依赖循环引用中的公式：循环中的公式结果为 #CIRC!，
+        # 之后依赖它们的公式照常计算（错误值随引用传递）
+        if evaluated < len(affected):
+            remaining = {pos for pos, count in pending.items() if count > 0}
+            ready = []
+            cycles = find_cycles(remaining, edges)
+            for pos in cycles:
+                self._set_value(pos, CYCLE_ERROR, changed)
+                for dependent in edges.get(pos, ()):
+                    if dependent in remaining and dependent not in cycles:
+                        pending[dependent] -= 1
+                        if pending[dependent] == 0:
+                            ready.append(dependent)
+            self._evaluate_ready(ready, pending, edges, changed)
+        self.last_recalc_count = len(affected)
+        return changed
+
+    def _evaluate_ready(self, ready: List[Position], pending: Dict[Position, int],
+                        edges: Dict[Position, List[Position]], changed: Dict[Position, Any]) -> int:
+        """按拓扑顺序计算ready中的公式及之后变为可计算的公式，返回计算的个数"""
+        formulas = self.formulas
+        evaluated = 0
+        while ready:
+            pos = ready.pop()
+            evaluated += 1
+            self._set_value(pos, self._evaluate(formulas[pos], pos), changed)
+            for dependent in edges.get(pos, ()):
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    ready.append(dependent)
+        return evaluated
+
+    def _set_value(self, pos: Position, value: Any, changed: Dict[Position, Any]):
+        old = self.values.get(pos, _MISSING)
+        if value.__class__ is not old.__class__ or value != old:
+            self.values[pos] = value
+            changed[pos] = value
+
+    def _evaluate(self, formula: Formula, pos: Position) -> Any:
+        try:
+            return normalize_result(formula.template.evaluate(self, *pos))
+        except EvalError as e:
+            return e.error
+        except ZeroDivisionError:
+            return DIV_ZERO
+        except (OverflowError, ValueError):
+            return NUM_ERROR
+        except (TypeError, IndexError):
+            return VALUE_ERROR
+
+    def cell_value(self, pos: Position) -> Any:
+        """公式中引用的单元格的值（公式单元格取计算结果）"""
+        if pos in self.formulas:
+            return self.values.get(pos)
+        cell = self.model.cells.get(pos)
+        if cell is None:
+            return None
+        value = cell.get("v")
+        return text_number(value) if value.__class__ is str else value
+
+    def range_values(self, r0: int, r1: int, c0: int, c1: int) -> List[Any]:
+        """区域中非空单元格的值（按行列顺序）"""
+        result = []
+        formulas, values, cells = self.formulas, self.values, self.model.cells
+        for pos in self.model._positions(r0, r1, c0, c1):
+            if pos in formulas:
+                result.append(values.get(pos))
+                continue
+            value = cells[pos].get("v")
+            if value is not None:
+                result.append(text_number(value) if value.__class__ is str else value)
+        return result
+
+    def values_in(self, r0: int, r1: int, c0: int, c1: int) -> Dict[str, Any]:
+        """区域内公式的计算结果: {"row_col": 值}"""
+        return {f"{row}_{col}": value for (row, col), value in self.values.items()
+                if r0 <= row <= r1 and c0 <= col <= c1}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """全部公式的计算结果: {"row_col": 值}"""
+        return {f"{row}_{col}": value for (row, col), value in self.values.items()}
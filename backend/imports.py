@@ -0,0 +1,107 @@
+"""表格导入 - 上传文件分块写入磁盘，后台解析并加载到内存模型
+
+上传的Excel文件以固定大小的块异步写入表格目录下的临时文件（不在内存中保留整个文件），
+之后在后台解析：xlsx引擎直接将临时文件移动到位，SQLite引擎转换后原子替换到位；
+解析结果直接构建内存模型，第一个打开表格的用户不需要再等待解析。解析失败时调用创建时
+传入的清理函数（删除密钥记录和不完整的表格文件），导入状态保留，可通过管理员接口查询失败原因。
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+from sheet_model import sheet_store
+from storage import import_sheet
+
+# 上传文件每次读取和写入的字节数
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class ImportManager:
+    """导入任务的状态和后台解析"""
+
+    def __init__(self):
+        # 导入状态: {sheet_key: {status, file_name, size, received, error, ...}}
+        # status: uploading（写入磁盘）/ parsing（后台解析）/ ready（已加载）/ failed（失败）
+        self.jobs: Dict[str, Dict] = {}
+        # 后台解析任务: {sheet_key: Task}
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def receive(self, sheet_key: str, upload: UploadFile, temp_path: str):
+        """将上传文件分块写入临时文件"""
+        job = self.jobs[sheet_key] = {
+            "status": "uploading",
+            "file_name": upload.filename,
+            "size": upload.size,
+            "received": 0,
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "error": None,
+        }
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await f.write(chunk)
+                    job["received"] += len(chunk)
+        except Exception as e:
+            self._fail(job, e)
+            raise
+
+    def start(self, sheet_key: str, temp_path: str, engine: str,
+              on_failure: Optional[Callable[[], Awaitable[None]]] = None):
+        """开始后台解析（文件移动或转换到位后加载为内存模型），失败时调用on_failure清理"""
+        job = self.jobs[sheet_key]
+        job["status"] = "parsing"
+        self.tasks[sheet_key] = asyncio.create_task(self._run(sheet_key, job, temp_path, engine, on_failure))
+
+    async def _run(self, sheet_key: str, job: Dict, temp_path: str, engine: str,
+                   on_failure: Optional[Callable[[], Awaitable[None]]]):
+        started = time.monotonic()
+        try:
+            model = await sheet_store.load_with(sheet_key, import_sheet, temp_path, sheet_key, engine)
+            job.update({
+                "status": "ready",
+                "finished_at": datetime.now().isoformat(),
+                "parse_ms": round((time.monotonic() - started) * 1000, 1),
+                "cell_count": len(model.cells),
+            })
+        except Exception as e:
+            print(f"导入表格失败 {sheet_key}: {e}")
+            self._fail(job, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            # 在等待导入的请求继续之前完成清理，之后打开该表格返回不存在
+            if on_failure is not None:
+                try:
+                    await on_failure()
+                except Exception as cleanup_error:
+                    print(f"清理导入失败的表格出错 {sheet_key}: {cleanup_error}")
+        finally:
+            self.tasks.pop(sheet_key, None)
+
+    @staticmethod
+    def _fail(job: Dict, error: Exception):
+        job.update({"status": "failed", "error": str(error), "finished_at": datetime.now().isoformat()})
+
+    async def wait(self, sheet_key: str):
+        """等待表格的后台解析完成（解析期间打开表格时调用）"""
+        task = self.tasks.get(sheet_key)
+        if task is not None:
+            await asyncio.wait({task})
+
+    def get(self, sheet_key: str) -> Optional[Dict]:
+        return self.jobs.get(sheet_key)
+
+    def forget(self, sheet_key: str):
+        self.jobs.pop(sheet_key, None)
+
+
+# 全局导入管理
+imports = ImportManager()
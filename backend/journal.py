@@ -0,0 +1,247 @@
+"""操作日志（journal）- 保证延迟保存期间的修改在崩溃后不丢失
+
+每条被接受的修改操作先追加到表格的journal（data/journal/{key}/{分段号}.jsonl，每行一条JSON），
+由后台定期批量fsync；延迟保存开始时切换到新分段，表格文件（快照）保存成功后删除旧分段。
+服务启动时将残留的journal按顺序重放到表格文件上；无法应用的操作跳过，连同错误信息保存到
+data/journal_failed/{key}.jsonl，整个表格恢复失败时journal目录移到data/journal_failed下，不影响启动。
+
+插入/删除行列等操作不是幂等的，不能重复重放：每条操作带有递增的journal序号，
+表格文件保存时在同一次写入中记录最后一条操作的序号，恢复时跳过序号不大于该值的操作
+（快照保存成功但旧分段尚未删除时崩溃也不会重复应用）。
+"""
+import asyncio
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+
+from database import DATA_DIR
+from serializer import dumps, loads
+from storage import read_journal_seq, save_operations
+from worker_pool import worker_pool
+
+JOURNAL_DIR = DATA_DIR / "journal"
+JOURNAL_DIR.mkdir(exist_ok=True)
+# 恢复时无法应用的操作
+FAILED_DIR = DATA_DIR / "journal_failed"
+
+
+def segment_path(sheet_key: str, segment: int) -> Path:
+    return JOURNAL_DIR / sheet_key / f"{segment:08d}.jsonl"
+
+
+def list_segments(sheet_key: str) -> List[int]:
+    """表格现有的journal分段号（升序）"""
+    sheet_dir = JOURNAL_DIR / sheet_key
+    if not sheet_dir.is_dir():
+        return []
+    return sorted(int(path.stem) for path in sheet_dir.glob("*.jsonl") if path.stem.isdigit())
+
+
+def read_segments(sheet_key: str) -> List[Tuple[int, Dict]]:
+    """按顺序读取表格所有journal分段中的操作: [(journal序号, 操作)]（忽略写入中断的最后一行）"""
+    entries = []
+    for segment in list_segments(sheet_key):
+        with open(segment_path(sheet_key, segment), "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    break
+                entries.append((entry["seq"], entry["op"]))
+    return entries
+
+
+def replay_segments(file_path: str, entries: List[Tuple[int, Dict]]) -> Tuple[int, List[Tuple[int, Dict, str]]]:
+    """将journal中尚未写入表格文件的操作写入，返回 (重放的操作数, 跳过的操作: [(序号, 操作, 错误)])
+
+    一次写入失败时逐条重放，跳过无法应用的操作。
+    """
+    saved_seq = read_journal_seq(file_path)
+    pending = [(seq, op) for seq, op in entries if seq > saved_seq]
+    if not pending:
+        return 0, []
+    try:
+        save_operations(file_path, [op for _, op in pending], pending[-1][0])
+        return len(pending), []
+    except Exception as e:
+        print(f"重放journal失败，逐条重放: {e}")
+
+    count = 0
+    skipped = []
+    for seq, op in pending:
+        try:
+            save_operations(file_path, [op], seq)
+            count += 1
+        except Exception as e:
+            skipped.append((seq, op, str(e)))
+    return count, skipped
+
+
+def save_failed(sheet_key: str, skipped: List[Tuple[int, Dict, str]]):
+    """保存恢复时跳过的操作"""
+    FAILED_DIR.mkdir(exist_ok=True)
+    with open(FAILED_DIR / f"{sheet_key}.jsonl", "ab") as f:
+        for seq, op, error in skipped:
+            f.write(dumps({"seq": seq, "op": op, "error": error}) + b"\n")
+
+
+class SheetJournal:
+    """单个表格当前写入的journal分段"""
+
+    def __init__(self, sheet_key: str):
+        self.sheet_key = sheet_key
+        segments = list_segments(sheet_key)
+        self.segment = segments[-1] + 1 if segments else 1
+        self.handle: Optional[IO[bytes]] = None
+        self.fsync_task: Optional[asyncio.Task] = None
+
+    def open(self) -> IO[bytes]:
+        if self.handle is None:
+            path = segment_path(self.sheet_key, self.segment)
+            path.parent.mkdir(exist_ok=True)
+            self.handle = open(path, "ab")
+        return self.handle
+
+
+class OpJournal:
+    """所有表格的journal管理"""
+
+    def __init__(self):
+        self.sheets: Dict[str, SheetJournal] = {}
+        # 批量fsync的间隔（秒），崩溃时最多丢失这段时间内的修改
+        self.fsync_interval = 0.05
+        # 统计信息
+        self.appended = 0
+        self.fsyncs = 0
+        self.last_fsync_ms = 0.0
+
+    def append(self, sheet_key: str, op: Dict, seq: int):
+        """追加一条修改操作及其journal序号（写入系统缓冲区，稍后批量fsync）"""
+        journal = self.sheets.get(sheet_key)
+        if journal is None:
+            journal = self.sheets[sheet_key] = SheetJournal(sheet_key)
+        handle = journal.open()
+        handle.write(dumps({"seq": seq, "op": op}) + b"\n")
+        handle.flush()
+        self.appended += 1
+        if journal.fsync_task is None or journal.fsync_task.done():
+            journal.fsync_task = asyncio.create_task(self._fsync_later(handle))
+
+    async def _fsync_later(self, handle: IO[bytes]):
+        await asyncio.sleep(self.fsync_interval)
+        if handle.closed:
+            return
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, os.fsync, handle.fileno())
+        self.fsyncs += 1
+        self.last_fsync_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def rotate(self, sheet_key: str) -> Optional[Tuple[int, IO[bytes], Optional[asyncio.Task]]]:
+        """切换到新分段（之后的修改写入新分段），返回旧分段: (分段号, 文件句柄, fsync任务)
+
+        必须与取出待保存操作在同一步中调用（中间不能有await），保证旧分段中的操作都在本次保存中。
+        """
+        journal = self.sheets.get(sheet_key)
+        if journal is None or journal.handle is None:
+            return None
+        sealed = (journal.segment, journal.handle, journal.fsync_task)
+        journal.segment += 1
+        journal.handle = None
+        journal.fsync_task = None
+        return sealed
+
+    async def seal(self, sealed: Tuple[int, IO[bytes], Optional[asyncio.Task]]):
+        """等待旧分段写入磁盘并关闭"""
+        _, handle, fsync_task = sealed
+        if fsync_task is not None:
+            # 等待进行中的批量fsync结束，避免与关闭文件同时进行
+            await asyncio.gather(fsync_task, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._sync_and_close, handle)
+
+    @staticmethod
+    def _sync_and_close(handle: IO[bytes]):
+        handle.flush()
+        os.fsync(handle.fileno())
+        handle.close()
+
+    def remove_sealed(self, sheet_key: str):
+        """删除已切换出去的分段（其中的操作都已写入表格文件），保留当前写入的分段"""
+        journal = self.sheets.get(sheet_key)
+        for segment in list_segments(sheet_key):
+            if journal is None or segment < journal.segment:
+                segment_path(sheet_key, segment).unlink(missing_ok=True)
+
+    def discard(self, sheet_key: str):
+        """删除表格的全部journal（表格被删除时调用）"""
+        journal = self.sheets.pop(sheet_key, None)
+        if journal is not None:
+            if journal.fsync_task is not None:
+                journal.fsync_task.cancel()
+            if journal.handle is not None:
+                journal.handle.close()
+        shutil.rmtree(JOURNAL_DIR / sheet_key, ignore_errors=True)
+
+    def close_all(self):
+        """关闭所有分段文件（服务器关闭时，所有修改已保存后调用）"""
+        for journal in self.sheets.values():
+            if journal.fsync_task is not None:
+                journal.fsync_task.cancel()
+            if journal.handle is not None:
+                journal.handle.flush()
+                os.fsync(journal.handle.fileno())
+                journal.handle.close()
+                journal.handle = None
+        self.sheets.clear()
+
+    def pending_sheets(self) -> List[str]:
+        """有残留journal的表格（启动时需要恢复）"""
+        if not JOURNAL_DIR.is_dir():
+            return []
+        return sorted(path.name for path in JOURNAL_DIR.iterdir() if path.is_dir())
+
+    async def recover(self, file_paths: Dict[str, str]) -> Dict[str, int]:
+        """启动时将残留的journal重放到表格文件上，返回 {sheet_key: 重放的操作数}"""
+        recovered = {}
+        for sheet_key in self.pending_sheets():
+            file_path = file_paths.get(sheet_key)
+            if not file_path or not os.path.exists(file_path):
+                # 表格已被删除
+                self.discard(sheet_key)
+                continue
+            try:
+                loop = asyncio.get_running_loop()
+                entries = await loop.run_in_executor(None, read_segments, sheet_key)
+                if entries:
+                    count, skipped = await worker_pool.run(sheet_key, replay_segments, file_path, entries)
+                    if count:
+                        recovered[sheet_key] = count
+                    if skipped:
+                        save_failed(sheet_key, skipped)
+                        print(f"表格 {sheet_key} 有 {len(skipped)} 条修改无法恢复，已保存到 {FAILED_DIR}")
+            except Exception as e:
+                print(f"恢复表格 {sheet_key} 失败: {e}")
+                self.sheets.pop(sheet_key, None)
+                FAILED_DIR.mkdir(exist_ok=True)
+                shutil.move(str(JOURNAL_DIR / sheet_key), str(FAILED_DIR / f"{sheet_key}-{int(time.time())}"))
+                continue
+            self.discard(sheet_key)
+        return recovered
+
+    def get_stats(self) -> Dict:
+        return {
+            "fsync_interval_ms": round(self.fsync_interval * 1000),
+            "appended": self.appended,
+            "fsyncs": self.fsyncs,
+            "last_fsync_ms": self.last_fsync_ms,
+            "open_sheets": sum(1 for journal in self.sheets.values() if journal.handle is not None),
+        }
+
+
+# 全局journal
+journal = OpJournal()
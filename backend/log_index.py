@@ -0,0 +1,274 @@
+"""操作日志索引 - 按表格、用户、单元格区域和时间查询日志
+
+每条日志在SQLite索引（data/logs/index.db）中记录所在日期文件的字节偏移和长度，
+以及表格密钥、用户、操作涉及的单元格区域和时间，查询时只读取命中的行，不扫描整个日志文件。
+索引由日志写入线程在写入时同步维护，启动时补齐未建立索引的日志（包括已压缩的.gz文件）。
+"""
+import gzip
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from openpyxl.utils.cell import range_boundaries
+
+from database import LOGS_DIR
+from serializer import loads
+
+INDEX_PATH = LOGS_DIR / "index.db"
+
+# 单元格区域: (起始行, 结束行, 起始列, 结束列)，0索引，不涉及行或列时对应值为None
+CellBounds = Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+def cell_bounds(details: Dict) -> CellBounds:
+    """计算一条操作涉及的单元格区域"""
+    rows: List[int] = []
+    cols: List[int] = []
+    if "row" in details or "col" in details:
+        rows.append(details.get("row"))
+        cols.append(details.get("col"))
+    for update in details.get("updates") or ():
+        rows.append(update.get("row"))
+        cols.append(update.get("col"))
+    for name, target in (("r0", rows), ("r1", rows), ("c0", cols), ("c1", cols)):
+        if details.get(name) is not None:
+            target.append(details[name])
+    cols.extend(details.get("col_widths") or ())
+    rows.extend(details.get("row_heights") or ())
+
+    rows = [int(r) for r in rows if r is not None]
+    cols = [int(c) for c in cols if c is not None]
+    return (
+        min(rows) if rows else None, max(rows) if rows else None,
+        min(cols) if cols else None, max(cols) if cols else None,
+    )
+
+
+def parse_cell_range(text: str) -> CellBounds:
+    """解析Excel区域写法（如"F:F"、"A1:C10"、"3:5"、"B2"）为0索引的单元格区域"""
+    min_col, min_row, max_col, max_row = range_boundaries(text.strip().upper())
+
+    def zero_based(value: Optional[int]) -> Optional[int]:
+        return value - 1 if value is not None else None
+
+    return zero_based(min_row), zero_based(max_row), zero_based(min_col), zero_based(max_col)
+
+
+def connect(path=INDEX_PATH) -> sqlite3.Connection:
+    """打开索引数据库（不存在时创建表）"""
+    conn = sqlite3.connect(str(path), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS log_entries (
+            day TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            sheet_key TEXT,
+            user_id TEXT,
+            action TEXT,
+            r0 INTEGER,
+            r1 INTEGER,
+            c0 INTEGER,
+            c1 INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_log_entries_sheet ON log_entries (sheet_key, ts);
+        CREATE INDEX IF NOT EXISTS idx_log_entries_user ON log_entries (user_id, ts);
+        CREATE INDEX IF NOT EXISTS idx_log_entries_ts ON log_entries (ts);
+        CREATE TABLE IF NOT EXISTS log_files (
+            day TEXT PRIMARY KEY,
+            indexed_bytes INTEGER NOT NULL
+        );
+    """)
+    return conn
+
+
+def index_row(day: str, offset: int, length: int, entry: Dict) -> Tuple:
+    """生成一条日志的索引记录"""
+    r0, r1, c0, c1 = cell_bounds(entry.get("details") or {})
+    return (day, offset, length, entry.get("timestamp", ""), entry.get("sheet_key"),
+            entry.get("user_id"), entry.get("action"), r0, r1, c0, c1)
+
+
+class LogIndex:
+    """日志索引的写入端（只在日志写入线程中使用）"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        if self.conn is None:
+            self.conn = connect(self.path)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def add(self, day: str, offset: int, entries: List[Dict], lines: List[bytes]):
+        """为刚写入日志文件的一批记录建立索引，offset为第一条记录在文件中的位置"""
+        self.open()
+        rows = []
+        for entry, line in zip(entries, lines):
+            rows.append(index_row(day, offset, len(line), entry))
+            offset += len(line)
+        with self.conn:
+            self.conn.executemany("INSERT INTO log_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._set_indexed(day, offset)
+
+    def _set_indexed(self, day: str, indexed_bytes: int):
+        self.conn.execute(
+            "INSERT INTO log_files (day, indexed_bytes) VALUES (?, ?) "
+            "ON CONFLICT(day) DO UPDATE SET indexed_bytes = MAX(indexed_bytes, excluded.indexed_bytes)",
+            (day, indexed_bytes)
+        )
+
+    def catch_up(self):
+        """为尚未建立索引的日志补建索引，并清除日志文件已删除的日期"""
+        self.open()
+        indexed = dict(self.conn.execute("SELECT day, indexed_bytes FROM log_files").fetchall())
+        days = set()
+        for path in sorted(LOGS_DIR.glob("*.log*")):
+            name = path.name
+            if name.endswith(".log"):
+                day, compressed = name[:-4], False
+            elif name.endswith(".log.gz"):
+                day, compressed = name[:-7], True
+            else:
+                continue
+            days.add(day)
+            start = indexed.get(day, 0)
+            if compressed and day in indexed:
+                # 压缩文件不再写入，已有索引即完整
+                continue
+            if not compressed and os.path.getsize(path) <= start:
+                continue
+            try:
+                self._index_file(day, str(path), compressed, start)
+            except Exception as e:
+                print(f"建立日志索引失败: {name}: {e}")
+
+        removed = [day for day in indexed if day not in days]
+        if removed:
+            with self.conn:
+                for day in removed:
+                    self.conn.execute("DELETE FROM log_entries WHERE day = ?", (day,))
+                    self.conn.execute("DELETE FROM log_files WHERE day = ?", (day,))
+
+    def reindex_day(self, day: str, path: str, compressed: bool):
+        """重建某天日志的索引（日志文件内容合并后偏移改变时使用）"""
+        self.open()
+        with self.conn:
+            self.conn.execute("DELETE FROM log_entries WHERE day = ?", (day,))
+            self.conn.execute("DELETE FROM log_files WHERE day = ?", (day,))
+        self._index_file(day, path, compressed, 0)
+
+    def _index_file(self, day: str, path: str, compressed: bool, start: int):
+        rows = []
+        offset = start
+        opener = gzip.open if compressed else open
+        with opener(path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 最后一行不完整（写入中断），等下次补齐
+                    break
+                try:
+                    entry = loads(line)
+                    rows.append(index_row(day, offset, len(line), entry))
+                except ValueError:
+                    pass
+                offset += len(line)
+        with self.conn:
+            self.conn.executemany("INSERT INTO log_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._set_indexed(day, offset)
+
+
+def _read_entries(locations: List[Tuple[str, int, int]]) -> Dict[Tuple[str, int], Dict]:
+    """按(日期, 偏移, 长度)读取日志记录，每个日期文件只打开一次"""
+    result = {}
+    by_day: Dict[str, List[Tuple[int, int]]] = {}
+    for day, offset, length in locations:
+        by_day.setdefault(day, []).append((offset, length))
+
+    for day, items in by_day.items():
+        path = LOGS_DIR / f"{day}.log"
+        compressed = not path.exists()
+        if compressed:
+            path = LOGS_DIR / f"{day}.log.gz"
+            if not path.exists():
+                continue
+        opener = gzip.open if compressed else open
+        with opener(str(path), "rb") as f:
+            # 按偏移顺序读取（压缩文件只能向前高效定位）
+            for offset, length in sorted(items):
+                f.seek(offset)
+                try:
+                    result[(day, offset)] = loads(f.read(length))
+                except ValueError:
+                    pass
+    return result
+
+
+def query_logs(sheet_key: Optional[str] = None, user_id: Optional[str] = None,
+               action: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+               bounds: Optional[CellBounds] = None, page: int = 1, page_size: int = 50) -> Dict[str, Any]:
+    """按条件分页查询操作日志（最新的在前）
+
+    start/end为时间（"YYYY-MM-DD HH:MM:SS"，可只写日期或前缀），bounds为单元格区域，
+    其中为None的边界表示不限制。
+    """
+    conditions = []
+    params: List[Any] = []
+    if sheet_key:
+        conditions.append("sheet_key = ?")
+        params.append(sheet_key)
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if action:
+        conditions.append("action = ?")
+        params.append(action)
+    if start:
+        conditions.append("ts >= ?")
+        params.append(start)
+    if end:
+        # 只写到日期或分钟等前缀时包含整个时间段
+        conditions.append("ts <= ?")
+        params.append(end + "\uffff")
+    if bounds:
+        r0, r1, c0, c1 = bounds
+        if r0 is not None:
+            conditions.append("r1 >= ?")
+            params.append(r0)
+        if r1 is not None:
+            conditions.append("r0 <= ?")
+            params.append(r1)
+        if c0 is not None:
+            conditions.append("c1 >= ?")
+            params.append(c0)
+        if c1 is not None:
+            conditions.append("c0 <= ?")
+            params.append(c1)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    conn = connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM log_entries {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT day, offset, length FROM log_entries {where} "
+            f"ORDER BY ts DESC, rowid DESC LIMIT ? OFFSET ?",
+            params + [page_size, (page - 1) * page_size]
+        ).fetchall()
+    finally:
+        conn.close()
+
+    entries = _read_entries(rows)
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "entries": [entries[(day, offset)] for day, offset, _ in rows if (day, offset) in entries],
+    }
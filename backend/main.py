@@ -1,22 +1,40 @@
 """共享表格 - 多人共享编辑Excel表格 Web应用"""
 import os
 import uuid
+import asyncio
 import hashlib
+import json
 import socket
+import time
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Request, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 
-from database import init_db, get_db, SHEETS_DIR
+from database import init_db, close_db, get_db, sheet_key_cache, SHEETS_DIR, EXPORTS_DIR
 from models import AuthRequest, AuthResponse, SheetKeyCreate
-from excel_handler import create_empty_sheet, load_sheet_data, import_excel
 from websocket_manager import manager
+from sheet_model import SheetModel, sheet_store, file_epoch, make_etag
+from serializer import dumps, gzip_bytes
+from excel_handler import write_sheet_cells
+from worker_pool import worker_pool
+from storage import (
+    STORAGE_ENGINES, create_sheet, migrate_sheet,
+    remove_sheet_files, sheet_file_path, storage_engine,
+)
+from audit_log import audit_logger
+from journal import journal
+from imports import imports
+from log_index import parse_cell_range, query_logs
+from numeric_columns import AGGREGATE_OPS
+from table_ops import filter_rows, find_cells
+from snapshots import snapshots, list_snapshots, load_snapshot, diff_snapshots, delete_sheet_snapshots
 
 # 加载.env配置
 load_dotenv(Path(__file__).parent.parent / ".env")
@@ -24,6 +42,23 @@ ADMIN_KEY = os.getenv("ADMIN_KEY", "admin123456")
 SERVER_PORT = os.getenv("SERVER_PORT", "8000")
 HISTORY_COUNT = int(os.getenv("HISTORY_COUNT", "20"))
 SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "3000"))
+SAVE_INTERVAL = int(os.getenv("SAVE_INTERVAL", "2000"))
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", "1000"))
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))
+BROADCAST_TICK = int(os.getenv("BROADCAST_TICK", "30"))
+STREAM_MIN_CELLS = int(os.getenv("STREAM_MIN_CELLS", "20000"))
+WORKER_MODE = os.getenv("WORKER_MODE", "thread")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "0"))
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "xlsx").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+KEY_NEGATIVE_TTL = int(os.getenv("KEY_NEGATIVE_TTL", "60"))
+JOURNAL_FSYNC_INTERVAL = int(os.getenv("JOURNAL_FSYNC_INTERVAL", "50"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_INTERVAL = int(os.getenv("LOG_FLUSH_INTERVAL", "500"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "false").lower() in ("1", "true", "yes")
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "10"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "200"))
 IP_WHITELIST = os.getenv("IP_WHITELIST", "21.,127.0.0.1")
 SYSTEM_NAME = os.getenv("SYSTEM_NAME", "共享表格")
 AUTHOR_INFO = os.getenv("AUTHOR_INFO", "未知作者")
@@ -117,7 +152,22 @@ app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
 @app.on_event("startup")
 async def startup():
     """启动时初始化数据库"""
-    await init_db()
+    sheet_key_cache.negative_ttl = KEY_NEGATIVE_TTL
+    await init_db(DB_POOL_SIZE)
+    manager.save_interval = SAVE_INTERVAL / 1000
+    sheet_store.change_log_size = CHANGE_LOG_SIZE
+    manager.send_queue_size = SEND_QUEUE_SIZE
+    manager.broadcast_tick = BROADCAST_TICK / 1000
+    worker_pool.start(WORKER_MODE, WORKER_COUNT)
+    audit_logger.start(LOG_QUEUE_SIZE, LOG_FLUSH_INTERVAL / 1000, LOG_COMPRESS)
+    journal.fsync_interval = JOURNAL_FSYNC_INTERVAL / 1000
+    # 将上次异常退出时尚未保存的修改重放到表格文件
+    recovered = await journal.recover(
+        {key: entry["file_path"] for key, entry in sheet_key_cache.entries.items()}
+    )
+    for key, count in recovered.items():
+        print(f"已恢复表格 {key} 的 {count} 条未保存修改")
+    snapshots.start(SNAPSHOT_INTERVAL * 60, SNAPSHOT_KEEP)
     print("=" * 50)
     print(SYSTEM_NAME)
     print(f"v1.0  {AUTHOR_INFO}")
@@ -126,6 +176,19 @@ async def startup():
     print(f"IP白名单: {IP_WHITELIST}")
     print(f"前端目录: {FRONTEND_DIR}")
     print(f"数据目录: {SHEETS_DIR}")
+    print(f"工作池: {worker_pool.mode} x {worker_pool.max_workers}")
+    print(f"存储引擎: {STORAGE_ENGINE}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """关闭时保存所有未写入的修改"""
+    await snapshots.stop()
+    await manager.flush_all()
+    journal.close_all()
+    worker_pool.shutdown()
+    audit_logger.stop()
+    await close_db()
 
 
 # ==================== 页面路由 ====================
@@ -140,18 +203,9 @@ async def index():
 async def sheet_page(key: str):
     """通过密钥直接访问表格编辑器"""
     # 验证密钥是否有效
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT key FROM sheet_keys WHERE key = ?",
-            (key,)
-        )
-        row = await cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="表格不存在或密钥无效")
-        return FileResponse(FRONTEND_DIR / "editor.html")
-    finally:
-        await db.close()
+    if not await sheet_key_cache.get(key):
+        raise HTTPException(status_code=404, detail="表格不存在或密钥无效")
+    return FileResponse(FRONTEND_DIR / "editor.html")
 
 
 @app.get("/admin/{admin_key}", response_class=HTMLResponse)
@@ -178,10 +232,13 @@ async def get_config():
 
 
 @app.get("/api/sheet/{key}/history")
-async def get_sheet_history(key: str):
-    """获取表格的修改历史"""
-    history = manager.get_history(key, HISTORY_COUNT)
-    return {"history": history}
+async def get_sheet_history(key: str, since: Optional[int] = None):
+    """获取表格的修改历史（指定since时只返回序号大于since的记录，用于补齐遗漏）"""
+    if since is None:
+        history = manager.get_history(key, HISTORY_COUNT)
+    else:
+        history = manager.get_history_since(key, since)
+    return {"history": history, "seq": manager.history_seq.get(key, 0)}
 
 
 @app.post("/api/auth", response_model=AuthResponse)
@@ -198,81 +255,245 @@ async def authenticate_get(key: str):
 
 async def verify_key(key: str) -> AuthResponse:
     """验证密钥的核心逻辑"""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT key, name, file_path FROM sheet_keys WHERE key = ?",
-            (key,)
+    sheet = await sheet_key_cache.get(key)
+
+    if sheet:
+        return AuthResponse(
+            success=True,
+            message="验证成功",
+            sheet_name=sheet["name"],
+            token=key  # 简化处理，直接用key作为token
+        )
+    else:
+        return AuthResponse(
+            success=False,
+            message="密钥无效"
         )
-        row = await cursor.fetchone()
 
-        if row:
-            return AuthResponse(
-                success=True,
-                message="验证成功",
-                sheet_name=row["name"],
-                token=key  # 简化处理，直接用key作为token
-            )
-        else:
-            return AuthResponse(
-                success=False,
-                message="密钥无效"
-            )
-    finally:
-        await db.close()
 
+def accepts_gzip(request: Request) -> bool:
+    """客户端是否接受gzip压缩"""
+    return "gzip" in request.headers.get("Accept-Encoding", "")
 
-@app.get("/api/sheet/{key}")
-async def get_sheet(key: str):
-    """获取表格数据"""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT file_path FROM sheet_keys WHERE key = ?",
-            (key,)
-        )
-        row = await cursor.fetchone()
 
-        if not row:
-            raise HTTPException(status_code=404, detail="表格不存在")
+def json_response(request: Request, data, headers: Optional[dict] = None) -> Response:
+    """序列化JSON响应，客户端支持且数据超过GZIP_MIN_SIZE时gzip压缩"""
+    body = dumps(data)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if accepts_gzip(request) and len(body) >= GZIP_MIN_SIZE:
+        body = gzip_bytes(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
 
-        file_path = row["file_path"]
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="表格文件不存在")
 
-        sheet_data = load_sheet_data(file_path)
-        return sheet_data
-    finally:
-        await db.close()
+def etag_matches(request: Request, etag: str) -> bool:
+    """检查请求的If-None-Match是否与ETag一致"""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 
-@app.get("/api/sheet/{key}/export")
-async def export_sheet(key: str):
-    """导出Excel文件"""
-    db = await get_db()
+@app.get("/api/sheet/{key}")
+async def get_sheet(key: str, request: Request):
+    """获取表格数据（支持ETag条件请求，未变化时返回304）"""
+    # 上传的表格正在后台导入时等待导入完成（导入失败时密钥已被删除）
+    await imports.wait(key)
+    sheet = await sheet_key_cache.get(key)
+    if not sheet:
+        raise HTTPException(status_code=404, detail="表格不存在")
+
+    file_path = sheet["file_path"]
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="表格文件不存在")
+
+    # 模型未加载时用文件信息生成ETag，与加载后的初始版本一致，无需解析文件
+    model = sheet_store.peek(key)
+    etag = model.etag if model else make_etag(file_epoch(file_path), 0)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    model = await sheet_store.get(key, file_path)
+    encoding = "gzip" if accepts_gzip(request) else "identity"
+    headers = {"ETag": model.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    cached = model.get_cached_body(encoding)
+    if cached is None and len(model.cells) < STREAM_MIN_CELLS:
+        cached = model.render_body(encoding, GZIP_MIN_SIZE)
+    if cached is None:
+        # 大表格：分段序列化并流式输出，不在内存中生成完整JSON
+        if encoding == "gzip":
+            headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(model.stream_body(encoding), media_type="application/json", headers=headers)
+
+    used_encoding, body = cached
+    if used_encoding == "gzip":
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def get_sheet_model(key: str) -> SheetModel:
+    """根据密钥获取表格内存模型（未加载时从文件加载）"""
+    await imports.wait(key)
+    sheet = await sheet_key_cache.get(key)
+    if not sheet:
+        raise HTTPException(status_code=404, detail="表格不存在")
+
+    file_path = sheet["file_path"]
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="表格文件不存在")
+
+    return await sheet_store.get(key, file_path)
+
+
+@app.get("/api/sheet/{key}/changes")
+async def get_sheet_changes(key: str, request: Request, since: int, epoch: Optional[str] = None):
+    """获取某版本之后的增量修改（替代定时拉取整个表格）"""
+    model = await get_sheet_model(key)
+    changes = None if epoch and epoch != model.epoch else model.changes_since(since)
+    if changes is None:
+        # 版本过旧或模型已重新加载，需要重新获取完整数据
+        return {"epoch": model.epoch, "version": model.version, "resync": True}
+    return json_response(request, {"epoch": model.epoch, "version": model.version, "changes": changes})
+
+
+@app.get("/api/sheet/{key}/meta")
+async def get_sheet_meta(key: str):
+    """获取表格元数据（行列数等），前端可据此按可视区域分段加载"""
+    model = await get_sheet_model(key)
+    return model.get_meta()
+
+
+@app.get("/api/sheet/{key}/range")
+async def get_sheet_range(key: str, request: Request, r0: int, r1: int, c0: int, c1: int):
+    """获取矩形区域（含边界，0索引）内的单元格、合并单元格和列宽行高"""
+    if r0 < 0 or c0 < 0 or r1 < r0 or c1 < c0:
+        raise HTTPException(status_code=400, detail="区域参数无效")
+    model = await get_sheet_model(key)
+    return json_response(request, model.get_range(r0, r1, c0, c1))
+
+
+@app.get("/api/sheet/{key}/aggregate")
+async def aggregate_sheet(key: str, request: Request, c0: int, c1: Optional[int] = None,
+                          r0: int = 0, r1: Optional[int] = None, ops: Optional[str] = None,
+                          group_by: Optional[int] = None):
+    """汇总区域内每列的数字（count/sum/mean/min/max，ops逗号分隔，默认全部），
+    group_by为列号时按该列的值分组统计。r1省略时到最后一行，c1省略时只汇总c0列"""
+    c1 = c0 if c1 is None else c1
+    if r0 < 0 or c0 < 0 or c1 < c0 or (r1 is not None and r1 < r0) or (group_by is not None and group_by < 0):
+        raise HTTPException(status_code=400, detail="区域参数无效")
+    requested = [op.strip() for op in ops.split(",")] if ops else list(AGGREGATE_OPS)
+    unknown = [op for op in requested if op not in AGGREGATE_OPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支持的汇总方式: {','.join(unknown)}")
+
+    model = await get_sheet_model(key)
+    r1 = model.row_count - 1 if r1 is None else r1
+    started = time.perf_counter()
     try:
-        cursor = await db.execute(
-            "SELECT name, file_path FROM sheet_keys WHERE key = ?",
-            (key,)
-        )
-        row = await cursor.fetchone()
-
-        if not row:
-            raise HTTPException(status_code=404, detail="表格不存在")
-
-        file_path = row["file_path"]
-        file_name = row["name"]
+        result = model.columns.aggregate(r0, r1, c0, c1, requested, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result.update({
+        "epoch": model.epoch,
+        "version": model.version,
+        "range": {"r0": r0, "r1": r1, "c0": c0, "c1": c1},
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+    return json_response(request, result)
+
+
+@app.get("/api/sheet/{key}/filter")
+async def filter_sheet(key: str, request: Request, where: str, r0: int = 0, r1: Optional[int] = None):
+    """筛选行：where为JSON数组 [{"col", "op", "value"?}]，op为eq/ne/gt/ge/lt/le/contains/begins/ends/empty/nonempty，
+    返回r0到r1（省略时到最后一行）之间有数据且满足所有条件的行号"""
+    try:
+        predicates = json.loads(where)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="where 必须是JSON数组")
+    if not isinstance(predicates, list) or not all(isinstance(p, dict) for p in predicates):
+        raise HTTPException(status_code=400, detail="where 必须是JSON数组")
+    if r0 < 0 or (r1 is not None and r1 < r0):
+        raise HTTPException(status_code=400, detail="区域参数无效")
+
+    model = await get_sheet_model(key)
+    r1 = model.row_count - 1 if r1 is None else r1
+    started = time.perf_counter()
+    try:
+        rows = filter_rows(model, r0, r1, predicates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(request, {
+        "rows": rows,
+        "count": len(rows),
+        "epoch": model.epoch,
+        "version": model.version,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@app.get("/api/sheet/{key}/find")
+async def find_in_sheet(key: str, request: Request, q: str, match_case: bool = False, whole: bool = False,
+                        r0: Optional[int] = None, r1: Optional[int] = None,
+                        c0: Optional[int] = None, c1: Optional[int] = None):
+    """查找值中包含q（whole为真时等于q）的单元格，区域参数省略时为整个表格，返回 [[row, col], ...]"""
+    query = {"find": q, "match_case": match_case, "whole": whole}
+    query.update({name: value for name, value in (("r0", r0), ("r1", r1), ("c0", c0), ("c1", c1)) if value is not None})
+    model = await get_sheet_model(key)
+    started = time.perf_counter()
+    try:
+        result = find_cells(model, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result.update({
+        "epoch": model.epoch,
+        "version": model.version,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+    return json_response(request, result)
 
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="表格文件不存在")
 
-        return FileResponse(
-            file_path,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=f"{file_name}.xlsx"
-        )
-    finally:
-        await db.close()
+@app.get("/api/sheet/{key}/export")
+async def export_sheet(key: str, request: Request):
+    """导出Excel文件（按内存模型的当前版本生成，包括尚未保存的修改；支持ETag条件请求）"""
+    model = await get_sheet_model(key)
+    sheet = await sheet_key_cache.get(key)
+
+    etag = model.etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    export_path = await render_export(model)
+    return FileResponse(
+        export_path,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=f"{sheet['name']}.xlsx",
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+
+
+# 导出锁，同一表格同时只生成一个导出文件
+export_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def render_export(model: SheetModel) -> str:
+    """生成表格当前版本的xlsx文件（按模型标识和版本号缓存，表格未修改时直接复用），返回文件路径"""
+    key = model.sheet_key
+    lock = export_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # 取得锁后再确定版本，等待期间的修改包含在本次生成的文件中
+        export_path = EXPORTS_DIR / f"{key}-{model.epoch}-{model.version}.xlsx"
+        if not export_path.exists():
+            fields = model.sheet_fields()
+            cells = list(model.cells.items())
+            temp_path = EXPORTS_DIR / f"temp_{uuid.uuid4()}.xlsx"
+            await worker_pool.run(key, write_sheet_cells, fields, cells, str(temp_path))
+            for old_path in EXPORTS_DIR.glob(f"{key}-*.xlsx"):
+                old_path.unlink(missing_ok=True)
+            os.replace(temp_path, export_path)
+    return str(export_path)
 
 
 # ==================== 管理员API ====================
@@ -289,8 +510,7 @@ async def verify_admin_key(key: str):
 @app.get("/api/admin/keys")
 async def list_keys():
     """列出所有密钥"""
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT key, name, file_path, created_at, updated_at FROM sheet_keys ORDER BY created_at DESC"
         )
@@ -302,13 +522,13 @@ async def list_keys():
                 "key": row["key"],
                 "name": row["name"],
                 "file_path": row["file_path"],
+                "storage": storage_engine(row["file_path"]),
                 "created_at": row["created_at"],
                 "updated_at": row["updated_at"],
-                "online_users": online_count
+                "online_users": online_count,
+                "import_status": (imports.get(row["key"]) or {}).get("status")
             })
         return {"keys": keys}
-    finally:
-        await db.close()
 
 
 @app.post("/api/admin/keys")
@@ -318,47 +538,57 @@ async def create_key(
     file: Optional[UploadFile] = File(None)
 ):
     """创建新密钥"""
-    db = await get_db()
-    try:
-        # 生成密钥
-        if not key:
-            key = str(uuid.uuid4())[:8].upper()
-
-        # 检查密钥是否已存在
-        cursor = await db.execute("SELECT key FROM sheet_keys WHERE key = ?", (key,))
-        if await cursor.fetchone():
-            raise HTTPException(status_code=400, detail="密钥已存在")
-
-        # 创建Excel文件
-        if file:
-            # 上传的文件
-            temp_path = SHEETS_DIR / f"temp_{uuid.uuid4()}.xlsx"
-            content = await file.read()
-            with open(temp_path, "wb") as f:
-                f.write(content)
-            file_path = import_excel(str(temp_path), key)
-            os.remove(temp_path)
-        else:
-            # 创建空白表格
-            file_path = create_empty_sheet(key)
-
-        # 保存到数据库
+    # 生成密钥
+    if not key:
+        key = str(uuid.uuid4())[:8].upper()
+
+    # 检查密钥是否已存在
+    if await sheet_key_cache.get(key):
+        raise HTTPException(status_code=400, detail="密钥已存在")
+
+    # 创建表格文件（按STORAGE_ENGINE配置使用xlsx文件或SQLite单元格存储）
+    if file:
+        # 上传的文件分块写入表格目录下的临时文件（不占用数据库连接），之后在后台解析并移动到位
+        temp_path = str(SHEETS_DIR / f"temp_{uuid.uuid4()}.xlsx")
+        try:
+            await imports.receive(key, file, temp_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        file_path = sheet_file_path(key, STORAGE_ENGINE)
+    else:
+        # 创建空白表格
+        file_path = await worker_pool.run(key, create_sheet, key, STORAGE_ENGINE)
+
+    # 保存到数据库
+    async with get_db() as db:
         await db.execute(
             "INSERT INTO sheet_keys (key, name, file_path) VALUES (?, ?, ?)",
             (key, name, file_path)
         )
         await db.commit()
+    sheet_key_cache.put(key, name, file_path)
+    if file:
+        imports.start(key, temp_path, STORAGE_ENGINE, on_failure=partial(remove_failed_import, key, file_path))
+
+    return {"success": True, "key": key, "name": name, "import": imports.get(key)}
 
-        return {"success": True, "key": key, "name": name}
-    finally:
-        await db.close()
+
+async def remove_failed_import(key: str, file_path: str):
+    """上传的表格解析失败后删除密钥记录和不完整的表格文件（导入状态保留，可查询失败原因）"""
+    async with get_db() as db:
+        await db.execute("DELETE FROM sheet_keys WHERE key = ?", (key,))
+        await db.commit()
+    sheet_key_cache.invalidate(key)
+    remove_sheet_files(file_path)
+    remove_sheet_files(f"{file_path}.import")
 
 
 @app.delete("/api/admin/keys/{key}")
 async def delete_key(key: str):
     """删除密钥"""
-    db = await get_db()
-    try:
+    async with get_db() as db:
         # 获取文件路径
         cursor = await db.execute(
             "SELECT file_path FROM sheet_keys WHERE key = ?",
@@ -371,16 +601,101 @@ async def delete_key(key: str):
 
         # 删除文件
         file_path = row["file_path"]
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await imports.wait(key)
+        imports.forget(key)
+        manager.discard_sheet(key)
+        remove_sheet_files(file_path)
+        for export_path in EXPORTS_DIR.glob(f"{key}-*.xlsx"):
+            export_path.unlink(missing_ok=True)
+        await worker_pool.run(key, delete_sheet_snapshots, key)
 
         # 删除数据库记录
         await db.execute("DELETE FROM sheet_keys WHERE key = ?", (key,))
         await db.commit()
+        sheet_key_cache.invalidate(key)
 
         return {"success": True}
-    finally:
-        await db.close()
+
+
+@app.post("/api/admin/keys/{key}/migrate")
+async def migrate_key(key: str, engine: str = Form(...)):
+    """将表格迁移到另一种存储引擎（xlsx或sqlite），需在没有用户在线时进行"""
+    engine = engine.lower()
+    if engine not in STORAGE_ENGINES:
+        raise HTTPException(status_code=400, detail=f"不支持的存储引擎: {engine}")
+
+    sheet = await sheet_key_cache.get(key)
+    if not sheet:
+        raise HTTPException(status_code=404, detail="密钥不存在")
+
+    old_path = sheet["file_path"]
+    if storage_engine(old_path) == engine:
+        return {"success": True, "key": key, "storage": engine, "file_path": old_path}
+    if manager.get_online_users(key):
+        raise HTTPException(status_code=409, detail="表格正在编辑中，请在所有用户离开后再迁移")
+
+    # 先写入尚未保存的修改，再转换文件
+    await manager.flush(key)
+    file_path = await worker_pool.run(key, migrate_sheet, old_path, key, engine)
+
+    async with get_db() as db:
+        await db.execute(
+            "UPDATE sheet_keys SET file_path = ?, updated_at = CURRENT_TIMESTAMP WHERE key = ?",
+            (file_path, key)
+        )
+        await db.commit()
+    sheet_key_cache.put(key, sheet["name"], file_path)
+    manager.discard_sheet(key)
+    remove_sheet_files(old_path)
+
+    return {"success": True, "key": key, "storage": engine, "file_path": file_path}
+
+
+@app.get("/api/admin/keys/{key}/import")
+async def get_key_import(key: str):
+    """获取上传表格的导入进度（已写入字节数、解析状态、失败原因）"""
+    job = imports.get(key)
+    if job is None:
+        raise HTTPException(status_code=404, detail="没有该表格的导入记录")
+    return job
+
+
+@app.get("/api/admin/keys/{key}/snapshots")
+async def get_key_snapshots(key: str):
+    """列出表格的历史版本（最新的在前）"""
+    if not await sheet_key_cache.get(key):
+        raise HTTPException(status_code=404, detail="密钥不存在")
+    return {"snapshots": await worker_pool.run(key, list_snapshots, key)}
+
+
+@app.post("/api/admin/keys/{key}/snapshots")
+async def create_key_snapshot(key: str, label: Optional[str] = Form(None)):
+    """为表格当前状态（包括尚未保存的修改）创建一个版本"""
+    model = await get_sheet_model(key)
+    snapshot = await snapshots.create(model, label or "手动", force=True)
+    return {"success": True, "snapshot": snapshot}
+
+
+@app.get("/api/admin/keys/{key}/snapshots/diff")
+async def diff_key_snapshots(key: str, old: int, new: int):
+    """对比两个版本（old -> new）的单元格和表格属性差异"""
+    diff = await worker_pool.run(key, diff_snapshots, key, old, new)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="版本不存在")
+    return diff
+
+
+@app.post("/api/admin/keys/{key}/snapshots/{snapshot_id}/restore")
+async def restore_key_snapshot(key: str, snapshot_id: int):
+    """将表格恢复到某个版本，在线用户会自动重新加载；恢复前的状态另存为一个版本"""
+    model = await get_sheet_model(key)
+    data = await worker_pool.run(key, load_snapshot, key, snapshot_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="版本不存在")
+
+    await snapshots.create(model, "恢复前")
+    model = await manager.restore_sheet(key, model.file_path, data)
+    return {"success": True, "key": key, "snapshot_id": snapshot_id, "epoch": model.epoch}
 
 
 @app.get("/api/admin/keys/{key}/users")
@@ -390,25 +705,53 @@ async def get_key_users(key: str):
     return {"users": users}
 
 
+@app.get("/api/admin/persistence")
+async def get_persistence_stats():
+    """获取各表格的保存状态（待写入操作数、保存延迟），用于调整SAVE_INTERVAL"""
+    return {
+        "save_interval": SAVE_INTERVAL,
+        "workers": worker_pool.get_stats(),
+        "journal": journal.get_stats(),
+        "sheets": manager.get_persistence_stats()
+    }
+
+
+@app.get("/api/admin/logs")
+async def search_logs(sheet_key: Optional[str] = None, user_id: Optional[str] = None,
+                      action: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                      cells: Optional[str] = None, page: int = 1, page_size: int = 50):
+    """按表格、用户、操作类型、单元格区域（如F:F、A1:C10）和时间段分页查询操作日志（最新的在前）"""
+    bounds = None
+    if cells:
+        try:
+            bounds = parse_cell_range(cells)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"单元格区域格式错误: {cells}")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+    return await worker_pool.run(
+        "__logs__", query_logs, sheet_key, user_id, action, start, end, bounds, page, page_size
+    )
+
+
+@app.get("/api/admin/logs/stats")
+async def get_audit_log_stats():
+    """获取操作日志写入状态（队列深度、丢弃记录数），磁盘较慢时用于调整LOG_QUEUE_SIZE"""
+    return audit_logger.get_stats()
+
+
 # ==================== WebSocket ====================
 
 @app.websocket("/ws/{key}")
 async def websocket_endpoint(websocket: WebSocket, key: str):
     """WebSocket连接端点"""
-    # 验证密钥
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT file_path FROM sheet_keys WHERE key = ?",
-            (key,)
-        )
-        row = await cursor.fetchone()
-        if not row:
-            await websocket.close(code=4001, reason="无效的密钥")
-            return
-        file_path = row["file_path"]
-    finally:
-        await db.close()
+    # 验证密钥（上传的表格正在后台导入时先等待导入完成）
+    await imports.wait(key)
+    sheet = await sheet_key_cache.get(key)
+    if not sheet:
+        await websocket.close(code=4001, reason="无效的密钥")
+        return
+    file_path = sheet["file_path"]
 
     # 获取客户端信息
     client = websocket.client
@@ -428,8 +771,10 @@ async def websocket_endpoint(websocket: WebSocket, key: str):
             message = await websocket.receive_text()
             await manager.process_message(key, user_id, message)
     except WebSocketDisconnect:
-        await manager.notify_disconnect(key, user_id)
-        manager.disconnect(key, user_id)
+        # 同一用户已在新连接上重新连接时，旧连接断开不做处理
+        if manager.is_current_connection(key, user_id, websocket):
+            await manager.notify_disconnect(key, user_id)
+            manager.disconnect(key, user_id)
 
 
 # ==================== 启动入口 ====================
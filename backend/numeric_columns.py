@@ -0,0 +1,266 @@
+"""数值列 - 表格中的数字按列保存在NumPy数组中，用于服务端汇总统计
+
+每列一个float64数组（下标为行号）和一个有效标记数组，数字、数字形式的文本和公式的数字结果
+为有效值。首次汇总时从内存模型构建，之后随单元格修改和公式重算增量更新；插入/删除行列后
+丢弃，下次汇总时重新构建。用作分组的列另外保存每行的分组编号（整数数组），同样增量更新。
+汇总（求和、平均、最小、最大、计数）和分组统计都是向量化计算。
+"""
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from formula import text_number
+
+AGGREGATE_OPS = ("count", "sum", "mean", "min", "max")
+
+# 单次汇总最多的列数和分组数
+MAX_AGGREGATE_COLUMNS = 256
+MAX_GROUPS = 10000
+
+
+def number_of(value: Any) -> Optional[float]:
+    """单元格的值作为数字（不是数字时返回None）"""
+    if value.__class__ is str:
+        value = text_number(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def group_key(value: Any) -> Any:
+    """分组的键：空值为None，数字（含数字形式的文本）统一为数字"""
+    if value is None or value == "":
+        return None
+    number = number_of(value)
+    if number is not None:
+        return int(number) if number.is_integer() else number
+    return value
+
+
+def _grow(array: np.ndarray, length: int) -> np.ndarray:
+    """扩大数组（至少到length，容量翻倍），新增部分为0"""
+    grown = np.zeros(max(length, len(array) * 2), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _pad(array: np.ndarray, length: int) -> np.ndarray:
+    """数组长度不足length时末尾补0"""
+    if len(array) < length:
+        return np.concatenate([array, np.zeros(length - len(array), dtype=array.dtype)])
+    return array
+
+
+class NumericColumn:
+    """单列的数值数组和有效标记"""
+
+    def __init__(self, rows: List[int], numbers: List[float]):
+        capacity = rows[-1] + 1 if rows else 0
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        if rows:
+            index = np.asarray(rows, dtype=np.int64)
+            self.values[index] = numbers
+            self.valid[index] = True
+
+    def set(self, row: int, number: Optional[float]):
+        if row >= len(self.values):
+            if number is None:
+                return
+            self.values, self.valid = _grow(self.values, row + 1), _grow(self.valid, row + 1)
+        if number is None:
+            self.valid[row] = False
+        else:
+            self.values[row] = number
+            self.valid[row] = True
+
+    def window(self, r0: int, r1: int) -> Tuple[np.ndarray, np.ndarray]:
+        """行r0到r1（含）的数值和有效标记，超出数组的部分补为无效"""
+        length = r1 - r0 + 1
+        return _pad(self.values[r0:r1 + 1], length), _pad(self.valid[r0:r1 + 1], length)
+
+
+class CategoryColumn:
+    """单列每行的分组编号（0为空单元格），用于按该列分组统计"""
+
+    def __init__(self):
+        self.codes = np.zeros(0, dtype=np.int32)
+        # 分组编号对应的键，以及键到编号的索引（已不再出现的键保留编号）
+        self.keys: List[Any] = [None]
+        self.index: Dict[Any, int] = {}
+
+    def set(self, row: int, key: Any):
+        code = 0
+        if key is not None:
+            code = self.index.get(key)
+            if code is None:
+                code = self.index[key] = len(self.keys)
+                self.keys.append(key)
+        if row >= len(self.codes):
+            if not code:
+                return
+            self.codes = _grow(self.codes, row + 1)
+        self.codes[row] = code
+
+    def window(self, r0: int, r1: int) -> np.ndarray:
+        return _pad(self.codes[r0:r1 + 1], r1 - r0 + 1)
+
+
+def summarize(values: np.ndarray, ops: Iterable[str]) -> Dict[str, Any]:
+    """一组数字的汇总结果"""
+    count = len(values)
+    result: Dict[str, Any] = {}
+    for op in ops:
+        if op == "count":
+            result[op] = count
+        elif op == "sum":
+            result[op] = float(values.sum())
+        elif not count:
+            result[op] = None
+        elif op == "mean":
+            result[op] = float(values.mean())
+        elif op == "min":
+            result[op] = float(values.min())
+        elif op == "max":
+            result[op] = float(values.max())
+    return result
+
+
+class NumericColumns:
+    """单个表格的数值列和分组列（所属的SheetModel首次汇总时构建）"""
+
+    def __init__(self, model):
+        self.model = model
+        # {列号: NumericColumn}，None表示尚未构建
+        self.columns: Optional[Dict[int, NumericColumn]] = None
+        # 作为分组列使用过的列: {列号: CategoryColumn}
+        self.categories: Dict[int, CategoryColumn] = {}
+
+    def cell_number(self, pos: Tuple[int, int]) -> Optional[float]:
+        """单元格的数值（不是数字时返回None）"""
+        return number_of(self.model.cell_value(pos))
+
+    def category(self, col: int) -> CategoryColumn:
+        """分组列的编号数组，首次使用时构建"""
+        category = self.categories.get(col)
+        if category is None:
+            category = self.categories[col] = CategoryColumn()
+            for pos in self.model._positions(0, self.model.row_count - 1, col, col):
+                category.set(pos[0], group_key(self.model.cell_value(pos)))
+        return category
+
+    def ensure(self) -> Dict[int, NumericColumn]:
+        if self.columns is None:
+            by_column: Dict[int, Tuple[List[int], List[float]]] = {}
+            for pos in self.model.cells:
+                number = self.cell_number(pos)
+                if number is not None:
+                    rows, numbers = by_column.setdefault(pos[1], ([], []))
+                    rows.append(pos[0])
+                    numbers.append(number)
+            columns = {}
+            for col, (rows, numbers) in by_column.items():
+                order = sorted(range(len(rows)), key=rows.__getitem__)
+                columns[col] = NumericColumn([rows[i] for i in order], [numbers[i] for i in order])
+            self.columns = columns
+        return self.columns
+
+    def update(self, positions: Iterable[Tuple[int, int]]):
+        """单元格的值或公式结果改变后更新（尚未构建时忽略）"""
+        if self.columns is None:
+            return
+        for pos in positions:
+            category = self.categories.get(pos[1])
+            if category is not None:
+                category.set(pos[0], group_key(self.model.cell_value(pos)))
+            number = self.cell_number(pos)
+            column = self.columns.get(pos[1])
+            if column is None:
+                if number is None:
+                    continue
+                column = self.columns[pos[1]] = NumericColumn([], [])
+            column.set(pos[0], number)
+
+    def reset(self):
+        """插入/删除行列后丢弃，下次汇总时重新构建"""
+        self.columns = None
+        self.categories = {}
+
+    def aggregate(self, r0: int, r1: int, c0: int, c1: int, ops: Iterable[str] = AGGREGATE_OPS,
+                  group_col: Optional[int] = None) -> Dict[str, Any]:
+        """汇总区域内每列的数字，group_col不为空时按该列的值分组统计"""
+        if c1 - c0 + 1 > MAX_AGGREGATE_COLUMNS:
+            raise ValueError(f"一次最多汇总{MAX_AGGREGATE_COLUMNS}列")
+        ops = [op for op in AGGREGATE_OPS if op in ops]
+        columns = self.ensure()
+        # 表格最后一行之后没有数据
+        r1 = min(r1, self.model.row_count - 1)
+        windows = {}
+        for col in range(c0, c1 + 1):
+            column = columns.get(col)
+            if column is not None and r1 >= r0:
+                windows[col] = column.window(r0, r1)
+
+        result: Dict[str, Any] = {
+            "columns": {
+                col: summarize(windows[col][0][windows[col][1]] if col in windows else np.empty(0), ops)
+                for col in range(c0, c1 + 1)
+            }
+        }
+        if group_col is not None:
+            result["groups"] = self._group(r0, r1, c0, c1, ops, group_col, windows)
+        return result
+
+    def _group(self, r0: int, r1: int, c0: int, c1: int, ops: List[str], group_col: int,
+               windows: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> List[Dict[str, Any]]:
+        model = self.model
+        category = self.category(group_col)
+        codes = category.window(r0, r1) if r1 >= r0 else np.zeros(0, dtype=np.int32)
+        key_count = len(category.keys)
+
+        # 每个分组的非空行数，只输出有行的分组
+        start = bisect.bisect_left(model.sorted_rows, r0)
+        end = bisect.bisect_right(model.sorted_rows, r1)
+        occupied = np.asarray(model.sorted_rows[start:end], dtype=np.int64) - r0
+        row_counts = np.bincount(codes[occupied], minlength=key_count)
+        present = np.flatnonzero(row_counts)
+        if len(present) > MAX_GROUPS:
+            raise ValueError(f"分组超过{MAX_GROUPS}个")
+
+        stats: Dict[int, Dict[str, np.ndarray]] = {}
+        for col, (values, valid) in windows.items():
+            group = codes[valid]
+            numbers = values[valid]
+            column_stats = {"count": np.bincount(group, minlength=key_count)}
+            if "sum" in ops or "mean" in ops:
+                column_stats["sum"] = np.bincount(group, weights=numbers, minlength=key_count)
+            if "min" in ops:
+                column_stats["min"] = np.full(key_count, np.inf)
+                np.minimum.at(column_stats["min"], group, numbers)
+            if "max" in ops:
+                column_stats["max"] = np.full(key_count, -np.inf)
+                np.maximum.at(column_stats["max"], group, numbers)
+            stats[col] = column_stats
+
+        groups = []
+        for code in present.tolist():
+            group_columns = {}
+            for col in range(c0, c1 + 1):
+                column_stats = stats.get(col)
+                count = int(column_stats["count"][code]) if column_stats else 0
+                entry: Dict[str, Any] = {}
+                for op in ops:
+                    if op == "count":
+                        entry[op] = count
+                    elif op == "sum":
+                        entry[op] = float(column_stats["sum"][code]) if count else 0.0
+                    elif not count:
+                        entry[op] = None
+                    elif op == "mean":
+                        entry[op] = float(column_stats["sum"][code] / count)
+                    else:
+                        entry[op] = float(column_stats[op][code])
+                group_columns[col] = entry
+            groups.append({"key": category.keys[code], "rows": int(row_counts[code]), "columns": group_columns})
+        return groups
@@ -0,0 +1,152 @@
+"""区域操作 - 矩形区域的批量修改和插入/删除行列
+
+WebSocket消息和修改操作格式（行列均为0索引）：
+    range_set    {"r0", "c0", "values": [[值, ...], ...], "style"?}  以(r0, c0)为左上角按二维数组写入值，
+                 可同时对整个区域应用样式
+    range_clear  {"r0", "r1", "c0", "c1", "formats"?}  清除区域内的值，formats为真时同时清除格式
+    range_style  {"r0", "r1", "c0", "c1", "style"}     对区域内每个单元格应用样式（保留值），
+                 最多MAX_STYLE_CELLS个单元格
+    insert_rows / delete_rows  {"at", "count"}  在第at行前插入 / 从第at行起删除count行
+    insert_cols / delete_cols  {"at", "count"}  同上，作用于列
+
+插入和删除行列时，之后的单元格、合并单元格、行高列宽随之移动，跨越插入位置的合并单元格扩大，
+与删除区域重叠的合并单元格缩小。内存模型和两种存储引擎都按本模块的规则计算。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from cell_ops import MAX_COLS, MAX_ROWS, cell_style, cell_value, non_negative_int
+
+RANGE_OP_TYPES = ("range_set", "range_clear", "range_style")
+STRUCTURE_OP_TYPES = ("insert_rows", "delete_rows", "insert_cols", "delete_cols")
+
+# 单个区域操作最多涉及的单元格数
+MAX_RANGE_CELLS = 200000
+# 设置格式的区域最多的单元格数：每个单元格都会写入内存模型和表格文件（包括原来不存在的空单元格），
+# 整行整列设置格式会使表格文件和之后的加载、快照都变得很大
+MAX_STYLE_CELLS = 20000
+# 单次最多插入或删除的行列数
+MAX_STRUCTURE_COUNT = 100000
+
+
+def normalize_op(op: Dict) -> Dict:
+    """校验区域操作并转换为规范格式（range_set补充r1、c1），格式错误时抛出ValueError"""
+    op_type = op.get("type")
+    if op_type in STRUCTURE_OP_TYPES:
+        axis, _ = structure_axis(op_type)
+        at = non_negative_int(op, "at", MAX_ROWS if axis == "row" else MAX_COLS)
+        count = non_negative_int(op, "count")
+        if not 0 < count <= MAX_STRUCTURE_COUNT:
+            raise ValueError(f"count 必须在1到{MAX_STRUCTURE_COUNT}之间")
+        return {"type": op_type, "at": at, "count": count}
+
+    r0 = non_negative_int(op, "r0")
+    c0 = non_negative_int(op, "c0")
+    if op_type == "range_set":
+        values = op.get("values")
+        if not isinstance(values, list) or not values or not all(isinstance(row, list) for row in values):
+            raise ValueError("values 必须是非空二维数组")
+        r1 = r0 + len(values) - 1
+        c1 = c0 + max(len(row) for row in values) - 1
+        if c1 < c0:
+            raise ValueError("values 不能全为空行")
+        values = [[cell_value(value) for value in row] for row in values]
+    else:
+        r1 = non_negative_int(op, "r1")
+        c1 = non_negative_int(op, "c1")
+        if r1 < r0 or c1 < c0:
+            raise ValueError("区域范围无效")
+    if r1 >= MAX_ROWS or c1 >= MAX_COLS:
+        raise ValueError(f"区域超出表格范围（{MAX_ROWS}行、{MAX_COLS}列）")
+
+    if (r1 - r0 + 1) * (c1 - c0 + 1) > MAX_RANGE_CELLS:
+        raise ValueError(f"区域超过{MAX_RANGE_CELLS}个单元格")
+
+    result: Dict[str, Any] = {"type": op_type, "r0": r0, "r1": r1, "c0": c0, "c1": c1}
+    if op_type == "range_set":
+        result["values"] = values
+        if op.get("style"):
+            result["style"] = cell_style(op["style"])
+    elif op_type == "range_clear":
+        result["formats"] = bool(op.get("formats"))
+    elif op_type == "range_style":
+        if not isinstance(op.get("style"), dict) or not op["style"]:
+            raise ValueError("style 不能为空")
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > MAX_STYLE_CELLS:
+            raise ValueError(f"一次最多对{MAX_STYLE_CELLS}个单元格设置格式")
+        result["style"] = op["style"]
+    else:
+        raise ValueError(f"未知操作类型: {op_type}")
+    return result
+
+
+def iter_range_values(op: Dict):
+    """range_set中的每个单元格: (row, col, value)，二维数组中较短的行不写入缺少的单元格"""
+    r0, c0 = op["r0"], op["c0"]
+    for i, row_values in enumerate(op["values"]):
+        for j, value in enumerate(row_values):
+            yield r0 + i, c0 + j, value
+
+
+def structure_axis(op_type: str) -> Tuple[str, bool]:
+    """插入/删除操作作用的方向和是否为插入: ("row" | "col", insert)"""
+    return ("row" if op_type.endswith("rows") else "col"), op_type.startswith("insert")
+
+
+def shift_index(index: int, at: int, count: int, insert: bool) -> Optional[int]:
+    """插入/删除后行号（列号）的新位置，被删除时返回None"""
+    if index < at:
+        return index
+    if insert:
+        return index + count
+    if index < at + count:
+        return None
+    return index - count
+
+
+def shift_span(start: int, end: int, at: int, count: int, insert: bool) -> Optional[Tuple[int, int]]:
+    """插入/删除后区间[start, end]的新位置，整个区间被删除时返回None"""
+    if insert:
+        return (start + count if start >= at else start), (end + count if end >= at else end)
+    removed_end = at + count - 1
+    new_start = start if start < at else (start - count if start > removed_end else at)
+    new_end = end if end < at else (end - count if end > removed_end else at - 1)
+    if new_end < new_start:
+        return None
+    return new_start, new_end
+
+
+def shift_merges(merges: List[Dict], op: Dict) -> List[Dict]:
+    """插入/删除行列后的合并单元格（缩小到单个单元格的合并被移除）"""
+    axis, insert = structure_axis(op["type"])
+    start_key, end_key = ("startRow", "endRow") if axis == "row" else ("startColumn", "endColumn")
+    result = []
+    for merge in merges:
+        span = shift_span(merge[start_key], merge[end_key], op["at"], op["count"], insert)
+        if span is None:
+            continue
+        merge = dict(merge, **{start_key: span[0], end_key: span[1]})
+        if merge["startRow"] == merge["endRow"] and merge["startColumn"] == merge["endColumn"]:
+            continue
+        result.append(merge)
+    return result
+
+
+def shift_sizes(sizes: Dict[int, int], op: Dict) -> Dict[int, int]:
+    """插入/删除行列后的行高（列宽）: {索引: 像素}"""
+    _, insert = structure_axis(op["type"])
+    result = {}
+    for index, size in sizes.items():
+        new_index = shift_index(int(index), op["at"], op["count"], insert)
+        if new_index is not None:
+            result[new_index] = size
+    return result
+
+
+def op_log_details(op: Dict) -> Dict:
+    """写入操作日志的内容（含涉及的单元格区域，用于按区域查询）"""
+    details = {k: v for k, v in op.items() if k != "type"}
+    if op["type"] in STRUCTURE_OP_TYPES:
+        axis, _ = structure_axis(op["type"])
+        first, last = op["at"], op["at"] + op["count"] - 1
+        details.update({"r0": first, "r1": last} if axis == "row" else {"c0": first, "c1": last})
+    return details
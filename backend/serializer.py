@@ -0,0 +1,79 @@
+"""JSON序列化 - HTTP响应和WebSocket消息统一使用
+
+优先使用orjson（更快，直接输出UTF-8字节），未安装时回退到标准库json。
+"""
+import json
+import zlib
+from datetime import date, datetime, time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+
+def json_default(value: Any) -> Any:
+    """JSON序列化无法直接处理的单元格值（日期时间等）"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        """序列化为JSON字节（UTF-8）"""
+        return orjson.dumps(obj, default=json_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        """序列化为JSON字节（UTF-8）"""
+        return json.dumps(obj, ensure_ascii=False, default=json_default,
+                          separators=(",", ":")).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_text(obj: Any) -> str:
+    """序列化为JSON字符串（用于WebSocket文本帧）"""
+    return dumps(obj).decode("utf-8")
+
+
+def iter_json_object(fields: List[Tuple[str, Any]], stream_key: str,
+                     stream_items: Iterable[Tuple[str, Any]], chunk_size: int = 2000) -> Iterator[bytes]:
+    """分段输出JSON对象：fields为普通字段，stream_key对应的字典按chunk_size条一段逐步序列化"""
+    yield b"{"
+    for name, value in fields:
+        yield dumps(name) + b":" + dumps(value) + b","
+    yield dumps(stream_key) + b":{"
+
+    first = True
+    chunk: Dict[str, Any] = {}
+    for key, value in stream_items:
+        chunk[key] = value
+        if len(chunk) >= chunk_size:
+            yield (b"" if first else b",") + dumps(chunk)[1:-1]
+            first = False
+            chunk = {}
+    if chunk:
+        yield (b"" if first else b",") + dumps(chunk)[1:-1]
+    yield b"}}"
+
+
+def gzip_bytes(data: bytes, level: int = 6) -> bytes:
+    """gzip压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """流式gzip压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
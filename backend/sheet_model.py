@@ -0,0 +1,408 @@
+"""表格内存模型 - 服务端持有的权威表格数据
+
+每个表格首次访问时从表格文件（Excel或SQLite单元格存储）加载一次，之后所有读取和修改都在内存中进行，
+表格文件只作为持久化产物。
+"""
+import asyncio
+import bisect
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from excel_handler import KEEP_VALUE, next_cell_state
+from formula import FormulaEngine
+from numeric_columns import NumericColumns
+from range_ops import STRUCTURE_OP_TYPES, iter_range_values, shift_index, shift_merges, shift_sizes, structure_axis
+from serializer import dumps, gzip_bytes, gzip_chunks, iter_json_object
+from storage import load_sheet
+from table_ops import ColumnIndexes, iter_sorted_positions
+from worker_pool import worker_pool
+
+_MISSING = object()
+
+
+def file_epoch(file_path: str) -> str:
+    """根据文件修改时间和大小生成模型实例标识"""
+    stat = os.stat(file_path)
+    return f"{stat.st_mtime_ns:x}{stat.st_size:x}"
+
+
+def make_etag(epoch: str, version: int) -> str:
+    """生成表格数据的ETag（模型标识+版本号）"""
+    return f'"{epoch}-{version}"'
+
+
+class SheetModel:
+    """单个表格的内存模型（单元格、样式、合并单元格、列宽行高）"""
+
+    def __init__(self, sheet_key: str, file_path: str, data: Dict[str, Any],
+                 epoch: str = "", change_log_size: int = 1000):
+        self.sheet_key = sheet_key
+        self.file_path = file_path
+        # 模型实例标识（加载时文件的修改时间和大小），重新加载后版本号从0开始
+        self.epoch = epoch
+        # 版本号，每应用一条修改操作加1
+        self.version = 0
+        # 最近的修改记录: [(version, op)]，超出容量的旧记录自动丢弃
+        self.changes: Deque[Tuple[int, Dict]] = deque(maxlen=change_log_size)
+        # 序列化缓存: {请求的编码: (version, 实际编码, 响应字节)}
+        self._body_cache: Dict[str, Tuple[int, str, bytes]] = {}
+        self.name = data.get("name", "Sheet1")
+        # 单元格: {(row, col): {"v": 值, "t": 类型, ...样式}}，0索引
+        self.cells: Dict[Tuple[int, int], Dict] = {}
+        # 行索引: {row: {col, ...}}，以及有单元格的行号（有序），用于按区域查询
+        self.row_index: Dict[int, Set[int]] = {}
+        self.sorted_rows: List[int] = []
+        for cell_key, cell in data.get("cellData", {}).items():
+            row, col = cell_key.split("_")
+            self.cells[(int(row), int(col))] = cell
+            self.row_index.setdefault(int(row), set()).add(int(col))
+        self.sorted_rows = sorted(self.row_index)
+        self.merges: List[Dict] = list(data.get("mergeData", []))
+        self.col_widths: Dict[int, int] = {int(k): v for k, v in data.get("columnData", {}).items()}
+        self.row_heights: Dict[int, int] = {int(k): v for k, v in data.get("rowData", {}).items()}
+        self.row_count = data.get("rowCount", 100)
+        self.column_count = data.get("columnCount", 26)
+        # 默认样式：不在cells中的单元格都使用此样式
+        self.default_style: Dict = data.get("defaultStyle") or {}
+        # 最后一条被接受的修改操作的journal序号（表格文件中记录已写入的序号，加载后从此继续）
+        self.journal_seq: int = data.get("journalSeq") or 0
+        # 公式计算结果和依赖关系
+        self.formulas = FormulaEngine(self)
+        self.formulas.rebuild()
+        # 数值列（首次汇总时构建）
+        self.columns = NumericColumns(self)
+        # 按列的排序/筛选索引（首次使用某列时构建）
+        self.indexes = ColumnIndexes(self)
+
+    def apply(self, op: Dict) -> Dict[str, Any]:
+        """应用一条修改操作（与WebSocket消息格式一致），返回计算结果有变化的公式: {"row_col": 值}
+
+        不再是公式的单元格值为None。插入/删除行列后公式整体重算，客户端重新获取数据，不返回变化；
+        排序后公式同样整体重算，返回与排序前相比有变化的位置。
+        """
+        op_type = op.get("type")
+        # 值被修改的单元格（需要重算依赖它们的公式）
+        touched: List[Tuple[int, int]] = []
+        formula_values = {}
+        if op_type == "cell_update":
+            self.set_cell(op["row"], op["col"], op.get("value"), op.get("style"))
+            touched.append((op["row"], op["col"]))
+        elif op_type in ("batch_update", "find_replace"):
+            for update in op.get("updates", []):
+                self.set_cell(update["row"], update["col"], update.get("value"), update.get("style"))
+                touched.append((update["row"], update["col"]))
+        elif op_type == "range_set":
+            for row, col, value in iter_range_values(op):
+                self.set_cell(row, col, value, op.get("style"))
+                touched.append((row, col))
+        elif op_type == "range_clear":
+            touched = list(self._positions(op["r0"], op["r1"], op["c0"], op["c1"]))
+            self.clear_range(op["r0"], op["r1"], op["c0"], op["c1"], op.get("formats", False))
+        elif op_type == "range_style":
+            for row in range(op["r0"], op["r1"] + 1):
+                for col in range(op["c0"], op["c1"] + 1):
+                    self.set_cell(row, col, KEEP_VALUE, op["style"])
+        elif op_type in STRUCTURE_OP_TYPES:
+            self.shift(op)
+            self.formulas.rebuild()
+            self.columns.reset()
+            self.indexes.reset()
+        elif op_type == "sort_range":
+            before = dict(self.formulas.values)
+            self.sort_rows(op)
+            self.formulas.rebuild()
+            self.columns.reset()
+            self.indexes.reset()
+            after = self.formulas.values
+            formula_values = {
+                f"{row}_{col}": after.get((row, col))
+                for row, col in before.keys() | after.keys()
+                if before.get((row, col), _MISSING) != after.get((row, col), _MISSING)
+            }
+        elif op_type == "dimension_update":
+            self.update_dimensions(op.get("col_widths"), op.get("row_heights"))
+        else:
+            raise ValueError(f"未知操作类型: {op_type}")
+
+        if touched:
+            changed = self.formulas.update(touched)
+            self.columns.update(touched)
+            self.columns.update(changed)
+            self.indexes.update(touched)
+            self.indexes.update(changed)
+            formula_values = {f"{row}_{col}": value for (row, col), value in changed.items()}
+
+        self.version += 1
+        # 修改记录中附带公式结果的变化，按增量同步的客户端同样能更新
+        self.changes.append((self.version, dict(op, formulaValues=formula_values) if formula_values else op))
+        return formula_values
+
+    def cell_value(self, pos: Tuple[int, int]) -> Any:
+        """单元格的值（公式单元格取计算结果）"""
+        if pos in self.formulas.formulas:
+            return self.formulas.values.get(pos)
+        cell = self.cells.get(pos)
+        return cell.get("v") if cell else None
+
+    def changes_since(self, since: int) -> Optional[List[Dict]]:
+        """获取某版本之后的修改操作，版本过旧（已不在修改记录中）时返回None"""
+        if since == self.version:
+            return []
+        if since > self.version:
+            return None
+        oldest = self.changes[0][0] if self.changes else self.version + 1
+        if since < oldest - 1:
+            return None
+        return [dict(op, version=version) for version, op in self.changes if version > since]
+
+    def set_cell(self, row: int, col: int, value: Any, style: Optional[Dict] = None):
+        """设置单元格的值和样式（value为KEEP_VALUE时只修改样式）"""
+        pos = (row, col)
+        old = self.cells.get(pos)
+        cell = next_cell_state(old, self.default_style, value, style)
+
+        if cell is not None:
+            self.cells[pos] = cell
+            if old is None:
+                self._index_add(row, col)
+        elif old is not None:
+            del self.cells[pos]
+            self._index_remove(row, col)
+
+        self.row_count = max(self.row_count, row + 1)
+        self.column_count = max(self.column_count, col + 1)
+
+    def clear_range(self, r0: int, r1: int, c0: int, c1: int, formats: bool = False):
+        """清除区域内的值，formats为真时连同格式一起清除"""
+        for row, col in list(self._positions(r0, r1, c0, c1)):
+            if formats:
+                del self.cells[(row, col)]
+                self._index_remove(row, col)
+            else:
+                self.set_cell(row, col, None)
+
+    def shift(self, op: Dict):
+        """插入/删除行列：移动之后的单元格、合并单元格和行高列宽"""
+        axis, insert = structure_axis(op["type"])
+        at, count = op["at"], op["count"]
+        cells = {}
+        for (row, col), cell in self.cells.items():
+            if axis == "row":
+                row = shift_index(row, at, count, insert)
+            else:
+                col = shift_index(col, at, count, insert)
+            if row is not None and col is not None:
+                cells[(row, col)] = cell
+        self.cells = cells
+        self.row_index = {}
+        for row, col in cells:
+            self.row_index.setdefault(row, set()).add(col)
+        self.sorted_rows = sorted(self.row_index)
+
+        self.merges = shift_merges(self.merges, op)
+        if axis == "row":
+            self.row_heights = shift_sizes(self.row_heights, op)
+            self.row_count = self.row_count + count if insert else max(self.row_count - count, 1)
+        else:
+            self.col_widths = shift_sizes(self.col_widths, op)
+            self.column_count = self.column_count + count if insert else max(self.column_count - count, 1)
+
+    def sort_rows(self, op: Dict):
+        """排序：按op["order"]移动区域内的单元格（区域外的单元格和行高不变）"""
+        r0, c0, c1 = op["r0"], op["c0"], op["c1"]
+        r1 = r0 + len(op["order"]) - 1
+        moves = list(iter_sorted_positions(op, self._positions(r0, r1, c0, c1)))
+        cells = [self.cells.pop((row, col)) for row, col, _ in moves]
+        for row, col, _ in moves:
+            self.row_index[row].discard(col)
+        for (_, col, new_row), cell in zip(moves, cells):
+            self.cells[(new_row, col)] = cell
+            self.row_index.setdefault(new_row, set()).add(col)
+        # 区域内的行可能变空或新出现，移动完成后统一整理行索引
+        for row in {row for row, _, _ in moves}:
+            if not self.row_index[row]:
+                del self.row_index[row]
+        self.sorted_rows = sorted(self.row_index)
+
+    def _index_add(self, row: int, col: int):
+        cols = self.row_index.get(row)
+        if cols is None:
+            cols = self.row_index[row] = set()
+            bisect.insort(self.sorted_rows, row)
+        cols.add(col)
+
+    def _index_remove(self, row: int, col: int):
+        cols = self.row_index[row]
+        cols.discard(col)
+        if not cols:
+            del self.row_index[row]
+            del self.sorted_rows[bisect.bisect_left(self.sorted_rows, row)]
+
+    def _positions(self, r0: int, r1: int, c0: int, c1: int) -> Iterator[Tuple[int, int]]:
+        """矩形区域（含边界）内已有单元格的位置，按行列顺序"""
+        start = bisect.bisect_left(self.sorted_rows, r0)
+        end = bisect.bisect_right(self.sorted_rows, r1)
+        span = c1 - c0 + 1
+        for row in self.sorted_rows[start:end]:
+            cols = self.row_index[row]
+            if span < len(cols):
+                row_cols = [col for col in range(c0, c1 + 1) if col in cols]
+            else:
+                row_cols = sorted(col for col in cols if c0 <= col <= c1)
+            for col in row_cols:
+                yield row, col
+
+    def get_range(self, r0: int, r1: int, c0: int, c1: int) -> Dict[str, Any]:
+        """获取与矩形区域（含边界，0索引）相交的单元格、合并单元格和列宽行高"""
+        cell_data = {f"{row}_{col}": self.cells[(row, col)] for row, col in self._positions(r0, r1, c0, c1)}
+
+        merges = [
+            merge for merge in self.merges
+            if merge["startRow"] <= r1 and merge["endRow"] >= r0
+            and merge["startColumn"] <= c1 and merge["endColumn"] >= c0
+        ]
+        col_widths = {col: width for col, width in self.col_widths.items() if c0 <= col <= c1}
+        row_heights = {row: height for row, height in self.row_heights.items() if r0 <= row <= r1}
+
+        return {
+            "id": self.sheet_key,
+            "epoch": self.epoch,
+            "version": self.version,
+            "range": {"r0": r0, "r1": r1, "c0": c0, "c1": c1},
+            "cellData": cell_data,
+            "mergeData": merges,
+            "columnData": col_widths,
+            "rowData": row_heights,
+            "formulaValues": self.formulas.values_in(r0, r1, c0, c1),
+        }
+
+    def get_meta(self) -> Dict[str, Any]:
+        """获取表格元数据（行列数、版本号等），用于前端按需分段加载"""
+        return {
+            "id": self.sheet_key,
+            "name": self.name,
+            "epoch": self.epoch,
+            "version": self.version,
+            "rowCount": self.row_count,
+            "columnCount": self.column_count,
+            "cellCount": len(self.cells),
+            "formulaCount": len(self.formulas.formulas),
+            "defaultStyle": self.default_style or None,
+        }
+
+    def update_dimensions(self, col_widths: Optional[Dict] = None, row_heights: Optional[Dict] = None):
+        """更新列宽和行高（像素）"""
+        if col_widths:
+            for col_idx, width in col_widths.items():
+                self.col_widths[int(col_idx)] = int(width)
+        if row_heights:
+            for row_idx, height in row_heights.items():
+                self.row_heights[int(row_idx)] = int(height)
+
+    @property
+    def etag(self) -> str:
+        return make_etag(self.epoch, self.version)
+
+    def get_cached_body(self, encoding: str) -> Optional[Tuple[str, bytes]]:
+        """获取当前版本已序列化的响应: (实际编码, 字节)，没有缓存时返回None"""
+        cached = self._body_cache.get(encoding)
+        if cached is None or cached[0] != self.version:
+            return None
+        return cached[1], cached[2]
+
+    def render_body(self, encoding: str, gzip_min_size: int = 1024) -> Tuple[str, bytes]:
+        """序列化当前版本的表格数据并缓存，encoding为gzip且数据不小于gzip_min_size时压缩"""
+        body = dumps(self.to_dict())
+        used = "identity"
+        if encoding == "gzip" and len(body) >= gzip_min_size:
+            body = gzip_bytes(body)
+            used = "gzip"
+        self._body_cache[encoding] = (self.version, used, body)
+        return used, body
+
+    def stream_body(self, encoding: str, chunk_size: int = 2000) -> Iterator[bytes]:
+        """分段序列化当前版本的表格数据（大表格使用，避免一次性生成整个JSON）"""
+        # 先取当前版本的快照（单元格字典写入后不再原地修改，只会被替换）
+        fields = list(self.sheet_fields().items())
+        items = [(f"{row}_{col}", cell) for (row, col), cell in self.cells.items()]
+        chunks = iter_json_object(fields, "cellData", items, chunk_size)
+        return gzip_chunks(chunks) if encoding == "gzip" else chunks
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为前端使用的表格数据格式（与load_sheet_data一致）"""
+        data = self.sheet_fields()
+        data["cellData"] = {f"{row}_{col}": cell for (row, col), cell in self.cells.items()}
+        return data
+
+    def sheet_fields(self) -> Dict[str, Any]:
+        """表格数据中除cellData以外的字段"""
+        return {
+            "id": self.sheet_key,
+            "name": self.name,
+            "epoch": self.epoch,
+            "version": self.version,
+            "mergeData": list(self.merges),
+            "columnData": dict(self.col_widths),
+            "rowData": dict(self.row_heights),
+            "rowCount": self.row_count,
+            "columnCount": self.column_count,
+            "defaultStyle": self.default_style or None,
+            "formulaValues": self.formulas.to_dict(),
+        }
+
+
+class SheetStore:
+    """内存表格模型仓库：按表格密钥缓存SheetModel，首次访问时加载"""
+
+    def __init__(self):
+        # {sheet_key: SheetModel}
+        self.models: Dict[str, SheetModel] = {}
+        # 加载锁，防止同一表格被并发重复加载
+        self.load_locks: Dict[str, asyncio.Lock] = {}
+        # 每个表格保留的修改记录条数，由main.py根据CHANGE_LOG_SIZE配置
+        self.change_log_size = 1000
+
+    async def get(self, sheet_key: str, file_path: str) -> SheetModel:
+        """获取表格模型，不存在时从Excel文件加载"""
+        model = self.models.get(sheet_key)
+        if model is not None:
+            return model
+
+        lock = self.load_locks.setdefault(sheet_key, asyncio.Lock())
+        async with lock:
+            model = self.models.get(sheet_key)
+            if model is None:
+                epoch = file_epoch(file_path)
+                data = await worker_pool.run(sheet_key, load_sheet, file_path)
+                model = SheetModel(sheet_key, file_path, data, epoch, self.change_log_size)
+                self.models[sheet_key] = model
+        return model
+
+    async def load_with(self, sheet_key: str, loader, *args) -> SheetModel:
+        """在工作池中执行loader(*args)（返回 (文件路径, 表格数据)）并构建表格模型，期间其他访问等待加载完成"""
+        lock = self.load_locks.setdefault(sheet_key, asyncio.Lock())
+        async with lock:
+            file_path, data = await worker_pool.run(sheet_key, loader, *args)
+            model = SheetModel(sheet_key, file_path, data, file_epoch(file_path), self.change_log_size)
+            self.models[sheet_key] = model
+        return model
+
+    def replace(self, sheet_key: str, file_path: str, data: Dict[str, Any]) -> SheetModel:
+        """用给定的表格数据替换内存模型（恢复历史版本后调用，文件须已写入相同数据）"""
+        model = SheetModel(sheet_key, file_path, data, file_epoch(file_path), self.change_log_size)
+        self.models[sheet_key] = model
+        return model
+
+    def peek(self, sheet_key: str) -> Optional[SheetModel]:
+        """获取已加载的表格模型（不触发加载）"""
+        return self.models.get(sheet_key)
+
+    def evict(self, sheet_key: str):
+        """从内存中移除表格模型"""
+        self.models.pop(sheet_key, None)
+        self.load_locks.pop(sheet_key, None)
+
+
+# 全局表格模型仓库
+sheet_store = SheetStore()
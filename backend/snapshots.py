@@ -0,0 +1,359 @@
+"""表格版本快照 - 按时间点保存表格，可列出、对比和恢复历史版本
+
+快照存放在 data/snapshots.db：单元格按行分块（每块CHUNK_ROWS行），每块按内容的SHA-256哈希存放一次，
+每个版本只记录各块的哈希和表格元数据（名称、合并单元格、列宽行高等）。
+未修改区域的块在各版本之间共享，一个版本只新增被修改的块；对比两个版本时哈希相同的块直接跳过。
+恢复时从块数据直接构建表格，不需要重新解析表格文件或重放修改。
+
+快照在以下时机自动创建（与上一版本内容相同时不新增）：表格加载后的第一次修改之前、
+编辑期间每隔SNAPSHOT_INTERVAL分钟、最后一位用户离开时；管理员也可以手动创建。
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from database import DATA_DIR
+from serializer import json_default, loads
+from sheet_model import SheetModel, sheet_store
+from worker_pool import worker_pool
+
+SNAPSHOT_DB = DATA_DIR / "snapshots.db"
+
+# 每个块包含的行数
+CHUNK_ROWS = 256
+
+# 对比结果中最多列出的单元格数
+DIFF_LIMIT = 1000
+
+# 快照保存的表格元数据字段（cellData以外）
+META_FIELDS = ("name", "mergeData", "columnData", "rowData", "rowCount", "columnCount", "defaultStyle")
+
+
+def connect() -> sqlite3.Connection:
+    """打开快照数据库（不存在时创建表）"""
+    conn = sqlite3.connect(str(SNAPSHOT_DB))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sheet_key TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            label TEXT,
+            version INTEGER,
+            cell_count INTEGER NOT NULL,
+            new_chunks INTEGER NOT NULL,
+            meta TEXT NOT NULL,
+            chunk_map TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_snapshots_sheet ON snapshots (sheet_key, id);
+        CREATE TABLE IF NOT EXISTS snapshot_chunks (
+            snapshot_id INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (snapshot_id, hash)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_snapshot_chunks_hash ON snapshot_chunks (hash);
+    """)
+    return conn
+
+
+def canonical(value: Any) -> bytes:
+    """规范JSON（键排序），相同内容得到相同字节和哈希"""
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+                      default=json_default).encode("utf-8")
+
+
+def build_chunks(cells: Iterable[Tuple[Tuple[int, int], Dict]]) -> Dict[int, bytes]:
+    """将单元格按行分块: {块号: 块内容（{"行_列": 单元格}的规范JSON）}"""
+    blocks: Dict[int, List[Tuple[Tuple[int, int], Dict]]] = {}
+    for pos, cell in cells:
+        blocks.setdefault(pos[0] // CHUNK_ROWS, []).append((pos, cell))
+    return {
+        block: canonical({f"{row}_{col}": cell for (row, col), cell in sorted(items, key=lambda item: item[0])})
+        for block, items in blocks.items()
+    }
+
+
+def _row_to_summary(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "sheet_key": row["sheet_key"],
+        "created_at": row["created_at"],
+        "label": row["label"],
+        "version": row["version"],
+        "cell_count": row["cell_count"],
+        "chunk_count": len(loads(row["chunk_map"])),
+        "new_chunks": row["new_chunks"],
+    }
+
+
+def save_snapshot(sheet_key: str, label: str, version: int, meta: Dict[str, Any],
+                  cells: List[Tuple[Tuple[int, int], Dict]], keep: int, force: bool = False) -> Optional[Dict]:
+    """保存一个版本快照，返回版本摘要；内容与最新版本相同且force为False时不保存，返回None
+
+    只写入数据库中还没有的块；超过keep个版本时删除最旧的版本和不再被引用的块。
+    """
+    chunks = build_chunks(cells)
+    hashes = {block: hashlib.sha256(data).hexdigest() for block, data in chunks.items()}
+    chunk_map = {str(block): hashes[block] for block in sorted(hashes)}
+    meta_text = canonical(meta).decode("utf-8")
+    chunk_map_text = json.dumps(chunk_map, separators=(",", ":"))
+
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        latest = conn.execute(
+            "SELECT meta, chunk_map FROM snapshots WHERE sheet_key = ? ORDER BY id DESC LIMIT 1", (sheet_key,)
+        ).fetchone()
+        if not force and latest and latest["meta"] == meta_text and latest["chunk_map"] == chunk_map_text:
+            return None
+
+        with conn:
+            existing = set()
+            unique_hashes = list(set(hashes.values()))
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                existing.update(row[0] for row in conn.execute(
+                    f"SELECT hash FROM chunks WHERE hash IN ({','.join('?' * len(batch))})", batch
+                ))
+            new_chunks = [(digest, gzip.compress(chunks[block], compresslevel=6))
+                          for block, digest in hashes.items() if digest not in existing]
+            conn.executemany("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)", new_chunks)
+
+            snapshot_id = conn.execute(
+                "INSERT INTO snapshots (sheet_key, created_at, label, version, cell_count, new_chunks, meta, chunk_map) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sheet_key, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), label, version,
+                 len(cells), len(new_chunks), meta_text, chunk_map_text)
+            ).lastrowid
+            conn.executemany("INSERT OR IGNORE INTO snapshot_chunks (snapshot_id, hash) VALUES (?, ?)",
+                             [(snapshot_id, digest) for digest in unique_hashes])
+
+            old_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM snapshots WHERE sheet_key = ? ORDER BY id DESC LIMIT -1 OFFSET ?", (sheet_key, keep)
+            )]
+            _delete_snapshots(conn, old_ids)
+
+        row = conn.execute("SELECT * FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        return _row_to_summary(row)
+    finally:
+        conn.close()
+
+
+def _delete_snapshots(conn: sqlite3.Connection, snapshot_ids: List[int]):
+    """删除版本，以及只被这些版本引用的块"""
+    for snapshot_id in snapshot_ids:
+        hashes = [row[0] for row in conn.execute(
+            "SELECT hash FROM snapshot_chunks WHERE snapshot_id = ?", (snapshot_id,)
+        )]
+        conn.execute("DELETE FROM snapshot_chunks WHERE snapshot_id = ?", (snapshot_id,))
+        conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+        conn.executemany(
+            "DELETE FROM chunks WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM snapshot_chunks WHERE hash = ?)",
+            [(digest, digest) for digest in hashes]
+        )
+
+
+def list_snapshots(sheet_key: str) -> List[Dict[str, Any]]:
+    """列出表格的所有版本（最新的在前）"""
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("SELECT * FROM snapshots WHERE sheet_key = ? ORDER BY id DESC", (sheet_key,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_summary(row) for row in rows]
+
+
+def delete_sheet_snapshots(sheet_key: str):
+    """删除表格的所有版本（表格被删除时调用）"""
+    conn = connect()
+    try:
+        with conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM snapshots WHERE sheet_key = ?", (sheet_key,))]
+            _delete_snapshots(conn, ids)
+    finally:
+        conn.close()
+
+
+def _get_snapshot(conn: sqlite3.Connection, sheet_key: str, snapshot_id: int) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        "SELECT * FROM snapshots WHERE id = ? AND sheet_key = ?", (snapshot_id, sheet_key)
+    ).fetchone()
+
+
+def _read_chunks(conn: sqlite3.Connection, hashes: Iterable[str]) -> Dict[str, Dict[str, Dict]]:
+    """读取块内容: {哈希: {"行_列": 单元格}}"""
+    result = {}
+    for digest in set(hashes):
+        row = conn.execute("SELECT data FROM chunks WHERE hash = ?", (digest,)).fetchone()
+        result[digest] = loads(gzip.decompress(row[0])) if row else {}
+    return result
+
+
+def load_snapshot(sheet_key: str, snapshot_id: int) -> Optional[Dict[str, Any]]:
+    """读取某个版本的表格数据（load_sheet格式），版本不存在时返回None"""
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        row = _get_snapshot(conn, sheet_key, snapshot_id)
+        if row is None:
+            return None
+        chunk_map = loads(row["chunk_map"])
+        chunks = _read_chunks(conn, chunk_map.values())
+    finally:
+        conn.close()
+
+    data = loads(row["meta"])
+    data["id"] = sheet_key
+    cell_data = {}
+    for block in sorted(chunk_map, key=int):
+        cell_data.update(chunks[chunk_map[block]])
+    data["cellData"] = cell_data
+    return data
+
+
+def diff_snapshots(sheet_key: str, old_id: int, new_id: int, limit: int = DIFF_LIMIT) -> Optional[Dict[str, Any]]:
+    """对比两个版本：只读取哈希不同的块，列出新增、删除和修改的单元格以及变化的元数据字段"""
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        old_row = _get_snapshot(conn, sheet_key, old_id)
+        new_row = _get_snapshot(conn, sheet_key, new_id)
+        if old_row is None or new_row is None:
+            return None
+        old_map = loads(old_row["chunk_map"])
+        new_map = loads(new_row["chunk_map"])
+        changed_blocks = sorted(
+            (block for block in set(old_map) | set(new_map) if old_map.get(block) != new_map.get(block)), key=int
+        )
+        chunks = _read_chunks(conn, [m[block] for m in (old_map, new_map) for block in changed_blocks if block in m])
+    finally:
+        conn.close()
+
+    counts = {"added": 0, "removed": 0, "changed": 0}
+    cells = []
+    for block in changed_blocks:
+        old_cells = chunks.get(old_map.get(block), {})
+        new_cells = chunks.get(new_map.get(block), {})
+        keys = sorted(set(old_cells) | set(new_cells), key=lambda key: tuple(int(i) for i in key.split("_")))
+        for cell_key in keys:
+            before, after = old_cells.get(cell_key), new_cells.get(cell_key)
+            if before == after:
+                continue
+            change = "added" if before is None else "removed" if after is None else "changed"
+            counts[change] += 1
+            if len(cells) < limit:
+                row, col = (int(i) for i in cell_key.split("_"))
+                cells.append({"row": row, "col": col, "change": change, "before": before, "after": after})
+
+    old_meta, new_meta = loads(old_row["meta"]), loads(new_row["meta"])
+    return {
+        "sheet_key": sheet_key,
+        "from": _row_to_summary(old_row),
+        "to": _row_to_summary(new_row),
+        "changed_chunks": len(changed_blocks),
+        "meta_changed": [field for field in META_FIELDS if old_meta.get(field) != new_meta.get(field)],
+        "counts": counts,
+        "cells": cells,
+        "truncated": sum(counts.values()) > len(cells),
+    }
+
+
+class SnapshotManager:
+    """版本快照的创建时机和调度"""
+
+    def __init__(self):
+        # 自动快照间隔（秒），0表示不定时创建；由main.py根据SNAPSHOT_INTERVAL配置
+        self.interval = 600.0
+        # 每个表格保留的版本数，由main.py根据SNAPSHOT_KEEP配置
+        self.keep = 200
+        # 每个表格最近一次快照对应的模型状态: {sheet_key: (epoch, version)}
+        self.last_saved: Dict[str, Tuple[str, int]] = {}
+        self.task: Optional[asyncio.Task] = None
+        # 后台保存中的"编辑前"快照（保留引用，服务器关闭时等待完成）
+        self.pending: Set[asyncio.Task] = set()
+
+    def start(self, interval: float, keep: int):
+        self.interval = interval
+        self.keep = max(keep, 1)
+        if self.interval > 0:
+            self.task = asyncio.create_task(self._run_periodic())
+
+    async def stop(self):
+        """停止定时快照，等待后台保存中的快照完成"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def _capture(self, model: SheetModel) -> Tuple[int, Dict[str, Any], List[Tuple[Tuple[int, int], Dict]]]:
+        """取模型当前状态（单元格字典写入后不再原地修改，只需复制引用）"""
+        fields = model.sheet_fields()
+        meta = {field: fields[field] for field in META_FIELDS}
+        return model.version, meta, list(model.cells.items())
+
+    def is_saved(self, model: SheetModel) -> bool:
+        """模型当前状态是否已有快照"""
+        return self.last_saved.get(model.sheet_key) == (model.epoch, model.version)
+
+    async def create(self, model: SheetModel, label: str, force: bool = False) -> Optional[Dict]:
+        """为模型当前状态创建快照，内容与最新版本相同且force为False时返回None"""
+        state = (model.epoch, model.version)
+        version, meta, cells = self._capture(model)
+        summary = await worker_pool.run(
+            model.sheet_key, save_snapshot, model.sheet_key, label, version, meta, cells, self.keep, force
+        )
+        self.last_saved[model.sheet_key] = state
+        return summary
+
+    def before_first_edit(self, model: SheetModel):
+        """表格加载后第一次修改之前，保存加载时的状态（必须在应用修改前同步调用）"""
+        if model.version != 0 or self.is_saved(model):
+            return
+        self.last_saved[model.sheet_key] = (model.epoch, 0)
+        version, meta, cells = self._capture(model)
+        task = asyncio.create_task(self._save_captured(model.sheet_key, "编辑前", version, meta, cells))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _save_captured(self, sheet_key: str, label: str, version: int, meta: Dict, cells: List):
+        try:
+            await worker_pool.run(sheet_key, save_snapshot, sheet_key, label, version, meta, cells, self.keep)
+        except Exception as e:
+            print(f"创建快照失败 {sheet_key}: {e}")
+            # 没有保存成功，之后的自动快照不再认为此状态已保存
+            if self.last_saved.get(sheet_key, (None, None))[1] == version:
+                self.last_saved.pop(sheet_key, None)
+
+    async def save_if_changed(self, model: SheetModel, label: str):
+        """模型在上次快照之后有修改时创建快照"""
+        if model.version == 0 or self.is_saved(model):
+            return
+        try:
+            await self.create(model, label)
+        except Exception as e:
+            print(f"创建快照失败 {model.sheet_key}: {e}")
+
+    async def _run_periodic(self):
+        """定时为有修改的表格创建快照"""
+        while True:
+            await asyncio.sleep(self.interval)
+            for model in list(sheet_store.models.values()):
+                await self.save_if_changed(model, "自动")
+
+    def forget(self, sheet_key: str):
+        self.last_saved.pop(sheet_key, None)
+
+
+# 全局快照管理
+snapshots = SnapshotManager()
@@ -0,0 +1,112 @@
+"""表格存储引擎选择 - xlsx文件或SQLite单元格存储
+
+两种引擎的表格可以同时存在：按文件后缀区分（.xlsx / .sqlite），新建表格使用的引擎由
+STORAGE_ENGINE配置决定，已有表格可通过管理员接口迁移到另一种引擎。
+以下函数都是阻塞操作，应通过工作池执行。
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import SHEETS_DIR
+from excel_handler import (
+    apply_operations, create_empty_sheet, import_excel, load_sheet_data, read_file_journal_seq, write_sheet_data,
+)
+from cell_store import (
+    CELL_STORE_SUFFIX, apply_cell_store_operations, create_empty_cell_store,
+    is_cell_store, load_cell_store, read_cell_store_journal_seq, write_cell_store,
+)
+
+STORAGE_ENGINES = ("xlsx", "sqlite")
+
+
+def storage_engine(file_path: str) -> str:
+    """表格文件使用的存储引擎"""
+    return "sqlite" if is_cell_store(file_path) else "xlsx"
+
+
+def sheet_file_path(name: str, engine: str) -> str:
+    """表格在指定存储引擎下的文件路径"""
+    suffix = CELL_STORE_SUFFIX if engine == "sqlite" else ".xlsx"
+    return str(SHEETS_DIR / f"{name}{suffix}")
+
+
+def load_sheet(file_path: str) -> Dict[str, Any]:
+    """加载表格数据"""
+    if is_cell_store(file_path):
+        return load_cell_store(file_path)
+    return load_sheet_data(file_path)
+
+
+def save_operations(file_path: str, ops: List[Dict], journal_seq: Optional[int] = None):
+    """将一组修改操作写入表格文件，journal_seq为最后一条操作的journal序号（与修改一起记录在文件中）"""
+    if is_cell_store(file_path):
+        apply_cell_store_operations(file_path, ops, journal_seq)
+    else:
+        apply_operations(file_path, ops, journal_seq)
+
+
+def read_journal_seq(file_path: str) -> int:
+    """表格文件中记录的已写入journal序号（崩溃恢复时跳过已写入的操作）"""
+    if is_cell_store(file_path):
+        return read_cell_store_journal_seq(file_path)
+    return read_file_journal_seq(file_path)
+
+
+def create_sheet(name: str, engine: str = "xlsx") -> str:
+    """创建空白表格，返回文件路径"""
+    if engine == "sqlite":
+        return create_empty_cell_store(name)
+    return create_empty_sheet(name)
+
+
+def import_sheet(source_path: str, name: str, engine: str = "xlsx") -> Tuple[str, Dict[str, Any]]:
+    """导入上传的Excel文件（须在表格目录中，导入后删除），返回 (文件路径, 表格数据)
+
+    先解析一次，文件无效时不会放入表格目录；解析结果直接用于构建内存模型。
+    """
+    data = load_sheet_data(source_path)
+    data["id"] = name
+    if engine == "sqlite":
+        file_path = sheet_file_path(name, engine)
+        temp_path = f"{file_path}.import"
+        remove_sheet_files(temp_path)
+        write_cell_store(data, temp_path)
+        os.replace(temp_path, file_path)
+        os.remove(source_path)
+    else:
+        file_path = import_excel(source_path, name)
+    return file_path, data
+
+
+def migrate_sheet(file_path: str, name: str, engine: str) -> str:
+    """将表格转换为另一种存储引擎，返回新文件路径（原文件保留，由调用方删除）"""
+    data = load_sheet(file_path)
+    data["id"] = name
+    target_path = sheet_file_path(name, engine)
+    if engine == "sqlite":
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        write_cell_store(data, target_path)
+    else:
+        write_sheet_data(data, target_path)
+    return target_path
+
+
+def replace_sheet_data(file_path: str, data: Dict[str, Any]):
+    """用完整的表格数据替换表格文件内容（写入临时文件后原子替换）"""
+    temp_path = f"{file_path}.restore"
+    remove_sheet_files(temp_path)
+    if is_cell_store(file_path):
+        write_cell_store(data, temp_path)
+    else:
+        write_sheet_data(data, temp_path)
+    os.replace(temp_path, file_path)
+    if os.path.exists(file_path + "-journal"):
+        os.remove(file_path + "-journal")
+
+
+def remove_sheet_files(file_path: str):
+    """删除表格文件（包括SQLite的日志文件）"""
+    for path in (file_path, file_path + "-journal"):
+        if os.path.exists(path):
+            os.remove(path)
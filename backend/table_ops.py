@@ -0,0 +1,398 @@
+"""排序、筛选和查找替换 - 在服务端内存模型上执行，排序和替换作为一条操作应用和广播
+
+WebSocket消息（行列均为0索引）：
+    sort_range    {"r0", "r1", "c0", "c1", "keys": [{"col", "desc"?}, ...]}  按一列或多列（列号在区域内）
+                  排序区域内的行，只移动区域内的单元格（连同格式）
+    find_replace  {"find", "replace", "match_case"?, "whole"?, "r0"?, "r1"?, "c0"?, "c1"?}
+                  替换区域（省略时为整个表格）内单元格中的文本，whole为真时只替换整个单元格都匹配的值
+
+服务端按当前内存模型计算结果，转换为带结果的操作后再应用、写入journal和广播：
+    sort_range    补充 "order": [原相对行号, ...]，第i项为排序后第r0+i行原来所在的行（相对r0）
+    find_replace  补充 "updates": [{"row", "col", "value"}, ...]，被替换的单元格的新值
+重放和写入表格文件时直接使用order和updates，不再重新计算。与插入/删除行列一样，排序不改写
+公式中的引用。
+
+筛选和查找是只读查询，返回符合条件的行号或单元格位置。每列的索引（行号到值、值到行号的哈希索引，
+以及数字和文本的有序索引）在首次用于排序、筛选时构建，之后随单元格修改和公式重算增量更新，
+排序和插入/删除行列后丢弃。
+
+查找和替换匹配单元格中保存的值（公式单元格匹配公式文本）。整个单元格匹配（whole）时，如果区域内的列
+都已有索引（只有一列时先构建），用各列的哈希索引取出值相同的行作为候选，再加上区域内的公式单元格逐个确认；
+包含匹配无法用哈希索引回答，与涉及多个未建索引的列时一样按单元格扫描（为多列构建索引比扫描一次更慢），
+相同的值只匹配一次。
+"""
+import bisect
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from formula import text_number
+from numeric_columns import number_of
+
+TABLE_OP_TYPES = ("sort_range", "find_replace")
+
+FILTER_OPS = ("eq", "ne", "gt", "ge", "lt", "le", "contains", "begins", "ends", "empty", "nonempty")
+
+# 排序最多的行数和排序列数
+MAX_SORT_ROWS = 1000000
+MAX_SORT_KEYS = 8
+# 单次查找返回、单次替换修改的最多单元格数
+MAX_FIND_RESULTS = 10000
+MAX_REPLACE_CELLS = 200000
+
+_MISSING = object()
+
+
+def index_key(value: Any) -> Any:
+    """索引和比较使用的键：空值为None，数字（含数字形式的文本）为float，文本不区分大小写"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    number = number_of(value)
+    if number is not None:
+        return number
+    return str(value).casefold()
+
+
+def _insort(items: List[Tuple[Any, int]], item: Tuple[Any, int]):
+    bisect.insort(items, item)
+
+
+def _remove(items: List[Tuple[Any, int]], item: Tuple[Any, int]):
+    index = bisect.bisect_left(items, item)
+    if index < len(items) and items[index] == item:
+        del items[index]
+
+
+class ColumnIndex:
+    """单列的索引：行号到键、键到行号，以及数字和文本按值排序的 (键, 行号) 列表"""
+
+    def __init__(self, entries: Iterable[Tuple[int, Any]] = ()):
+        self.keys: Dict[int, Any] = {}
+        self.rows: Dict[Any, Set[int]] = {}
+        numbers, texts = [], []
+        for row, key in entries:
+            if key is None:
+                continue
+            self.keys[row] = key
+            self.rows.setdefault(key, set()).add(row)
+            (numbers if key.__class__ is float else texts).append((key, row))
+        numbers.sort()
+        texts.sort()
+        self.numbers: List[Tuple[float, int]] = numbers
+        self.texts: List[Tuple[str, int]] = texts
+
+    def set(self, row: int, key: Any):
+        old = self.keys.get(row)
+        if old == key:
+            return
+        if old is not None:
+            rows = self.rows[old]
+            rows.discard(row)
+            if not rows:
+                del self.rows[old]
+            _remove(self.numbers if old.__class__ is float else self.texts, (old, row))
+            del self.keys[row]
+        if key is not None:
+            self.keys[row] = key
+            self.rows.setdefault(key, set()).add(row)
+            _insort(self.numbers if key.__class__ is float else self.texts, (key, row))
+
+    def between(self, low: Any, high: Any, low_inclusive: bool, high_inclusive: bool) -> Set[int]:
+        """键在low和high之间的行（None表示不限），数字与文本分别比较"""
+        sample = low if low is not None else high
+        items = self.numbers if sample.__class__ is float else self.texts
+        if low is None:
+            start = 0
+        elif low_inclusive:
+            start = bisect.bisect_left(items, (low,))
+        else:
+            start = bisect.bisect_left(items, (low, float("inf")))
+        if high is None:
+            end = len(items)
+        elif high_inclusive:
+            end = bisect.bisect_left(items, (high, float("inf")))
+        else:
+            end = bisect.bisect_left(items, (high,))
+        return {row for _, row in items[start:end]}
+
+
+class ColumnIndexes:
+    """单个表格按列的索引（所属的SheetModel首次排序或筛选某列时构建该列）"""
+
+    def __init__(self, model):
+        self.model = model
+        # {列号: ColumnIndex}
+        self.columns: Dict[int, ColumnIndex] = {}
+
+    def column(self, col: int) -> ColumnIndex:
+        index = self.columns.get(col)
+        if index is None:
+            index = self.columns[col] = ColumnIndex(self._entries(col))
+        return index
+
+    def _entries(self, col: int) -> Iterable[Tuple[int, Any]]:
+        """该列已有单元格的 (行号, 键)，相同的值只计算一次键"""
+        model = self.model
+        cells, formulas, row_index = model.cells, model.formulas, model.row_index
+        keys: Dict[Tuple[type, Any], Any] = {}
+        for row in model.sorted_rows:
+            if col not in row_index[row]:
+                continue
+            pos = (row, col)
+            value = formulas.values.get(pos) if pos in formulas.formulas else cells[pos].get("v")
+            cache_key = (value.__class__, value)
+            key = keys.get(cache_key, _MISSING)
+            if key is _MISSING:
+                key = keys[cache_key] = index_key(value)
+            yield row, key
+
+    def update(self, positions: Iterable[Tuple[int, int]]):
+        """单元格的值或公式结果改变后更新已构建的列"""
+        if not self.columns:
+            return
+        cell_value = self.model.cell_value
+        for pos in positions:
+            index = self.columns.get(pos[1])
+            if index is not None:
+                index.set(pos[0], index_key(cell_value(pos)))
+
+    def reset(self):
+        """排序和插入/删除行列后丢弃，下次使用时重新构建"""
+        self.columns = {}
+
+
+def _non_negative_int(data: Dict, name: str, default: Optional[int] = None) -> int:
+    value = data.get(name, default)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError(f"{name} 必须是非负整数")
+    return value
+
+
+def _sort_key(key: Any, desc: bool) -> Tuple:
+    """排序键：数字在文本之前，空单元格无论升序降序都排在最后"""
+    if key is None:
+        return (0, 0, 0) if desc else (1, 0, 0)
+    rank = 1 if key.__class__ is str else 0
+    return (1, rank, key) if desc else (0, rank, key)
+
+
+def plan_sort(model, data: Dict) -> Dict:
+    """校验排序请求并按当前数据计算行顺序，返回带order的sort_range操作，请求无效时抛出ValueError"""
+    r0 = _non_negative_int(data, "r0")
+    c0 = _non_negative_int(data, "c0")
+    c1 = _non_negative_int(data, "c1")
+    r1 = min(_non_negative_int(data, "r1"), model.row_count - 1)
+    if r1 < r0 or c1 < c0:
+        raise ValueError("区域范围无效")
+    if r1 - r0 + 1 > MAX_SORT_ROWS:
+        raise ValueError(f"一次最多排序{MAX_SORT_ROWS}行")
+
+    keys = data.get("keys")
+    if not isinstance(keys, list) or not keys or len(keys) > MAX_SORT_KEYS:
+        raise ValueError(f"keys 必须包含1到{MAX_SORT_KEYS}个排序列")
+    sort_keys = []
+    for key in keys:
+        if not isinstance(key, dict):
+            raise ValueError("排序列格式无效")
+        col = _non_negative_int(key, "col")
+        if not c0 <= col <= c1:
+            raise ValueError("排序列必须在区域内")
+        sort_keys.append({"col": col, "desc": bool(key.get("desc"))})
+
+    for merge in model.merges:
+        if (merge["startRow"] <= r1 and merge["endRow"] >= r0
+                and merge["startColumn"] <= c1 and merge["endColumn"] >= c0):
+            raise ValueError("排序区域不能包含合并单元格")
+
+    # 从最后一个排序列开始依次稳定排序，相同的行保持原来的顺序
+    order = list(range(r1 - r0 + 1))
+    for key in reversed(sort_keys):
+        row_keys = model.indexes.column(key["col"]).keys
+        desc = key["desc"]
+        # 空单元格的排序键都相同，先全部填入，再覆盖有值的行
+        sort_keys_by_row = [_sort_key(None, desc)] * len(order)
+        for row, value in row_keys.items():
+            if r0 <= row <= r1:
+                sort_keys_by_row[row - r0] = _sort_key(value, desc)
+        order.sort(key=sort_keys_by_row.__getitem__, reverse=desc)
+
+    return {"type": "sort_range", "r0": r0, "r1": r1, "c0": c0, "c1": c1, "keys": sort_keys, "order": order}
+
+
+def iter_sorted_positions(op: Dict, positions: Iterable[Tuple[int, int]]):
+    """排序后单元格的新位置: (原行, 列, 新行)，只包含位置改变的单元格"""
+    r0 = op["r0"]
+    new_rows = [0] * len(op["order"])
+    for new, old in enumerate(op["order"]):
+        new_rows[old] = new
+    for row, col in positions:
+        new_row = r0 + new_rows[row - r0]
+        if new_row != row:
+            yield row, col, new_row
+
+
+def filter_rows(model, r0: int, r1: int, predicates: List[Dict]) -> List[int]:
+    """区域内（有数据的行）同时满足所有条件的行号，条件: {"col", "op", "value"?}"""
+    start = bisect.bisect_left(model.sorted_rows, r0)
+    end = bisect.bisect_right(model.sorted_rows, r1)
+    rows = set(model.sorted_rows[start:end])
+    for predicate in predicates:
+        if not rows:
+            break
+        rows &= _matching_rows(model, predicate, rows)
+    return sorted(rows)
+
+
+def _matching_rows(model, predicate: Dict, rows: Set[int]) -> Set[int]:
+    col = _non_negative_int(predicate, "col")
+    op = predicate.get("op")
+    if op not in FILTER_OPS:
+        raise ValueError(f"不支持的筛选条件: {op}")
+    index = model.indexes.column(col)
+    if op == "empty":
+        return rows - index.keys.keys()
+    if op == "nonempty":
+        return set(index.keys)
+
+    key = index_key(predicate.get("value"))
+    if op in ("eq", "ne"):
+        matched = index.rows.get(key, set()) if key is not None else rows - index.keys.keys()
+        return rows - matched if op == "ne" else matched
+    if key is None:
+        raise ValueError(f"筛选条件 {op} 需要 value")
+    if op == "gt":
+        return index.between(key, None, False, False)
+    if op == "ge":
+        return index.between(key, None, True, False)
+    if op == "lt":
+        return index.between(None, key, False, False)
+    if op == "le":
+        return index.between(None, key, False, True)
+
+    # 文本匹配：开头匹配取文本有序索引中连续的一段，其余按该列中不重复的值判断；数字按显示的文本匹配
+    text = str(predicate.get("value")).casefold()
+    matched: Set[int] = set()
+    if op == "begins":
+        texts = index.texts
+        for i in range(bisect.bisect_left(texts, (text,)), len(texts)):
+            if not texts[i][0].startswith(text):
+                break
+            matched.add(texts[i][1])
+    test = {"contains": str.__contains__, "begins": str.startswith, "ends": str.endswith}[op]
+    for value, value_rows in index.rows.items():
+        if value.__class__ is float:
+            value = _text_of(value)
+        elif op == "begins":
+            continue
+        if test(value, text):
+            matched |= value_rows
+    return matched
+
+
+def _text_of(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _find_pattern(data: Dict) -> "re.Pattern":
+    find = data.get("find")
+    if not isinstance(find, str) or not find:
+        raise ValueError("find 不能为空")
+    flags = 0 if data.get("match_case") else re.IGNORECASE
+    return re.compile(re.escape(find), flags)
+
+
+def _find_bounds(model, data: Dict) -> Tuple[int, int, int, int]:
+    r0 = _non_negative_int(data, "r0", 0)
+    c0 = _non_negative_int(data, "c0", 0)
+    r1 = _non_negative_int(data, "r1", model.row_count - 1)
+    c1 = _non_negative_int(data, "c1", model.column_count - 1)
+    if r1 < r0 or c1 < c0:
+        raise ValueError("区域范围无效")
+    return r0, r1, c0, c1
+
+
+def _indexed_candidates(model, find: str, r0: int, r1: int, c0: int, c1: int) -> Set[Tuple[int, int]]:
+    """整个单元格匹配的候选单元格：各列索引中键与查找内容相同的行，以及区域内的公式单元格
+
+    值的文本与查找内容相同（不区分大小写）时两者的索引键相同，候选包含所有可能匹配的单元格。
+    索引按公式的计算结果建立，公式单元格匹配的是公式文本，单独加入。
+    """
+    keys = {index_key(find)}
+    if find.upper() in ("TRUE", "FALSE"):
+        keys.add(find.upper())
+    positions = set()
+    for col in range(c0, c1 + 1):
+        index = model.indexes.column(col)
+        for key in keys:
+            positions.update((row, col) for row in index.rows.get(key, ()) if r0 <= row <= r1)
+    positions.update((row, col) for row, col in model.formulas.formulas if r0 <= row <= r1 and c0 <= col <= c1)
+    return positions
+
+
+def _iter_matches(model, data: Dict) -> List[Tuple[int, int, str]]:
+    """区域内值与查找内容匹配的单元格: [(row, col, 值的文本)]，按行列顺序，相同的值只匹配一次"""
+    pattern = _find_pattern(data)
+    whole = bool(data.get("whole"))
+    match = pattern.fullmatch if whole else pattern.search
+    r0, r1, c0, c1 = _find_bounds(model, data)
+    cells = model.cells
+    if whole and (c0 == c1 or all(col in model.indexes.columns for col in range(c0, c1 + 1))):
+        positions: Iterable[Tuple[int, int]] = _indexed_candidates(model, data["find"], r0, r1, c0, c1)
+    else:
+        positions = (pos for pos in cells if r0 <= pos[0] <= r1 and c0 <= pos[1] <= c1)
+    cache: Dict[Tuple[type, Any], Optional[str]] = {}
+    matches = []
+    for row, col in positions:
+        value = cells[(row, col)].get("v")
+        cache_key = (value.__class__, value)
+        text = cache.get(cache_key, _MISSING)
+        if text is _MISSING:
+            text = cache[cache_key] = None
+            if value is not None:
+                value_text = _text_of(value)
+                if match(value_text) is not None:
+                    text = cache[cache_key] = value_text
+        if text is not None:
+            matches.append((row, col, text))
+    matches.sort()
+    return matches
+
+
+def find_cells(model, data: Dict) -> Dict[str, Any]:
+    """查找值中包含（whole为真时等于）查找内容的单元格，按行列顺序，最多MAX_FIND_RESULTS个"""
+    matches = _iter_matches(model, data)
+    return {
+        "cells": [[row, col] for row, col, _ in matches[:MAX_FIND_RESULTS]],
+        "truncated": len(matches) > MAX_FIND_RESULTS,
+    }
+
+
+def plan_replace(model, data: Dict) -> Dict:
+    """按当前数据计算替换结果，返回带updates的find_replace操作（没有匹配时updates为空）"""
+    replace = data.get("replace", "")
+    if not isinstance(replace, str):
+        raise ValueError("replace 必须是文本")
+    pattern = _find_pattern(data)
+    whole = bool(data.get("whole"))
+    r0, r1, c0, c1 = _find_bounds(model, data)
+    matches = _iter_matches(model, data)
+    if len(matches) > MAX_REPLACE_CELLS:
+        raise ValueError(f"一次最多替换{MAX_REPLACE_CELLS}个单元格")
+    updates = []
+    for row, col, text in matches:
+        value = replace if whole else pattern.sub(lambda _: replace, text)
+        if value == text:
+            continue
+        # 数字单元格替换后仍是数字形式时保持为数字，不变成文本
+        old = model.cells[(row, col)].get("v")
+        if isinstance(old, (int, float)) and not isinstance(old, bool):
+            value = text_number(value)
+        updates.append({"row": row, "col": col, "value": value})
+    return {
+        "type": "find_replace", "find": data["find"], "replace": replace,
+        "match_case": bool(data.get("match_case")), "whole": whole,
+        "r0": r0, "r1": r1, "c0": c0, "c1": c1, "updates": updates,
+    }
@@ -2,58 +2,179 @@
 import json
 import asyncio
 import os
-from typing import Dict, List, Set, Optional
+import time
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Set, Optional, Tuple
 from fastapi import WebSocket
+from openpyxl.utils import get_column_letter
 from datetime import datetime
 
-from excel_handler import update_cell, batch_update_cells, batch_update_dimensions
-from database import LOGS_DIR
-
-
-def get_log_file_path() -> str:
-    """获取今天的日志文件路径"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    return str(LOGS_DIR / f"{today}.log")
-
-
-def log_user_action(user_id: str, display_name: str, sheet_key: str,
-                    action_type: str, details: dict):
-    """记录用户操作到日志文件"""
-    log_path = get_log_file_path()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+from storage import replace_sheet_data, save_operations
+from journal import journal
+from snapshots import snapshots
+from audit_log import log_user_action
+from sheet_model import sheet_store
+from worker_pool import worker_pool
+from serializer import dumps_text
+from cell_ops import normalize_cell_op
+from range_ops import RANGE_OP_TYPES, STRUCTURE_OP_TYPES, normalize_op, op_log_details, structure_axis
+from table_ops import TABLE_OP_TYPES, plan_replace, plan_sort
+
+
+# 在线状态类消息（光标、选区），发送队列满时优先丢弃
+PRESENCE_MESSAGE_TYPES = {"cursor_move", "selection_change"}
+
+# 发送队列溢出时断开连接使用的关闭码，前端收到后重新连接并重新加载表格
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+def build_frame(parts: List[Tuple[str, bool]]) -> Optional[Tuple[str, bool]]:
+    """将多条已序列化的消息合并为一个JSON数组帧: (帧文本, 是否全部为在线状态消息)"""
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return "[" + ",".join(text for text, _ in parts) + "]", all(presence for _, presence in parts)
+
+
+def describe_range_op(op: Dict) -> Tuple[str, str]:
+    """区域操作在修改历史中的描述: (操作, 涉及的单元格区域)"""
+    op_type = op["type"]
+    if op_type in STRUCTURE_OP_TYPES:
+        axis, insert = structure_axis(op_type)
+        first, last = op["at"], op["at"] + op["count"] - 1
+        if axis == "row":
+            target = f"{first + 1}:{last + 1}"
+        else:
+            target = f"{get_column_letter(first + 1)}:{get_column_letter(last + 1)}"
+        action = ("插入" if insert else "删除") + f"{op['count']}" + ("行" if axis == "row" else "列")
+        return action, target
+
+    target = f"{get_column_letter(op['c0'] + 1)}{op['r0'] + 1}:{get_column_letter(op['c1'] + 1)}{op['r1'] + 1}"
+    if op_type == "range_set":
+        action = "写入区域"
+    elif op_type == "range_clear":
+        action = "清除区域(含格式)" if op.get("formats") else "清除区域"
+    else:
+        action = "修改区域格式"
+    return action, target
+
+
+def describe_table_op(op: Dict) -> Tuple[str, str, str]:
+    """排序和查找替换在修改历史中的描述: (操作, 涉及的单元格区域, 内容)"""
+    target = f"{get_column_letter(op['c0'] + 1)}{op['r0'] + 1}:{get_column_letter(op['c1'] + 1)}{op['r1'] + 1}"
+    if op["type"] == "sort_range":
+        value = ",".join(f"{get_column_letter(key['col'] + 1)}列{'降序' if key['desc'] else '升序'}" for key in op["keys"])
+        return "排序", target, value
+    return f"替换{len(op['updates'])}处", target, f"{op['find']} → {op['replace']}"[:50]
+
+
+class ClientConnection:
+    """单个WebSocket连接：独立的有界发送队列，由专门的发送任务依次发送"""
+
+    def __init__(self, websocket: WebSocket, max_queue: int = 1000):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        # 待发送消息: [(JSON文本, 是否为在线状态消息)]
+        self.queue: Deque[Tuple[str, bool]] = deque()
+        self.has_messages = asyncio.Event()
+        # 发送失败（连接已断开）或被判定为慢客户端后置为True
+        self.closed = False
+        # 因队列满而丢弃的在线状态消息数
+        self.dropped = 0
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, text: str, presence: bool = False) -> bool:
+        """加入发送队列。队列满时先丢弃在线状态消息，仍然放不下则返回False"""
+        if self.closed:
+            return True
+        if len(self.queue) >= self.max_queue:
+            if presence:
+                self.dropped += 1
+                return True
+            kept = deque(item for item in self.queue if not item[1])
+            self.dropped += len(self.queue) - len(kept)
+            self.queue = kept
+            if len(self.queue) >= self.max_queue:
+                return False
+        self.queue.append((text, presence))
+        self.has_messages.set()
+        return True
+
+    async def _writer(self):
+        """依次发送队列中的消息"""
+        try:
+            while True:
+                if not self.queue:
+                    self.has_messages.clear()
+                    await self.has_messages.wait()
+                    continue
+                text, _ = self.queue.popleft()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"发送消息失败: {e}")
+            self.closed = True
 
-    log_entry = {
-        "timestamp": timestamp,
-        "user_id": user_id,
-        "display_name": display_name,
-        "sheet_key": sheet_key,
-        "action": action_type,
-        "details": details
-    }
+    def stop(self):
+        """停止发送任务并清空队列"""
+        self.closed = True
+        self.queue.clear()
+        self.writer_task.cancel()
 
-    try:
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-    except Exception as e:
-        print(f"写入日志失败: {e}")
+    async def close_slow_consumer(self):
+        """慢客户端：丢弃积压消息并断开连接，提示前端重新同步"""
+        self.stop()
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="resync")
+        except Exception:
+            pass
 
 
 class ConnectionManager:
     """WebSocket连接管理器"""
 
     def __init__(self):
-        # 按表格密钥分组的活动连接: {sheet_key: {user_id: WebSocket}}
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+        # 按表格密钥分组的活动连接: {sheet_key: {user_id: ClientConnection}}
+        self.active_connections: Dict[str, Dict[str, ClientConnection]] = {}
+        # 每个连接的发送队列容量，由main.py根据SEND_QUEUE_SIZE配置
+        self.send_queue_size = 1000
+        # 广播周期（秒），周期内的广播消息合并为一帧发送，0表示立即发送；由main.py根据BROADCAST_TICK配置
+        self.broadcast_tick = 0.03
+        # 待合并发送的消息: {sheet_key: [(JSON文本, 排除的用户, 是否在线状态消息)]}
+        self.outboxes: Dict[str, List[Tuple[str, Optional[str], bool]]] = {}
+        # 待发送的在线状态消息（每个用户每种类型只保留最新一条）: {sheet_key: {(user_id, type): (JSON文本, 排除的用户)}}
+        self.presence_outboxes: Dict[str, Dict[Tuple[str, str], Tuple[str, Optional[str]]]] = {}
+        # 合并发送任务
+        self.outbox_tasks: Dict[str, asyncio.Task] = {}
         # 用户信息: {user_id: {ip, mac, sheet_key, connected_at}}
         self.user_info: Dict[str, Dict] = {}
         # 每个表格的文件路径
         self.sheet_paths: Dict[str, str] = {}
-        # 更新队列，用于批量保存
+        # 更新队列，用于批量保存（尚未写入表格文件的修改操作）
         self.update_queues: Dict[str, List[Dict]] = {}
-        # 保存任务
+        # 更新队列中最后一条操作的journal序号: {sheet_key: seq}
+        self.queued_seq: Dict[str, int] = {}
+        # 保存任务（延迟写入，同一间隔内的修改合并为一次保存）
         self.save_tasks: Dict[str, asyncio.Task] = {}
-        # 修改历史记录: {sheet_key: [history_entries]}
-        self.edit_history: Dict[str, List[Dict]] = {}
+        # 保存锁，保证同一表格的保存顺序执行
+        self.save_locks: Dict[str, asyncio.Lock] = {}
+        # 最后一个用户离开后的保存和释放任务（保留引用，避免任务未完成时被回收）
+        self.release_tasks: Set[asyncio.Task] = set()
+        # 断开慢客户端的任务（保留引用，服务器关闭时等待完成）
+        self.close_tasks: Set[asyncio.Task] = set()
+        # 保存间隔（秒），由main.py根据SAVE_INTERVAL配置
+        self.save_interval = 2.0
+        # 最早一条未保存修改的时间: {sheet_key: monotonic时间}
+        self.pending_since: Dict[str, float] = {}
+        # 保存统计: {sheet_key: {last_flush_at, last_flush_ops, last_flush_ms, flush_count, error}}
+        self.flush_stats: Dict[str, Dict] = {}
+        # 修改历史记录（固定容量的环形缓冲区，按时间从旧到新）: {sheet_key: deque[history_entry]}
+        self.edit_history: Dict[str, Deque[Dict]] = {}
+        # 每个表格最新一条历史记录的序号: {sheet_key: seq}
+        self.history_seq: Dict[str, int] = {}
         # 历史记录最大条数（默认100，防止内存溢出）
         self.max_history = 100
 
@@ -64,12 +185,16 @@ class ConnectionManager:
 
         if sheet_key not in self.active_connections:
             self.active_connections[sheet_key] = {}
-            self.update_queues[sheet_key] = []
+            self.update_queues.setdefault(sheet_key, [])
 
         # 检查是否是同一用户重新连接
-        is_reconnect = user_id in self.active_connections.get(sheet_key, {})
+        old_connection = self.active_connections[sheet_key].get(user_id)
+        is_reconnect = old_connection is not None
+        if old_connection:
+            old_connection.stop()
 
-        self.active_connections[sheet_key][user_id] = websocket
+        connection = ClientConnection(websocket, self.send_queue_size)
+        self.active_connections[sheet_key][user_id] = connection
         self.sheet_paths[sheet_key] = file_path
 
         # 只在首次连接时更新用户信息的connected_at
@@ -95,24 +220,32 @@ class ConnectionManager:
             }, exclude=user_id)
 
         # 发送当前在线用户列表给连接的用户
-        await self.send_personal(websocket, {
+        await self.send_personal(connection, {
             "type": "connected",
             "user_id": user_id,
             "display_name": self.user_info[user_id]["display_name"],
             "online_users": self.get_online_users(sheet_key)
         })
 
+    def is_current_connection(self, sheet_key: str, user_id: str, websocket: WebSocket) -> bool:
+        """websocket是否仍是该用户在此表格的当前连接（重新连接后旧连接不再是）"""
+        connection = self.active_connections.get(sheet_key, {}).get(user_id)
+        return connection is not None and connection.websocket is websocket
+
     def disconnect(self, sheet_key: str, user_id: str):
         """断开WebSocket连接"""
         if sheet_key in self.active_connections:
-            if user_id in self.active_connections[sheet_key]:
+            connection = self.active_connections[sheet_key].get(user_id)
+            if connection:
+                connection.stop()
                 del self.active_connections[sheet_key][user_id]
 
-            # 如果没有用户了，清理资源
+            # 如果没有用户了，立即保存并释放内存模型
             if not self.active_connections[sheet_key]:
                 del self.active_connections[sheet_key]
-                if sheet_key in self.update_queues:
-                    del self.update_queues[sheet_key]
+                task = asyncio.create_task(self.release_sheet(sheet_key))
+                self.release_tasks.add(task)
+                task.add_done_callback(self._release_done)
 
         if user_id in self.user_info:
             del self.user_info[user_id]
@@ -140,59 +273,306 @@ class ConnectionManager:
                 })
         return users
 
-    def add_history(self, sheet_key: str, entry: Dict):
-        """添加修改历史记录"""
+    def add_history(self, sheet_key: str, entry: Dict) -> Dict:
+        """添加修改历史记录（带递增序号，超出容量时自动丢弃最旧的记录）"""
         if sheet_key not in self.edit_history:
-            self.edit_history[sheet_key] = []
+            self.edit_history[sheet_key] = deque(maxlen=self.max_history)
 
-        # 添加时间戳
+        # 添加时间戳和序号
         entry["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entry["seq"] = self.history_seq.get(sheet_key, 0) + 1
+        self.history_seq[sheet_key] = entry["seq"]
 
-        # 在列表头部插入新记录
-        self.edit_history[sheet_key].insert(0, entry)
-
-        # 限制历史记录条数
-        if len(self.edit_history[sheet_key]) > self.max_history:
-            self.edit_history[sheet_key] = self.edit_history[sheet_key][:self.max_history]
+        self.edit_history[sheet_key].append(entry)
+        return entry
 
     def get_history(self, sheet_key: str, count: int = 20) -> List[Dict]:
-        """获取修改历史记录"""
+        """获取修改历史记录（最新的在前）"""
         if sheet_key not in self.edit_history:
             return []
-        return self.edit_history[sheet_key][:count]
-
-    async def send_personal(self, websocket: WebSocket, message: dict):
+        return list(islice(reversed(self.edit_history[sheet_key]), count))
+
+    def get_history_since(self, sheet_key: str, since: int) -> List[Dict]:
+        """获取序号大于since的历史记录（最新的在前），已被丢弃的记录不再返回"""
+        result = []
+        for entry in reversed(self.edit_history.get(sheet_key, ())):
+            if entry["seq"] <= since:
+                break
+            result.append(entry)
+        return result
+
+    async def send_personal(self, connection: ClientConnection, message: dict):
         """发送消息给单个用户"""
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            print(f"发送消息失败: {e}")
+        if not connection.enqueue(dumps_text(message)):
+            self.disconnect_slow_consumer(connection)
+
+    def disconnect_slow_consumer(self, connection: ClientConnection):
+        """在后台断开慢客户端"""
+        task = asyncio.create_task(connection.close_slow_consumer())
+        self.close_tasks.add(task)
+        task.add_done_callback(self._close_done)
+
+    def _close_done(self, task: asyncio.Task):
+        self.close_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"断开慢客户端失败: {task.exception()}")
 
     async def broadcast_to_sheet(self, sheet_key: str, message: dict, exclude: Optional[str] = None):
-        """广播消息给某表格的所有用户"""
+        """广播消息给某表格的所有用户（同一周期内的消息合并为一帧发送）"""
         if sheet_key not in self.active_connections:
             return
 
+        # 只序列化一次，加入每个用户各自的发送队列（慢客户端不会拖慢其他用户）
+        text = dumps_text(message)
+        msg_type = message.get("type")
+        presence = msg_type in PRESENCE_MESSAGE_TYPES
+        if self.broadcast_tick <= 0:
+            self._send_frame(sheet_key, [(text, exclude, presence)])
+            return
+
+        if presence:
+            # 在线状态消息每个用户只保留最新一条
+            outbox = self.presence_outboxes.setdefault(sheet_key, {})
+            outbox[(message.get("user_id"), msg_type)] = (text, exclude)
+        else:
+            self.outboxes.setdefault(sheet_key, []).append((text, exclude, False))
+
+        task = self.outbox_tasks.get(sheet_key)
+        if task is None or task.done():
+            self.outbox_tasks[sheet_key] = asyncio.create_task(self._flush_outbox_later(sheet_key))
+
+    async def _flush_outbox_later(self, sheet_key: str):
+        """等待一个广播周期后，发送期间积累的所有消息"""
+        await asyncio.sleep(self.broadcast_tick)
+        self.outbox_tasks.pop(sheet_key, None)
+        messages = self.outboxes.pop(sheet_key, [])
+        presence_messages = self.presence_outboxes.pop(sheet_key, {})
+        messages.extend((text, exclude, True) for text, exclude in presence_messages.values())
+        self._send_frame(sheet_key, messages)
+
+    def _send_frame(self, sheet_key: str, messages: List[Tuple[str, Optional[str], bool]]):
+        """将一批消息[(JSON文本, 排除的用户, 是否在线状态消息)]合并为一帧，发送给表格的每个用户"""
+        connections = self.active_connections.get(sheet_key)
+        if not connections or not messages:
+            return
+
+        excluded_users = {exclude for _, exclude, _ in messages if exclude}
+        shared_frame = None
         disconnected = []
-        for user_id, websocket in self.active_connections[sheet_key].items():
-            if exclude and user_id == exclude:
-                continue
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                print(f"广播失败 {user_id}: {e}")
+        for user_id, connection in list(connections.items()):
+            if connection.closed:
                 disconnected.append(user_id)
+                continue
+            if user_id in excluded_users:
+                frame = build_frame([(text, presence) for text, exclude, presence in messages if exclude != user_id])
+            else:
+                # 未被任何消息排除的用户共用同一帧
+                if shared_frame is None:
+                    shared_frame = build_frame([(text, presence) for text, _, presence in messages])
+                frame = shared_frame
+            if frame is None:
+                continue
+            text, presence = frame
+            if not connection.enqueue(text, presence):
+                print(f"发送队列已满，断开慢客户端 {user_id}")
+                self.disconnect_slow_consumer(connection)
 
         # 清理断开的连接
         for user_id in disconnected:
             self.disconnect(sheet_key, user_id)
 
+    async def apply_operation(self, sheet_key: str, op: dict) -> Optional[int]:
+        """将修改应用到内存模型，并加入保存队列（延迟写入表格文件），返回应用后的版本号
+
+        广播的修改操作附带此版本号，客户端据此跳过定时同步中已通过WebSocket应用过的修改。
+        """
+        file_path = self.sheet_paths.get(sheet_key)
+        if not file_path:
+            return None
+
+        model = await sheet_store.get(sheet_key, file_path)
+        # 加载后的第一次修改之前保存一个版本快照
+        snapshots.before_first_edit(model)
+        # 先写入journal再修改内存模型，写入失败时模型保持不变；延迟保存完成前崩溃也可在启动时恢复
+        seq = model.journal_seq + 1
+        journal.append(sheet_key, op, seq)
+        model.journal_seq = seq
+        formula_values = model.apply(op)
+
+        self.update_queues.setdefault(sheet_key, []).append(op)
+        self.queued_seq[sheet_key] = model.journal_seq
+        self.pending_since.setdefault(sheet_key, time.monotonic())
+        self.schedule_save(sheet_key)
+
+        # 公式计算结果有变化时通知所有用户（包括修改者）
+        if formula_values:
+            await self.broadcast_to_sheet(sheet_key, {
+                "type": "formula_values",
+                "version": model.version,
+                "values": formula_values
+            })
+        return model.version
+
+    def schedule_save(self, sheet_key: str):
+        """安排延迟保存，已有等待中的保存任务时不重复创建"""
+        task = self.save_tasks.get(sheet_key)
+        if task and not task.done():
+            return
+        self.save_tasks[sheet_key] = asyncio.create_task(self._delayed_save(sheet_key))
+
+    async def _delayed_save(self, sheet_key: str):
+        """等待保存间隔后写入文件"""
+        await asyncio.sleep(self.save_interval)
+        self.save_tasks.pop(sheet_key, None)
+        await self.flush(sheet_key)
+
+    async def flush(self, sheet_key: str):
+        """将队列中的所有修改一次性写入表格文件"""
+        lock = self.save_locks.setdefault(sheet_key, asyncio.Lock())
+        async with lock:
+            ops = self.update_queues.get(sheet_key)
+            file_path = self.sheet_paths.get(sheet_key)
+            if not ops or not file_path:
+                return
+
+            self.update_queues[sheet_key] = []
+            journal_seq = self.queued_seq.get(sheet_key)
+            # 之后的修改写入新的journal分段，本次保存成功后删除旧分段
+            sealed = journal.rotate(sheet_key)
+            pending_since = self.pending_since.pop(sheet_key, None)
+            stats = self.flush_stats.setdefault(sheet_key, {"flush_count": 0})
+            started = time.monotonic()
+            try:
+                if sealed:
+                    await journal.seal(sealed)
+                await worker_pool.run(sheet_key, save_operations, file_path, ops, journal_seq)
+            except Exception as e:
+                print(f"保存表格失败 {sheet_key}: {e}")
+                # 保存失败，放回队列等待下次重试
+                self.update_queues[sheet_key] = ops + self.update_queues.get(sheet_key, [])
+                self.pending_since[sheet_key] = pending_since or started
+                stats["error"] = str(e)
+                if sheet_key in self.active_connections:
+                    self.schedule_save(sheet_key)
+                return
+
+            journal.remove_sealed(sheet_key)
+            stats.update({
+                "last_flush_at": datetime.now().isoformat(),
+                "last_flush_ops": len(ops),
+                "last_flush_ms": round((time.monotonic() - started) * 1000, 1),
+                "flush_count": stats["flush_count"] + 1,
+                "error": None,
+            })
+
+    async def flush_all(self):
+        """保存所有表格的待写入修改（服务器关闭时调用）"""
+        for task in list(self.save_tasks.values()):
+            task.cancel()
+        self.save_tasks.clear()
+        if self.release_tasks or self.close_tasks:
+            await asyncio.gather(*self.release_tasks, *self.close_tasks, return_exceptions=True)
+        for sheet_key in list(self.update_queues):
+            await self.flush(sheet_key)
+
+    def _release_done(self, task: asyncio.Task):
+        self.release_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"释放表格失败: {task.exception()}")
+
+    async def release_sheet(self, sheet_key: str):
+        """最后一个用户离开后：立即保存，并释放内存模型"""
+        task = self.save_tasks.pop(sheet_key, None)
+        if task:
+            task.cancel()
+        await self.flush(sheet_key)
+        model = sheet_store.peek(sheet_key)
+        if model is not None:
+            await snapshots.save_if_changed(model, "用户离开")
+
+        # 保存期间可能有用户重新连接
+        if sheet_key in self.active_connections or self.update_queues.get(sheet_key):
+            return
+        self.update_queues.pop(sheet_key, None)
+        self.queued_seq.pop(sheet_key, None)
+        sheet_store.evict(sheet_key)
+
+    async def restore_sheet(self, sheet_key: str, file_path: str, data: Dict):
+        """用历史版本的数据替换表格：写入表格文件、替换内存模型，并通知在线用户重新加载
+
+        尚未保存的修改和恢复期间收到的修改都被丢弃（以恢复的版本为准）。
+        """
+        lock = self.save_locks.setdefault(sheet_key, asyncio.Lock())
+        async with lock:
+            task = self.save_tasks.pop(sheet_key, None)
+            if task:
+                task.cancel()
+            await worker_pool.run(sheet_key, replace_sheet_data, file_path, data)
+            self.update_queues[sheet_key] = []
+            self.queued_seq.pop(sheet_key, None)
+            self.pending_since.pop(sheet_key, None)
+            journal.discard(sheet_key)
+            model = sheet_store.replace(sheet_key, file_path, data)
+            self.sheet_paths[sheet_key] = file_path
+
+        await self.broadcast_to_sheet(sheet_key, {
+            "type": "resync",
+            "epoch": model.epoch,
+            "version": model.version
+        })
+        return model
+
+    def discard_sheet(self, sheet_key: str):
+        """丢弃表格的待保存修改并释放内存模型（表格被删除或迁移存储引擎后调用）"""
+        task = self.save_tasks.pop(sheet_key, None)
+        if task:
+            task.cancel()
+        self.update_queues.pop(sheet_key, None)
+        self.queued_seq.pop(sheet_key, None)
+        self.pending_since.pop(sheet_key, None)
+        self.flush_stats.pop(sheet_key, None)
+        self.sheet_paths.pop(sheet_key, None)
+        journal.discard(sheet_key)
+        snapshots.forget(sheet_key)
+        sheet_store.evict(sheet_key)
+
+    def get_persistence_stats(self) -> List[Dict]:
+        """获取各表格的保存状态（待写入操作数、保存延迟等）"""
+        now = time.monotonic()
+        result = []
+        for sheet_key in set(self.update_queues) | set(self.flush_stats):
+            pending_since = self.pending_since.get(sheet_key)
+            stats = self.flush_stats.get(sheet_key, {})
+            result.append({
+                "sheet_key": sheet_key,
+                "pending_ops": len(self.update_queues.get(sheet_key, [])),
+                "flush_lag_ms": round((now - pending_since) * 1000, 1) if pending_since else 0,
+                "last_flush_at": stats.get("last_flush_at"),
+                "last_flush_ops": stats.get("last_flush_ops", 0),
+                "last_flush_ms": stats.get("last_flush_ms", 0),
+                "flush_count": stats.get("flush_count", 0),
+                "error": stats.get("error"),
+            })
+        return result
+
+    async def send_error(self, sheet_key: str, user_id: str, op_type: Optional[str], message: str):
+        """通知发起者操作被拒绝"""
+        connection = self.active_connections.get(sheet_key, {}).get(user_id)
+        if connection:
+            await self.send_personal(connection, {"type": "error", "op": op_type, "message": message})
+
     async def handle_cell_update(self, sheet_key: str, user_id: str, data: dict):
         """处理单元格更新"""
-        row = data.get("row")
-        col = data.get("col")
-        value = data.get("value")
-        style = data.get("style")
+        try:
+            op = normalize_cell_op(data)
+        except ValueError as e:
+            print(f"单元格修改无效: {e}")
+            await self.send_error(sheet_key, user_id, "cell_update", str(e))
+            return
+        row = op["row"]
+        col = op["col"]
+        value = op["value"]
+        style = op["style"]
 
         display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
 
@@ -220,7 +600,7 @@ class ConnectionManager:
                     action_desc = "修改内容和格式"
 
         # 添加到修改历史
-        self.add_history(sheet_key, {
+        history_entry = self.add_history(sheet_key, {
             "user": display_name,
             "action": action_desc,
             "cell": f"{chr(65 + col)}{row + 1}",
@@ -236,13 +616,13 @@ class ConnectionManager:
             details={"row": row, "col": col, "value": value, "style": style}
         )
 
-        # 立即保存到Excel文件
-        file_path = self.sheet_paths.get(sheet_key)
-        if file_path:
-            try:
-                update_cell(file_path, row, col, value, style)
-            except Exception as e:
-                print(f"保存单元格失败: {e}")
+        # 更新内存模型并保存（失败时不广播，其他用户的表格与服务端保持一致）
+        try:
+            version = await self.apply_operation(sheet_key, op)
+        except Exception as e:
+            print(f"保存单元格失败: {e}")
+            await self.send_error(sheet_key, user_id, "cell_update", "保存失败")
+            return
 
         # 广播给其他用户（包含历史记录）
         await self.broadcast_to_sheet(sheet_key, {
@@ -251,18 +631,26 @@ class ConnectionManager:
             "col": col,
             "value": value,
             "style": style,
+            "version": version,
             "user_id": user_id,
             "display_name": display_name
         }, exclude=user_id)
 
-        # 广播历史记录更新给所有用户
+        # 广播新增的历史记录给所有用户（只发送这一条，客户端根据序号检测遗漏）
         await self.broadcast_to_sheet(sheet_key, {
-            "type": "history_update",
-            "history": self.get_history(sheet_key, 20)
+            "type": "history_append",
+            "entry": history_entry
         })
 
-    async def handle_batch_update(self, sheet_key: str, user_id: str, updates: List[dict]):
+    async def handle_batch_update(self, sheet_key: str, user_id: str, data: dict):
         """处理批量单元格更新"""
+        try:
+            op = normalize_cell_op(data)
+        except ValueError as e:
+            print(f"批量修改无效: {e}")
+            await self.send_error(sheet_key, user_id, "batch_update", str(e))
+            return
+        updates = op["updates"]
         display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
 
         # 记录用户操作日志
@@ -274,21 +662,116 @@ class ConnectionManager:
             details={"updates": updates}
         )
 
-        file_path = self.sheet_paths.get(sheet_key)
-        if file_path:
-            try:
-                batch_update_cells(file_path, updates)
-            except Exception as e:
-                print(f"批量保存失败: {e}")
+        try:
+            version = await self.apply_operation(sheet_key, op)
+        except Exception as e:
+            print(f"批量保存失败: {e}")
+            await self.send_error(sheet_key, user_id, "batch_update", "保存失败")
+            return
 
         # 广播给其他用户
         await self.broadcast_to_sheet(sheet_key, {
             "type": "batch_update",
             "updates": updates,
+            "version": version,
             "user_id": user_id,
             "display_name": display_name
         }, exclude=user_id)
 
+    async def handle_range_op(self, sheet_key: str, user_id: str, data: dict):
+        """处理区域操作（区域写入/清除/设置格式、插入/删除行列）：作为一条操作应用、记录和广播"""
+        try:
+            op = normalize_op(data)
+        except ValueError as e:
+            print(f"区域操作无效: {e}")
+            await self.send_error(sheet_key, user_id, data.get("type"), str(e))
+            return
+
+        display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
+        action, target = describe_range_op(op)
+        history_entry = self.add_history(sheet_key, {
+            "user": display_name,
+            "action": action,
+            "cell": target,
+            "value": ""
+        })
+
+        # 记录用户操作日志（整个区域一条）
+        log_user_action(
+            user_id=user_id,
+            display_name=display_name,
+            sheet_key=sheet_key,
+            action_type=op["type"],
+            details=op_log_details(op)
+        )
+
+        try:
+            version = await self.apply_operation(sheet_key, op)
+        except Exception as e:
+            print(f"区域操作失败: {e}")
+            await self.send_error(sheet_key, user_id, op["type"], "保存失败")
+            return
+
+        # 广播给其他用户（一条消息）
+        await self.broadcast_to_sheet(sheet_key, dict(op, version=version, user_id=user_id, display_name=display_name),
+                                      exclude=user_id)
+        await self.broadcast_to_sheet(sheet_key, {
+            "type": "history_append",
+            "entry": history_entry
+        })
+
+    async def handle_table_op(self, sheet_key: str, user_id: str, data: dict):
+        """处理排序和查找替换：按内存模型计算结果后作为一条操作应用和记录，广播给所有用户（包括发起者）"""
+        file_path = self.sheet_paths.get(sheet_key)
+        if not file_path:
+            return
+        model = await sheet_store.get(sheet_key, file_path)
+        # 计算和应用之间没有切换到其他任务，结果与应用时的数据一致
+        try:
+            op = plan_sort(model, data) if data.get("type") == "sort_range" else plan_replace(model, data)
+            if op["type"] == "find_replace" and not op["updates"]:
+                raise ValueError(f"未找到“{op['find']}”")
+        except ValueError as e:
+            print(f"排序/替换操作无效: {e}")
+            await self.send_error(sheet_key, user_id, data.get("type"), str(e))
+            return
+
+        display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
+        action, target, value = describe_table_op(op)
+        history_entry = self.add_history(sheet_key, {
+            "user": display_name,
+            "action": action,
+            "cell": target,
+            "value": value
+        })
+
+        # 操作日志不记录行顺序和逐个单元格的替换结果
+        details = {k: v for k, v in op.items() if k not in ("type", "order", "updates")}
+        if op["type"] == "find_replace":
+            details["count"] = len(op["updates"])
+        log_user_action(
+            user_id=user_id,
+            display_name=display_name,
+            sheet_key=sheet_key,
+            action_type=op["type"],
+            details=details
+        )
+
+        # 应用失败时不广播，客户端不能执行服务端没有完成的排序或替换
+        try:
+            version = await self.apply_operation(sheet_key, op)
+        except Exception as e:
+            print(f"排序/替换操作失败: {e}")
+            await self.send_error(sheet_key, user_id, op["type"], "操作失败")
+            return
+
+        # 发起者也需要结果（行顺序或替换后的值），广播给所有用户
+        await self.broadcast_to_sheet(sheet_key, dict(op, version=version, user_id=user_id, display_name=display_name))
+        await self.broadcast_to_sheet(sheet_key, {
+            "type": "history_append",
+            "entry": history_entry
+        })
+
     async def handle_cursor_move(self, sheet_key: str, user_id: str, data: dict):
         """处理光标移动（用于显示其他用户的选择区域）"""
         display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
@@ -312,8 +795,14 @@ class ConnectionManager:
 
     async def handle_dimension_update(self, sheet_key: str, user_id: str, data: dict):
         """处理列宽行高更新"""
-        col_widths = data.get("col_widths")
-        row_heights = data.get("row_heights")
+        try:
+            op = normalize_cell_op(data)
+        except ValueError as e:
+            print(f"列宽行高修改无效: {e}")
+            await self.send_error(sheet_key, user_id, "dimension_update", str(e))
+            return
+        col_widths = op["col_widths"]
+        row_heights = op["row_heights"]
 
         display_name = self.user_info.get(user_id, {}).get("display_name", user_id)
 
@@ -326,19 +815,20 @@ class ConnectionManager:
             details={"col_widths": col_widths, "row_heights": row_heights}
         )
 
-        # 保存到Excel文件
-        file_path = self.sheet_paths.get(sheet_key)
-        if file_path:
-            try:
-                batch_update_dimensions(file_path, col_widths, row_heights)
-            except Exception as e:
-                print(f"保存列宽行高失败: {e}")
+        # 更新内存模型并保存
+        try:
+            version = await self.apply_operation(sheet_key, op)
+        except Exception as e:
+            print(f"保存列宽行高失败: {e}")
+            await self.send_error(sheet_key, user_id, "dimension_update", "保存失败")
+            return
 
         # 广播给其他用户
         await self.broadcast_to_sheet(sheet_key, {
             "type": "dimension_update",
             "col_widths": col_widths,
             "row_heights": row_heights,
+            "version": version,
             "user_id": user_id,
             "display_name": display_name
         }, exclude=user_id)
@@ -352,18 +842,22 @@ class ConnectionManager:
             if msg_type == "cell_update":
                 await self.handle_cell_update(sheet_key, user_id, data)
             elif msg_type == "batch_update":
-                await self.handle_batch_update(sheet_key, user_id, data.get("updates", []))
+                await self.handle_batch_update(sheet_key, user_id, data)
             elif msg_type == "cursor_move":
                 await self.handle_cursor_move(sheet_key, user_id, data)
             elif msg_type == "selection_change":
                 await self.handle_selection_change(sheet_key, user_id, data)
             elif msg_type == "dimension_update":
                 await self.handle_dimension_update(sheet_key, user_id, data)
+            elif msg_type in RANGE_OP_TYPES or msg_type in STRUCTURE_OP_TYPES:
+                await self.handle_range_op(sheet_key, user_id, data)
+            elif msg_type in TABLE_OP_TYPES:
+                await self.handle_table_op(sheet_key, user_id, data)
             elif msg_type == "ping":
                 # 心跳响应
-                ws = self.active_connections.get(sheet_key, {}).get(user_id)
-                if ws:
-                    await self.send_personal(ws, {"type": "pong"})
+                connection = self.active_connections.get(sheet_key, {}).get(user_id)
+                if connection:
+                    await self.send_personal(connection, {"type": "pong"})
             else:
                 print(f"未知消息类型: {msg_type}")
 
@@ -0,0 +1,59 @@
+"""后台工作池 - 将openpyxl等阻塞操作移出asyncio事件循环
+
+同一表格的任务按提交顺序串行执行（保证写入顺序），不同表格的任务在线程池或进程池中并行执行，
+每个表格同一时间最多占用一个工作者，单个繁忙表格不会占满整个工作池。
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class SheetWorkerPool:
+    """按表格串行、跨表格并行的工作池"""
+
+    def __init__(self):
+        self.executor: Optional[Executor] = None
+        # 工作模式: thread（线程池）或 process（进程池，可利用多核）
+        self.mode = "thread"
+        self.max_workers = 0
+        # 每个表格的任务锁（asyncio.Lock按等待顺序唤醒，保证先提交先执行）
+        self.sheet_locks: Dict[str, asyncio.Lock] = {}
+
+    def start(self, mode: str = "thread", max_workers: int = 0):
+        """启动工作池，max_workers为0时按CPU核数自动设置"""
+        if self.executor is not None:
+            return
+        self.mode = "process" if mode == "process" else "thread"
+        self.max_workers = max_workers if max_workers > 0 else min(8, (os.cpu_count() or 1) + 1)
+        if self.mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sheet-worker")
+
+    def shutdown(self):
+        """关闭工作池（等待正在执行的任务完成）"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, sheet_key: str, func: Callable, *args) -> Any:
+        """在工作池中执行表格相关的阻塞任务，同一表格的任务顺序执行"""
+        if self.executor is None:
+            self.start()
+        lock = self.sheet_locks.setdefault(sheet_key, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取工作池状态"""
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "busy_sheets": [key for key, lock in self.sheet_locks.items() if lock.locked()],
+        }
+
+
+# 全局工作池实例
+worker_pool = SheetWorkerPool()
@@ -0,0 +1,97 @@
+"""汇总统计基准测试：流水账式表格（地区、金额、数量、单价公式），对比NumPy数值列与逐单元格遍历的汇总耗时
+
+用法: python benchmarks/bench_aggregate.py [行数]
+"""
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from numeric_columns import number_of
+from sheet_model import SheetModel
+
+REGIONS = ["华东", "华南", "华北", "西南", "西北", "东北", "华中", "海外"]
+
+
+def build_data(rows: int):
+    rng = random.Random(7)
+    cells = {"0_0": {"v": "地区"}, "0_1": {"v": "金额"}, "0_2": {"v": "数量"}, "0_3": {"v": "单价"}}
+    for i in range(1, rows + 1):
+        cells[f"{i}_0"] = {"v": rng.choice(REGIONS), "t": "s"}
+        # 前端写入的金额是文本
+        cells[f"{i}_1"] = {"v": f"{rng.uniform(-500, 5000):.2f}", "t": "s"}
+        cells[f"{i}_2"] = {"v": rng.randrange(1, 100), "t": "n"}
+        cells[f"{i}_3"] = {"v": f"=B{i + 1}/C{i + 1}", "t": "s"}
+    return {"name": "Sheet1", "cellData": cells, "rowCount": rows + 1, "columnCount": 4}
+
+
+def aggregate_by_cells(model: SheetModel, r0: int, r1: int, c0: int, c1: int, group_col: int):
+    """对照实现：逐个单元格读取数值并按分组累加"""
+    groups = {}
+    for row in range(r0, r1 + 1):
+        cell = model.cells.get((row, group_col))
+        key = cell.get("v") if cell else None
+        group = groups.setdefault(key, {})
+        for col in range(c0, c1 + 1):
+            number = model.columns.cell_number((row, col))
+            if number is not None:
+                stats = group.setdefault(col, [0, 0.0, math.inf, -math.inf])
+                stats[0] += 1
+                stats[1] += number
+                stats[2] = min(stats[2], number)
+                stats[3] = max(stats[3], number)
+    return groups
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    model = SheetModel("BENCH", "bench.xlsx", build_data(rows))
+    last = model.row_count - 1
+
+    start = time.perf_counter()
+    model.columns.ensure()
+    print(f"行数: {rows}，构建数值列: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    totals = model.columns.aggregate(1, last, 1, 3)
+    print(f"整列汇总（3列）: {(time.perf_counter() - start) * 1000:.2f}ms  金额合计 {totals['columns'][1]['sum']:.2f}")
+
+    start = time.perf_counter()
+    model.columns.aggregate(1, last, 1, 3, group_col=0)
+    print(f"首次按地区分组（含构建分组列）: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    grouped = model.columns.aggregate(1, last, 1, 3, group_col=0)
+    numpy_time = time.perf_counter() - start
+    print(f"按地区分组汇总（3列）: {numpy_time * 1000:.2f}ms，{len(grouped['groups'])} 组")
+
+    start = time.perf_counter()
+    expected = aggregate_by_cells(model, 1, last, 1, 3, 0)
+    python_time = time.perf_counter() - start
+    print(f"逐单元格分组汇总: {python_time * 1000:.1f}ms（NumPy快 {python_time / numpy_time:.0f} 倍）")
+
+    for group in grouped["groups"]:
+        for col, stats in group["columns"].items():
+            count, total, low, high = expected[group["key"]][col]
+            assert stats["count"] == count and stats["min"] == low and stats["max"] == high
+            assert math.isclose(stats["sum"], total, rel_tol=1e-9)
+
+    # 增量更新：修改金额后公式结果和数值列同步更新
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(1000):
+        row = rng.randrange(1, last + 1)
+        model.apply({"type": "cell_update", "row": row, "col": 1, "value": f"{rng.uniform(0, 100):.2f}"})
+    edit_time = time.perf_counter() - start
+    updated = model.columns.aggregate(1, last, 1, 3, group_col=0)
+    expected_sum = sum(model.columns.cell_number((row, 3)) or 0 for row in range(1, last + 1))
+    assert math.isclose(updated["columns"][3]["sum"], expected_sum, rel_tol=1e-9)
+    assert math.isclose(sum(group["columns"][3]["sum"] for group in updated["groups"]), expected_sum, rel_tol=1e-9)
+    print(f"1000次单元格修改（含公式重算和数值列更新）: {edit_time * 1000:.1f}ms，汇总结果与逐单元格计算一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""公式重算基准测试：约5万个公式的表格，对比修改单个单元格后的增量重算与整体重算的耗时，并验证结果一致
+
+表格结构（N行）：A、B列为数字，C{i}=A{i}*B{i}，D{i}=D{i-1}+C{i}（累计和，依赖链长度N），
+E列每1000行一个 =SUM(C..:C..)，F1=SUM(D1:D{N})。
+
+用法: python benchmarks/bench_formula_recalc.py [行数]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from sheet_model import SheetModel
+
+
+def build_data(rows: int):
+    cells = {}
+
+    def put(row, col, value):
+        cells[f"{row}_{col}"] = {"v": value, "t": "s" if isinstance(value, str) else "n"}
+
+    for i in range(rows):
+        put(i, 0, i % 97)
+        put(i, 1, i % 13 + 1)
+        put(i, 2, f"=A{i + 1}*B{i + 1}")
+        put(i, 3, f"=D{i}+C{i + 1}" if i else "=C1")
+    for k, start in enumerate(range(0, rows, 1000)):
+        put(k, 4, f"=SUM(C{start + 1}:C{min(start + 1000, rows)})")
+    put(0, 5, f"=SUM(D1:D{rows})")
+    return {"name": "Sheet1", "cellData": cells, "rowCount": rows, "columnCount": 6}
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 25000
+    data = build_data(rows)
+
+    start = time.perf_counter()
+    model = SheetModel("BENCH", "bench.xlsx", data)
+    build_time = time.perf_counter() - start
+    formula_count = len(model.formulas.formulas)
+    print(f"公式数: {formula_count}，加载（解析+建立依赖+整体计算）: {build_time:.3f}s")
+
+    start = time.perf_counter()
+    model.formulas.rebuild()
+    full_time = time.perf_counter() - start
+    print(f"整体重算: {full_time:.3f}s")
+
+    edits = [
+        ("与公式无关的单元格", 0, 7),
+        (f"最后一行 A{rows}", rows - 1, 0),
+        (f"中间一行 A{rows // 2 + 1}", rows // 2, 0),
+        ("第一行 A1（累计和整条链）", 0, 0),
+    ]
+    for label, row, col in edits:
+        start = time.perf_counter()
+        changed = model.apply({"type": "cell_update", "row": row, "col": col, "value": "1000"})
+        elapsed = time.perf_counter() - start
+        recalculated = model.formulas.last_recalc_count
+
+        incremental = dict(model.formulas.values)
+        model.formulas.rebuild()
+        assert incremental == model.formulas.values, f"{label}: 增量重算结果与整体重算不一致"
+        print(f"修改{label}: {elapsed * 1000:.1f}ms，重算 {recalculated} 个公式，"
+              f"{len(changed)} 个结果变化（整体重算的 {elapsed / full_time:.1%}）")
+
+    # 循环引用：A1引用累计和的最后一项
+    start = time.perf_counter()
+    changed = model.apply({"type": "cell_update", "row": 0, "col": 0, "value": f"=D{rows}"})
+    elapsed = time.perf_counter() - start
+    print(f"形成循环引用: {elapsed * 1000:.1f}ms，{len(changed)} 个结果变化，"
+          f"A1={model.formulas.values[(0, 0)]} F1={model.formulas.values[(0, 5)]}")
+    print("增量重算结果与整体重算一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""排序、筛选和查找替换基准测试：流水账式表格（地区、金额、数量、备注），在内存模型上执行，
+对比排序操作（行顺序）与逐单元格更新的消息大小，以及按列索引筛选、整格查找与逐行判断的耗时
+
+用法: python benchmarks/bench_sort_filter.py [行数]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from serializer import dumps
+from sheet_model import SheetModel
+from table_ops import filter_rows, find_cells, index_key, plan_replace, plan_sort
+
+REGIONS = ["华东", "华南", "华北", "西南", "西北", "东北", "华中", "海外"]
+
+
+def build_data(rows: int):
+    rng = random.Random(7)
+    cells = {"0_0": {"v": "地区"}, "0_1": {"v": "金额"}, "0_2": {"v": "数量"}, "0_3": {"v": "备注"}}
+    for i in range(1, rows + 1):
+        cells[f"{i}_0"] = {"v": rng.choice(REGIONS), "t": "s"}
+        cells[f"{i}_1"] = {"v": f"{rng.uniform(-500, 5000):.2f}", "t": "s"}
+        cells[f"{i}_2"] = {"v": rng.randrange(1, 100), "t": "n"}
+        cells[f"{i}_3"] = {"v": f"订单{rng.randrange(100000)}", "t": "s"}
+    return {"name": "Sheet1", "cellData": cells, "rowCount": rows + 1, "columnCount": 4}
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    model = SheetModel("BENCH", "bench.xlsx", build_data(rows))
+    last = model.row_count - 1
+    print(f"行数: {rows}")
+
+    # 排序：地区升序、金额降序
+    request = {"r0": 1, "r1": last, "c0": 0, "c1": 3, "keys": [{"col": 0}, {"col": 1, "desc": True}]}
+    start = time.perf_counter()
+    op = plan_sort(model, request)
+    plan_time = time.perf_counter() - start
+    before = {pos: cell.get("v") for pos, cell in model.cells.items()}
+    start = time.perf_counter()
+    model.apply(op)
+    apply_time = time.perf_counter() - start
+    print(f"排序（首次含构建2列索引）: 计算 {plan_time * 1000:.1f}ms，应用 {apply_time * 1000:.1f}ms")
+
+    previous = None
+    for row in range(1, last + 1):
+        key = (index_key(model.cells[(row, 0)]["v"]), -index_key(model.cells[(row, 1)]["v"]))
+        assert previous is None or previous <= key, f"第{row + 1}行顺序错误"
+        previous = key
+    updates = [{"row": row, "col": col, "value": cell.get("v")}
+               for (row, col), cell in model.cells.items() if before.get((row, col)) != cell.get("v")]
+    sort_size = len(dumps(op))
+    update_size = len(dumps({"type": "batch_update", "updates": updates}))
+    print(f"排序消息: {sort_size / 1024:.0f}KB（行顺序），逐单元格更新: {update_size / 1024:.0f}KB，"
+          f"{len(updates)} 个单元格（{update_size / sort_size:.1f} 倍）")
+
+    # 筛选：华东且金额不小于1000
+    predicates = [{"col": 0, "op": "eq", "value": "华东"}, {"col": 1, "op": "ge", "value": 1000}]
+    filter_rows(model, 1, last, predicates)
+    start = time.perf_counter()
+    matched = filter_rows(model, 1, last, predicates)
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [
+        row for row in range(1, last + 1)
+        if model.cell_value((row, 0)) == "华东" and float(model.cell_value((row, 1))) >= 1000
+    ]
+    scan_time = time.perf_counter() - start
+    assert matched == expected
+    print(f"筛选（{len(matched)} 行）: 索引 {index_time * 1000:.2f}ms，逐行判断 {scan_time * 1000:.1f}ms"
+          f"（快 {scan_time / index_time:.0f} 倍）")
+
+    # 修改后索引增量更新，筛选结果与逐行判断一致
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(1000):
+        row = rng.randrange(1, last + 1)
+        model.apply({"type": "cell_update", "row": row, "col": 1, "value": f"{rng.uniform(0, 2000):.2f}"})
+    edit_time = time.perf_counter() - start
+    matched = filter_rows(model, 1, last, predicates)
+    expected = [
+        row for row in range(1, last + 1)
+        if model.cell_value((row, 0)) == "华东" and float(model.cell_value((row, 1))) >= 1000
+    ]
+    assert matched == expected
+    print(f"1000次单元格修改（含索引更新）: {edit_time * 1000:.1f}ms，筛选结果与逐行判断一致")
+
+    # 查找和替换
+    start = time.perf_counter()
+    found = find_cells(model, {"find": "订单123", "c0": 3, "c1": 3})
+    print(f"查找: {(time.perf_counter() - start) * 1000:.1f}ms，{len(found['cells'])} 个单元格")
+    request = {"find": "订单123", "whole": True, "c0": 3, "c1": 3}
+    find_cells(model, request)
+    start = time.perf_counter()
+    found = find_cells(model, request)
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = sorted((row, col) for (row, col), cell in model.cells.items() if col == 3 and cell.get("v") == "订单123")
+    scan_time = time.perf_counter() - start
+    assert [tuple(cell) for cell in found["cells"]] == expected
+    print(f"整格查找（{len(expected)} 个单元格）: 列索引 {index_time * 1000:.2f}ms，逐个单元格判断 {scan_time * 1000:.1f}ms")
+    start = time.perf_counter()
+    op = plan_replace(model, {"find": "海外", "replace": "境外", "whole": True})
+    model.apply(op)
+    print(f"替换: {(time.perf_counter() - start) * 1000:.1f}ms，{len(op['updates'])} 个单元格（一条操作）")
+    assert not filter_rows(model, 1, last, [{"col": 0, "op": "eq", "value": "海外"}])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""稀疏加载基准测试：验证load_sheet_data与原逐格遍历实现输出一致，并对比耗时
+
+用法: python benchmarks/bench_sparse_loader.py [填充单元格数] [远端单元格行号]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from excel_handler import load_sheet_data, extract_cell_style, get_cell_type
+
+
+def load_sheet_data_dense(file_path: str):
+    """原实现：遍历 max(max_row,100) x max(max_column,26) 的每个坐标"""
+    wb = load_workbook(file_path)
+    ws = wb.active
+    max_row = max(ws.max_row, 100)
+    max_col = max(ws.max_column, 26)
+
+    cell_data = {}
+    for row in range(1, max_row + 1):
+        for col in range(1, max_col + 1):
+            cell = ws.cell(row=row, column=col)
+            style = extract_cell_style(cell)
+            value = cell.value
+            if value is not None or (style and len(style) > 0):
+                cell_key = f"{row-1}_{col-1}"
+                cell_data[cell_key] = {}
+                if value is not None:
+                    cell_data[cell_key]["v"] = value
+                    cell_data[cell_key]["t"] = get_cell_type(value)
+                if style:
+                    cell_data[cell_key].update(style)
+
+    merges = [{
+        "startRow": r.min_row - 1, "endRow": r.max_row - 1,
+        "startColumn": r.min_col - 1, "endColumn": r.max_col - 1,
+    } for r in ws.merged_cells.ranges]
+
+    col_widths = {}
+    for col in range(1, max_col + 1):
+        col_letter = get_column_letter(col)
+        if col_letter in ws.column_dimensions:
+            width = ws.column_dimensions[col_letter].width
+            if width:
+                col_widths[col - 1] = int(width * 7)
+
+    row_heights = {}
+    for row in range(1, max_row + 1):
+        if row in ws.row_dimensions:
+            height = ws.row_dimensions[row].height
+            if height:
+                row_heights[row - 1] = int(height)
+
+    return {
+        "cellData": cell_data, "mergeData": merges, "columnData": col_widths,
+        "rowData": row_heights, "rowCount": max_row, "columnCount": max_col,
+    }
+
+
+def expand_default_style(data):
+    """将稀疏输出中的默认样式展开到整个区域，得到与原实现等价的cellData"""
+    cell_data = dict(data["cellData"])
+    default_style = data.get("defaultStyle")
+    if default_style:
+        for row in range(data["rowCount"]):
+            for col in range(data["columnCount"]):
+                cell_data.setdefault(f"{row}_{col}", dict(default_style))
+    return cell_data
+
+
+def build_workbook(file_path: str, populated: int, far_row: int):
+    wb = Workbook()
+    ws = wb.active
+    bold = Font(bold=True, color="FF0000")
+    fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    border = Border(top=Side(style="thin", color="000000"))
+    for i in range(populated):
+        row, col = i // 10 + 1, i % 10 + 1
+        cell = ws.cell(row=row, column=col, value=i if i % 3 else f"text{i}")
+        if i % 7 == 0:
+            cell.font = bold
+        if i % 11 == 0:
+            cell.fill = fill
+        if i % 13 == 0:
+            cell.border = border
+    ws.merge_cells("A1:B2")
+    ws.column_dimensions["C"].width = 20
+    ws.row_dimensions[3].height = 30
+    # 远端的一个带格式的空单元格，使原实现的遍历区域变得很大
+    ws.cell(row=far_row, column=52).fill = fill
+    wb.save(file_path)
+
+
+def main():
+    populated = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    far_row = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "bench.xlsx")
+        build_workbook(file_path, populated, far_row)
+
+        start = time.perf_counter()
+        dense = load_sheet_data_dense(file_path)
+        dense_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sparse = load_sheet_data(file_path)
+        sparse_time = time.perf_counter() - start
+
+    for key in ("mergeData", "columnData", "rowData", "rowCount", "columnCount"):
+        assert dense[key] == sparse[key], f"{key} 不一致"
+    assert expand_default_style(sparse) == dense["cellData"], "cellData 不一致"
+
+    print(f"区域: {dense['rowCount']} x {dense['columnCount']}，填充单元格: {populated}")
+    print(f"输出条目: 原实现 {len(dense['cellData'])}，稀疏 {len(sparse['cellData'])}")
+    print(f"原实现: {dense_time:.3f}s")
+    print(f"稀疏:   {sparse_time:.3f}s  ({dense_time / sparse_time:.1f}x)")
+    print("输出一致")
+
+
+if __name__ == "__main__":
+    main()
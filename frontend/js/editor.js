@@ -10,12 +10,19 @@ let currentUserId = null;
 let onlineUsers = [];
 let isUpdatingFromRemote = false;  // 防止循环更新
 let historyCount = 20;  // 历史记录显示条数
+let historyEntries = [];  // 当前显示的历史记录（最新的在前）
+let lastHistorySeq = 0;   // 已收到的最新历史记录序号
 let syncInterval = 3000;  // 定时同步间隔（毫秒）
 let pendingCellUpdate = null;  // 待发送的单元格更新（退出编辑状态时发送）
 let lastSelectedCell = null;  // 上次选中的单元格位置
 let isEditTextareaUpdating = false;  // 防止编辑窗口循环更新
 let currentEditCell = { row: -1, col: -1 };  // 当前编辑的单元格位置
 let lastDimensions = { cols: {}, rows: {} };  // 上次记录的列宽行高
+let sheetVersion = 0;  // 已同步的表格版本号
+let sheetEpoch = '';  // 服务端表格模型标识（服务端重新加载后改变）
+let appliedVersions = new Set();  // 已通过WebSocket应用、版本号大于sheetVersion的修改
+let resyncOnConnect = false;  // 重新连接后是否需要重新加载整个表格
+let formulaValues = {};  // 服务端计算的公式结果: {"row_col": 值}
 
 // 用户颜色映射
 const userColors = [
@@ -157,7 +164,35 @@ async function loadSheetData() {
     if (!response.ok) {
         throw new Error('无法加载表格数据');
     }
-    return await response.json();
+    const sheetData = await response.json();
+    if ((sheetData.epoch || '') !== sheetEpoch) {
+        appliedVersions = new Set();
+    }
+    setSheetVersion(sheetData.version || 0);
+    sheetEpoch = sheetData.epoch || '';
+    formulaValues = sheetData.formulaValues || {};
+    refreshEditCellInfo();
+    return sheetData;
+}
+
+// 更新已同步的版本号，并丢弃已被覆盖的WebSocket版本记录
+function setSheetVersion(version) {
+    sheetVersion = version;
+    for (const applied of appliedVersions) {
+        if (applied <= version) {
+            appliedVersions.delete(applied);
+        }
+    }
+}
+
+// 通过WebSocket收到的修改是否需要应用：同一版本的修改也会出现在定时同步的结果中，
+// 插入/删除行列等修改重复应用会导致数据错位，已应用过的版本跳过
+function acceptRemoteVersion(message) {
+    const version = message.version;
+    if (!version) return true;
+    if (version <= sheetVersion || appliedVersions.has(version)) return false;
+    appliedVersions.add(version);
+    return true;
 }
 
 // 初始化电子表格
@@ -196,13 +231,16 @@ function initSpreadsheet(sheetData) {
                 width: 100,
                 indexWidth: 60,
                 minWidth: 60
-            }
+            },
+            // 表格默认样式（未单独设置格式的单元格使用）
+            style: sheetData.defaultStyle ? convertCellStyle(sheetData.defaultStyle) : {}
         });
 
         // 加载数据
         console.log('加载数据到表格...');
         console.log('加载的数据结构:', JSON.stringify(xsData, null, 2));
         spreadsheet.loadData(xsData);
+        installFormulaDisplay();
         console.log('数据加载完成');
 
         // 调试：检查加载后的单元格数据
@@ -534,14 +572,28 @@ async function connectWebSocket() {
     websocket.onopen = () => {
         console.log('WebSocket连接已建立');
         startHeartbeat();
+        if (resyncOnConnect) {
+            resyncOnConnect = false;
+            resyncSheet();
+        }
     };
 
     websocket.onmessage = (event) => {
-        handleWebSocketMessage(JSON.parse(event.data));
+        const data = JSON.parse(event.data);
+        // 服务端会将同一周期内的多条消息合并为数组发送
+        if (Array.isArray(data)) {
+            data.forEach(handleWebSocketMessage);
+        } else {
+            handleWebSocketMessage(data);
+        }
     };
 
     websocket.onclose = (event) => {
         console.log('WebSocket连接已关闭', event.code, event.reason);
+        // 4008: 网络太慢导致服务端发送队列溢出，期间的消息已丢弃，重连后需重新加载表格
+        if (event.code === 4008) {
+            resyncOnConnect = true;
+        }
         showToast('连接已断开，正在重连...', 'info');
         setTimeout(connectWebSocket, 3000);
     };
@@ -562,6 +614,9 @@ function startHeartbeat() {
 
 // 处理WebSocket消息
 function handleWebSocketMessage(message) {
+    if (SYNCED_OP_TYPES.includes(message.type) && !acceptRemoteVersion(message)) {
+        return;
+    }
     switch (message.type) {
         case 'connected':
             currentUserId = message.user_id;
@@ -587,6 +642,35 @@ function handleWebSocketMessage(message) {
             applyRemoteBatchUpdate(message);
             break;
 
+        case 'range_set':
+        case 'range_clear':
+        case 'range_style':
+        case 'insert_rows':
+        case 'delete_rows':
+        case 'insert_cols':
+        case 'delete_cols':
+            applyRemoteRangeOp(message);
+            break;
+
+        case 'sort_range':
+            applyRemoteSort(message);
+            break;
+
+        case 'find_replace':
+            applyRemoteBatchUpdate(message);
+            if (message.user_id === currentUserId) {
+                showToast(`已替换 ${message.updates.length} 处`, 'success');
+            }
+            break;
+
+        case 'error':
+            showToast(message.message || '操作失败', 'error');
+            break;
+
+        case 'formula_values':
+            applyFormulaValues(message.values);
+            break;
+
         case 'selection_change':
             showCollaboratorSelection(message);
             break;
@@ -595,13 +679,25 @@ function handleWebSocketMessage(message) {
             // 心跳响应
             break;
 
+        case 'history_append':
+            appendHistoryEntry(message.entry);
+            break;
+
         case 'history_update':
-            updateHistoryPanel(message.history);
+            historyEntries = message.history || [];
+            lastHistorySeq = historyEntries.length > 0 ? historyEntries[0].seq || 0 : lastHistorySeq;
+            updateHistoryPanel(historyEntries);
             break;
 
         case 'dimension_update':
             applyRemoteDimensionUpdate(message);
             break;
+
+        case 'resync':
+            // 管理员恢复了历史版本，重新加载整个表格
+            showToast('表格已恢复到历史版本', 'info');
+            resyncSheet();
+            break;
     }
 }
 
@@ -672,6 +768,87 @@ function applyRemoteBatchUpdate(message) {
     }
 }
 
+// 区域操作类型（服务端作为一条操作广播）
+const RANGE_OP_TYPES = ['range_set', 'range_clear', 'range_style', 'insert_rows', 'delete_rows', 'insert_cols', 'delete_cols'];
+// 带版本号广播、同时出现在定时同步结果中的修改操作类型
+const SYNCED_OP_TYPES = ['cell_update', 'batch_update', 'dimension_update', 'sort_range', 'find_replace', ...RANGE_OP_TYPES];
+
+// 应用远程区域操作：写入值和清除值直接更新单元格，格式和行列结构变化重新加载表格
+function applyRemoteRangeOp(message) {
+    if (!spreadsheet) return;
+
+    const valuesOnly = (message.type === 'range_set' && !message.style) ||
+        (message.type === 'range_clear' && !message.formats);
+    if (!valuesOnly) {
+        resyncSheet();
+        return;
+    }
+
+    isUpdatingFromRemote = true;
+    try {
+        if (message.type === 'range_set') {
+            message.values.forEach((rowValues, i) => {
+                rowValues.forEach((value, j) => {
+                    spreadsheet.cellText(message.r0 + i, message.c0 + j, value !== null ? String(value) : '');
+                });
+            });
+        } else {
+            for (let row = message.r0; row <= message.r1; row++) {
+                for (let col = message.c0; col <= message.c1; col++) {
+                    spreadsheet.cellText(row, col, '');
+                }
+            }
+        }
+        spreadsheet.reRender();
+    } catch (error) {
+        console.error('应用区域操作失败:', error);
+    } finally {
+        isUpdatingFromRemote = false;
+    }
+}
+
+// 应用排序：按服务端给出的行顺序移动区域内的单元格（连同格式），不逐个单元格更新
+function applyRemoteSort(message) {
+    if (!spreadsheet) return;
+
+    isUpdatingFromRemote = true;
+    try {
+        const { r0, c0, c1, order } = message;
+        const data = spreadsheet.getData();
+        if (!data || !data[0]) return;
+
+        const rows = data[0].rows || (data[0].rows = {});
+        // 先取出区域内每行的单元格，再放到排序后的行
+        const picked = order.map((_, i) => {
+            const row = rows[r0 + i];
+            const cells = {};
+            if (row && row.cells) {
+                for (let col = c0; col <= c1; col++) {
+                    if (row.cells[col] !== undefined) {
+                        cells[col] = row.cells[col];
+                        delete row.cells[col];
+                    }
+                }
+            }
+            return cells;
+        });
+        order.forEach((oldIndex, i) => {
+            const cells = picked[oldIndex];
+            if (Object.keys(cells).length === 0) return;
+            if (!rows[r0 + i]) rows[r0 + i] = {};
+            if (!rows[r0 + i].cells) rows[r0 + i].cells = {};
+            Object.assign(rows[r0 + i].cells, cells);
+        });
+
+        spreadsheet.loadData(data);
+        spreadsheet.reRender();
+    } catch (error) {
+        console.error('应用排序失败:', error);
+    } finally {
+        isUpdatingFromRemote = false;
+    }
+}
+
 // 显示单元格更新指示器
 function showCellUpdateIndicator(row, col, userName) {
     // 简单的闪烁效果（通过临时改变背景色实现）
@@ -783,12 +960,39 @@ async function loadHistory() {
     try {
         const response = await fetch(`/api/sheet/${sheetKey}/history`);
         const data = await response.json();
-        updateHistoryPanel(data.history || []);
+        historyEntries = data.history || [];
+        lastHistorySeq = data.seq || 0;
+        updateHistoryPanel(historyEntries);
     } catch (error) {
         console.error('加载历史记录失败:', error);
     }
 }
 
+// 追加一条历史记录，序号不连续时（有遗漏）向服务器补齐
+async function appendHistoryEntry(entry) {
+    if (!entry || entry.seq <= lastHistorySeq) {
+        return;
+    }
+
+    let newEntries = [entry];
+    if (lastHistorySeq > 0 && entry.seq > lastHistorySeq + 1) {
+        try {
+            const since = lastHistorySeq;
+            const response = await fetch(`/api/sheet/${sheetKey}/history?since=${since}`);
+            const data = await response.json();
+            newEntries = data.history && data.history.length > 0 ? data.history : newEntries;
+            // 补齐期间可能已收到更新的记录，以服务器返回的为准重新合并
+            historyEntries = historyEntries.filter(item => item.seq <= since);
+        } catch (error) {
+            console.error('补齐历史记录失败:', error);
+        }
+    }
+
+    lastHistorySeq = Math.max(lastHistorySeq, newEntries[0].seq);
+    historyEntries = newEntries.concat(historyEntries).slice(0, historyCount);
+    updateHistoryPanel(historyEntries);
+}
+
 // 初始化历史面板
 function initHistoryPanel() {
     const panel = document.getElementById('historyPanel');
@@ -880,7 +1084,7 @@ function makeDraggable(element) {
 
 // ==================== 定时同步功能 ====================
 
-// 启动定时同步
+// 启动定时同步（只拉取上次同步之后的增量修改）
 function startPeriodicSync() {
     setInterval(async () => {
         // 如果有待发送的更新，先发送
@@ -889,12 +1093,19 @@ function startPeriodicSync() {
             pendingCellUpdate = null;
         }
 
-        // 重新加载表格数据并同步
         try {
-            const response = await fetch(`/api/sheet/${sheetKey}`);
-            if (response.ok) {
-                const sheetData = await response.json();
-                syncSheetData(sheetData);
+            const params = `since=${sheetVersion}&epoch=${encodeURIComponent(sheetEpoch)}`;
+            const response = await fetch(`/api/sheet/${sheetKey}/changes?${params}`);
+            if (!response.ok) return;
+
+            const result = await response.json();
+            if (result.resync) {
+                // 版本差距过大或服务端已重新加载，重新获取整个表格
+                await resyncSheet();
+            } else {
+                applyChanges(result.changes || []);
+                setSheetVersion(result.version);
+                sheetEpoch = result.epoch;
             }
         } catch (error) {
             console.error('定时同步失败:', error);
@@ -902,6 +1113,49 @@ function startPeriodicSync() {
     }, syncInterval);
 }
 
+// 重新加载整个表格并同步
+async function resyncSheet() {
+    try {
+        const sheetData = await loadSheetData();
+        syncSheetData(sheetData);
+    } catch (error) {
+        console.error('重新同步失败:', error);
+    }
+}
+
+// 应用增量修改
+function applyChanges(changes) {
+    for (const change of changes) {
+        // 已通过WebSocket应用过的修改
+        if (appliedVersions.has(change.version)) {
+            continue;
+        }
+        if (change.formulaValues) {
+            applyFormulaValues(change.formulaValues);
+        }
+        switch (change.type) {
+            case 'cell_update':
+                applyRemoteCellUpdate(change);
+                break;
+            case 'batch_update':
+            case 'find_replace':
+                applyRemoteBatchUpdate(change);
+                break;
+            case 'sort_range':
+                applyRemoteSort(change);
+                break;
+            case 'dimension_update':
+                applyRemoteDimensionUpdate(change);
+                break;
+            default:
+                if (RANGE_OP_TYPES.includes(change.type)) {
+                    applyRemoteRangeOp(change);
+                }
+                break;
+        }
+    }
+}
+
 // 同步表格数据（只更新有差异的单元格）
 function syncSheetData(sheetData) {
     if (!spreadsheet || !sheetData) return;
@@ -1003,12 +1257,9 @@ function updateEditPanel(row, col) {
     currentEditCell.row = row;
     currentEditCell.col = col;
 
-    const cellInfo = document.getElementById('editCellInfo');
     const textarea = document.getElementById('editTextarea');
 
-    // 获取列字母（A, B, C...）
-    const colLetter = String.fromCharCode(65 + col);
-    cellInfo.textContent = `${colLetter}${row + 1}`;
+    refreshEditCellInfo();
 
     // 获取单元格值并显示在编辑窗口
     if (spreadsheet) {
@@ -1019,6 +1270,60 @@ function updateEditPanel(row, col) {
     }
 }
 
+// 更新编辑窗口的单元格位置，公式单元格同时显示服务端计算的结果
+function refreshEditCellInfo() {
+    const { row, col } = currentEditCell;
+    if (row < 0 || col < 0) return;
+
+    // 获取列字母（A, B, C...）
+    const colLetter = String.fromCharCode(65 + col);
+    const key = `${row}_${col}`;
+    const cellInfo = document.getElementById('editCellInfo');
+    cellInfo.textContent = key in formulaValues
+        ? `${colLetter}${row + 1} = ${formulaValues[key]}`
+        : `${colLetter}${row + 1}`;
+}
+
+// 合并公式结果的变化（值为null表示单元格不再是公式）
+function applyFormulaValues(values) {
+    const entries = Object.entries(values || {});
+    for (const [key, value] of entries) {
+        if (value === null) {
+            delete formulaValues[key];
+        } else {
+            formulaValues[key] = value;
+        }
+    }
+    refreshEditCellInfo();
+    if (spreadsheet && entries.length > 0) {
+        spreadsheet.reRender();
+    }
+}
+
+// 绘制表格时公式单元格显示服务端计算的结果，单元格内容仍是公式（编辑时显示公式）
+function installFormulaDisplay() {
+    const table = spreadsheet.sheet.table;
+    const render = table.render;
+    table.render = function (...args) {
+        const data = this.data;
+        const getCell = data.getCell;
+        data.getCell = function (ri, ci) {
+            const cell = getCell.call(this, ri, ci);
+            const key = `${ri}_${ci}`;
+            if (cell && typeof cell.text === 'string' && cell.text.startsWith('=') && key in formulaValues) {
+                return { ...cell, text: String(formulaValues[key]) };
+            }
+            return cell;
+        };
+        try {
+            return render.apply(this, args);
+        } finally {
+            data.getCell = getCell;
+        }
+    };
+    spreadsheet.reRender();
+}
+
 // ==================== 列宽行高同步功能 ====================
 
 // 检查并同步列宽行高
@@ -0,0 +1,79 @@
+"""公式计算：结果、增量重算、循环引用和结果的序列化"""
+import time
+
+import pytest
+
+from serializer import dumps, loads
+from sheet_model import SheetModel
+
+
+def make_model(cells):
+    data = {"name": "Sheet1", "cellData": {key: {"v": value} for key, value in cells.items()}}
+    return SheetModel("TEST", "test.xlsx", data)
+
+
+def value(model, row, col):
+    return model.cell_value((row, col))
+
+
+@pytest.mark.parametrize("formula, expected", [
+    ("=1+2*3", 7),
+    ("=(1+2)*3", 9),
+    ("=2^10", 1024),
+    ("=7/2", 3.5),
+    ("=1/0", "#DIV/0!"),
+    ("=50%", 0.5),
+    ('="a"&"b"', "ab"),
+    ("=SUM(A1:A3)", 6),
+    ("=AVERAGE(A1:A3)", 2),
+    ("=IF(A1>1,\"big\",\"small\")", "small"),
+    ("=ROUND(2.345,2)", 2.35),
+    ("=ROUND(-2.5,0)", -3),
+    ("=ROUND(1234.5,-2)", 1200),
+    ("=IFERROR(1/0,0)", 0),
+    ("=FOO(1)", "#NAME?"),
+    ("=(-8)^(1/3)", "#NUM!"),
+])
+def test_formula_results(formula, expected):
+    model = make_model({"0_0": 1, "1_0": "2", "2_0": 3, "0_1": formula})
+    assert value(model, 0, 1) == expected
+
+
+def test_edit_recalculates_dependents():
+    model = make_model({"0_0": 1, "0_1": "=A1*2", "0_2": "=B1+1", "1_0": "=SUM(A1:A1)"})
+    changes = model.apply({"type": "cell_update", "row": 0, "col": 0, "value": "5"})
+    assert changes == {"0_1": 10, "0_2": 11, "1_0": 5}
+    # 结果没有变化的公式不返回
+    assert model.apply({"type": "cell_update", "row": 5, "col": 5, "value": "x"}) == {}
+
+
+def test_cycle_marks_formulas():
+    model = make_model({"0_0": "=B1", "0_1": "=A1", "0_2": "=A1+1", "0_3": 1})
+    assert value(model, 0, 0) == "#CIRC!"
+    assert value(model, 0, 2) == "#CIRC!"
+    # 打破循环后恢复计算
+    changes = model.apply({"type": "cell_update", "row": 0, "col": 1, "value": "=D1"})
+    assert changes == {"0_0": 1, "0_1": 1, "0_2": 2}
+
+
+def test_formula_removed_reports_none():
+    model = make_model({"0_0": "=1+1"})
+    assert model.apply({"type": "cell_update", "row": 0, "col": 0, "value": "3"}) == {"0_0": None}
+
+
+@pytest.mark.parametrize("formula", ["=2^100", "=A2*A2*A2", "=9^99999999", "=POWER(10,400)"])
+def test_large_results_serialize(formula):
+    model = make_model({"0_0": formula, "1_0": 9007199254740993})
+    result = value(model, 0, 0)
+    assert not isinstance(result, int) or abs(result) <= 2 ** 53
+    # 公式结果随整个表格一起序列化返回
+    _, body = model.render_body("identity")
+    assert loads(body)["formulaValues"]["0_0"] == result
+    dumps(model.apply({"type": "cell_update", "row": 1, "col": 0, "value": "3"}))
+
+
+@pytest.mark.parametrize("formula", ["=ROUND(1,20000000)", "=ROUND(1,-20000000)", "=9^99999999"])
+def test_huge_arguments_do_not_block(formula):
+    start = time.perf_counter()
+    make_model({"0_0": formula})
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,124 @@
+"""journal重放和崩溃恢复"""
+import asyncio
+
+import pytest
+
+import journal as journal_module
+from cell_store import write_cell_store
+from excel_handler import write_sheet_data
+from journal import OpJournal, read_segments, replay_segments, segment_path
+from serializer import dumps, loads
+from storage import load_sheet
+
+BASE = {"name": "Sheet1", "cellData": {}, "defaultStyle": {"fs": 11.0, "ff": "Calibri"}}
+
+
+@pytest.fixture(params=["xlsx", "sqlite"])
+def sheet_file(request, tmp_path):
+    if request.param == "xlsx":
+        path = str(tmp_path / "sheet.xlsx")
+        write_sheet_data(dict(BASE), path)
+    else:
+        path = str(tmp_path / "sheet.sqlite")
+        write_cell_store(dict(BASE), path)
+    return path
+
+
+@pytest.fixture
+def journal_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "JOURNAL_DIR", tmp_path / "journal")
+    monkeypatch.setattr(journal_module, "FAILED_DIR", tmp_path / "journal_failed")
+    (tmp_path / "journal").mkdir()
+    return tmp_path
+
+
+def values(path):
+    return {key: cell.get("v") for key, cell in load_sheet(path)["cellData"].items()}
+
+
+def test_replay_applies_ops_in_order(sheet_file):
+    entries = [
+        (1, {"type": "cell_update", "row": 0, "col": 0, "value": "a"}),
+        (2, {"type": "insert_rows", "at": 0, "count": 1}),
+        (3, {"type": "batch_update", "updates": [{"row": 0, "col": 1, "value": 5}]}),
+    ]
+    assert replay_segments(sheet_file, entries) == (3, [])
+    assert values(sheet_file) == {"1_0": "a", "0_1": 5}
+
+
+def test_replay_skips_saved_ops(sheet_file):
+    entries = [
+        (1, {"type": "insert_rows", "at": 0, "count": 1}),
+        (2, {"type": "cell_update", "row": 0, "col": 0, "value": "a"}),
+    ]
+    replay_segments(sheet_file, entries)
+    # 插入行不是幂等的，已写入表格文件的操作不能再次应用
+    assert replay_segments(sheet_file, entries) == (0, [])
+    assert values(sheet_file) == {"0_0": "a"}
+
+
+def test_replay_skips_op_that_cannot_be_applied(sheet_file):
+    entries = [
+        (1, {"type": "cell_update", "row": 0, "col": 0, "value": "good"}),
+        (2, {"type": "cell_update", "row": "a", "col": 0, "value": "bad"}),
+        (3, {"type": "cell_update", "row": 1, "col": 0, "value": "after"}),
+    ]
+    count, skipped = replay_segments(sheet_file, entries)
+    assert count == 2
+    assert [seq for seq, _, _ in skipped] == [2]
+    assert values(sheet_file) == {"0_0": "good", "1_0": "after"}
+
+
+def write_segment(sheet_key, entries):
+    path = segment_path(sheet_key, 1)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        for seq, op in entries:
+            f.write(dumps({"seq": seq, "op": op}) + b"\n")
+        # 写入中断的最后一行
+        f.write(b'{"seq": 9, "op"')
+
+
+def test_read_segments_ignores_torn_line(journal_dirs):
+    write_segment("K1", [(1, {"type": "cell_update", "row": 0, "col": 0, "value": 1})])
+    assert read_segments("K1") == [(1, {"type": "cell_update", "row": 0, "col": 0, "value": 1})]
+
+
+def test_recover_quarantines_bad_ops(journal_dirs, sheet_file):
+    write_segment("K1", [
+        (1, {"type": "cell_update", "row": "a", "col": 0, "value": "bad"}),
+        (2, {"type": "cell_update", "row": 0, "col": 0, "value": "good"}),
+    ])
+    recovered = asyncio.run(OpJournal().recover({"K1": sheet_file}))
+    assert recovered == {"K1": 1}
+    assert values(sheet_file) == {"0_0": "good"}
+    assert not (journal_dirs / "journal" / "K1").exists()
+    failed = [loads(line) for line in (journal_dirs / "journal_failed" / "K1.jsonl").read_bytes().splitlines()]
+    assert [entry["seq"] for entry in failed] == [1]
+
+
+def test_recover_continues_after_sheet_failure(journal_dirs, sheet_file, tmp_path):
+    broken = tmp_path / "broken.xlsx"
+    broken.write_bytes(b"not a workbook")
+    write_segment("BAD", [(1, {"type": "cell_update", "row": 0, "col": 0, "value": 1})])
+    write_segment("K1", [(1, {"type": "cell_update", "row": 0, "col": 0, "value": 2})])
+    recovered = asyncio.run(OpJournal().recover({"BAD": str(broken), "K1": sheet_file}))
+    assert recovered == {"K1": 1}
+    assert values(sheet_file) == {"0_0": 2}
+    # 无法恢复的表格的journal移到journal_failed，不再在启动时重放
+    assert not (journal_dirs / "journal" / "BAD").exists()
+    assert any(path.name.startswith("BAD-") for path in (journal_dirs / "journal_failed").iterdir())
+
+
+def test_journal_rotation_removes_saved_segments(journal_dirs):
+    async def run():
+        journal = OpJournal()
+        journal.append("K1", {"type": "cell_update", "row": 0, "col": 0, "value": 1}, 1)
+        sealed = journal.rotate("K1")
+        journal.append("K1", {"type": "cell_update", "row": 0, "col": 0, "value": 2}, 2)
+        await journal.seal(sealed)
+        journal.remove_sealed("K1")
+        journal.close_all()
+
+    asyncio.run(run())
+    assert read_segments("K1") == [(2, {"type": "cell_update", "row": 0, "col": 0, "value": 2})]
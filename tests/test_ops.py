@@ -0,0 +1,47 @@
+"""修改操作在写入journal之前的校验"""
+import pytest
+
+from cell_ops import MAX_COLS, normalize_cell_op
+from range_ops import MAX_STYLE_CELLS, normalize_op
+
+
+@pytest.mark.parametrize("op", [
+    {"type": "cell_update", "row": "a", "col": 0, "value": "x"},
+    {"type": "cell_update", "row": -1, "col": 0},
+    {"type": "cell_update", "row": 0, "col": MAX_COLS},
+    {"type": "cell_update", "row": 0, "col": 0, "value": {"v": 1}},
+    {"type": "cell_update", "row": 0, "col": 0, "value": 2 ** 70},
+    {"type": "cell_update", "row": 0, "col": 0, "style": "bold"},
+    {"type": "batch_update", "updates": []},
+    {"type": "batch_update", "updates": [{"row": 0, "col": None}]},
+    {"type": "dimension_update", "col_widths": {"x": 10}},
+    {"type": "dimension_update", "row_heights": {"1": -5}},
+])
+def test_invalid_cell_ops_rejected(op):
+    with pytest.raises(ValueError):
+        normalize_cell_op(op)
+
+
+def test_cell_ops_normalized():
+    assert normalize_cell_op({"type": "cell_update", "row": 1, "col": 2, "value": 3, "extra": 1}) == {
+        "type": "cell_update", "row": 1, "col": 2, "value": 3, "style": None
+    }
+    assert normalize_cell_op({"type": "dimension_update", "col_widths": {1: 120.6}}) == {
+        "type": "dimension_update", "col_widths": {"1": 120}, "row_heights": None
+    }
+
+
+@pytest.mark.parametrize("op", [
+    {"type": "range_set", "r0": 0, "c0": 0, "values": [[[1]]]},
+    {"type": "range_clear", "r0": 0, "r1": 0, "c0": 0, "c1": MAX_COLS},
+    {"type": "insert_cols", "at": MAX_COLS, "count": 1},
+    {"type": "range_style", "r0": 0, "r1": MAX_STYLE_CELLS, "c0": 0, "c1": 0, "style": {"bold": True}},
+])
+def test_invalid_range_ops_rejected(op):
+    with pytest.raises(ValueError):
+        normalize_op(op)
+
+
+def test_range_style_within_limit():
+    op = normalize_op({"type": "range_style", "r0": 0, "r1": MAX_STYLE_CELLS - 1, "c0": 0, "c1": 0, "style": {"bold": True}})
+    assert op["style"] == {"bold": True}
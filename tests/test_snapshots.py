@@ -0,0 +1,112 @@
+"""版本快照：分块保存、对比和恢复"""
+import asyncio
+
+import pytest
+
+import snapshots as snapshots_module
+from cell_store import write_cell_store
+from excel_handler import write_sheet_data
+from sheet_model import SheetModel
+from snapshots import (CHUNK_ROWS, SnapshotManager, diff_snapshots, list_snapshots, load_snapshot,
+                       save_snapshot)
+from storage import load_sheet, replace_sheet_data
+
+
+@pytest.fixture(autouse=True)
+def snapshot_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots_module, "SNAPSHOT_DB", tmp_path / "snapshots.db")
+
+
+def make_model(rows=1000):
+    cells = {f"{row}_{col}": {"v": f"r{row}c{col}"} for row in range(rows) for col in range(3)}
+    data = {"name": "Sheet1", "cellData": cells, "columnData": {"1": 150}, "rowCount": rows, "columnCount": 3}
+    return SheetModel("SNAP", "snap.xlsx", data)
+
+
+def capture(model):
+    return SnapshotManager()._capture(model)
+
+
+def save(model, label="test", keep=10, force=False):
+    version, meta, cells = capture(model)
+    return save_snapshot(model.sheet_key, label, version, meta, cells, keep, force)
+
+
+def test_unchanged_sheet_shares_chunks():
+    model = make_model()
+    first = save(model)
+    assert first["chunk_count"] == first["new_chunks"] == -(-1000 // CHUNK_ROWS)
+    # 内容相同不新增版本
+    assert save(model) is None
+    model.apply({"type": "cell_update", "row": 5, "col": 0, "value": "edited"})
+    second = save(model)
+    # 只有被修改的块是新的
+    assert second["new_chunks"] == 1
+    assert [s["id"] for s in list_snapshots("SNAP")] == [second["id"], first["id"]]
+
+
+def test_diff_lists_changed_cells():
+    model = make_model()
+    first = save(model)
+    model.apply({"type": "cell_update", "row": 5, "col": 0, "value": "edited"})
+    model.apply({"type": "cell_update", "row": 700, "col": 2, "value": None})
+    model.apply({"type": "cell_update", "row": 2000, "col": 0, "value": "new"})
+    model.apply({"type": "dimension_update", "col_widths": {"1": 200}})
+    second = save(model)
+
+    diff = diff_snapshots("SNAP", first["id"], second["id"])
+    assert diff["counts"] == {"added": 1, "removed": 1, "changed": 1}
+    assert [(cell["row"], cell["col"], cell["change"]) for cell in diff["cells"]] == [
+        (5, 0, "changed"), (700, 2, "removed"), (2000, 0, "added")
+    ]
+    assert diff["changed_chunks"] == 3
+    assert "columnData" in diff["meta_changed"]
+    assert diff_snapshots("SNAP", first["id"], 9999) is None
+
+
+def test_keep_removes_oldest_versions():
+    model = make_model(10)
+    ids = []
+    for i in range(4):
+        model.apply({"type": "cell_update", "row": 0, "col": 0, "value": i})
+        ids.append(save(model, keep=2)["id"])
+    assert [s["id"] for s in list_snapshots("SNAP")] == ids[:1:-1]
+    assert load_snapshot("SNAP", ids[0]) is None
+
+
+@pytest.mark.parametrize("engine", ["xlsx", "sqlite"])
+def test_restore_writes_snapshot_to_sheet_file(engine, tmp_path):
+    model = make_model(300)
+    snapshot_id = save(model)["id"]
+    model.apply({"type": "insert_rows", "at": 0, "count": 5})
+    model.apply({"type": "cell_update", "row": 0, "col": 0, "value": "later"})
+
+    path = str(tmp_path / f"sheet.{engine}")
+    base = {"name": "Sheet1", "cellData": {"0_0": {"v": "current"}}}
+    write_sheet_data(base, path) if engine == "xlsx" else write_cell_store(base, path)
+
+    data = load_snapshot("SNAP", snapshot_id)
+    replace_sheet_data(path, data)
+    restored = load_sheet(path)
+    assert {key: cell.get("v") for key, cell in restored["cellData"].items()} == {
+        f"{row}_{col}": f"r{row}c{col}" for row in range(300) for col in range(3)
+    }
+    assert restored["columnData"] == {1: 150}
+    # 恢复后的数据可以直接构建内存模型
+    assert SheetModel("SNAP", path, restored).cell_value((299, 2)) == "r299c2"
+
+
+def test_before_first_edit_snapshot_is_awaited_on_stop():
+    async def run():
+        manager = SnapshotManager()
+        model = make_model(10)
+        manager.before_first_edit(model)
+        model.apply({"type": "cell_update", "row": 0, "col": 0, "value": "edited"})
+        assert manager.pending
+        await manager.stop()
+        assert not manager.pending
+
+    asyncio.run(run())
+    [snapshot] = list_snapshots("SNAP")
+    assert snapshot["label"] == "编辑前"
+    assert load_snapshot("SNAP", snapshot["id"])["cellData"]["0_0"]["v"] == "r0c0"
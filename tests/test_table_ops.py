@@ -0,0 +1,176 @@
+"""排序、筛选和查找替换"""
+import random
+
+import pytest
+
+import table_ops
+from sheet_model import SheetModel
+from table_ops import filter_rows, find_cells, index_key, plan_replace, plan_sort
+
+
+def make_model(columns, merges=()):
+    cells = {}
+    for col, values in enumerate(columns):
+        for row, value in enumerate(values):
+            if value is not None:
+                cells[f"{row}_{col}"] = {"v": value}
+    return SheetModel("TEST", "test.xlsx", {"cellData": cells, "mergeData": list(merges)})
+
+
+def column(model, col, rows):
+    return [model.cell_value((row, col)) for row in rows]
+
+
+def test_sort_numbers_before_text_and_empty_last():
+    model = make_model([["b", 10, None, "2", "A", 1.5], [1, 2, 3, 4, 5, 6]])
+    op = plan_sort(model, {"r0": 0, "r1": 5, "c0": 0, "c1": 1, "keys": [{"col": 0}]})
+    model.apply(op)
+    assert column(model, 0, range(6)) == [1.5, "2", 10, "A", "b", None]
+    # 整行一起移动
+    assert column(model, 1, range(6)) == [6, 4, 2, 5, 1, 3]
+
+    op = plan_sort(model, {"r0": 0, "r1": 5, "c0": 0, "c1": 1, "keys": [{"col": 0, "desc": True}]})
+    model.apply(op)
+    assert column(model, 0, range(6)) == ["b", "A", 10, "2", 1.5, None]
+
+
+def test_sort_multiple_keys_is_stable():
+    model = make_model([["x", "y", "x", "y", "x"], [3, 1, 1, 2, 3], ["a", "b", "c", "d", "e"]])
+    op = plan_sort(model, {"r0": 0, "r1": 4, "c0": 0, "c1": 2, "keys": [{"col": 0}, {"col": 1, "desc": True}]})
+    model.apply(op)
+    assert column(model, 2, range(5)) == ["a", "e", "c", "d", "b"]
+
+
+def test_sort_only_moves_cells_inside_range():
+    model = make_model([[None, 3, 1, 2], [None, "c", "a", "b"], ["h", "x", "y", "z"]])
+    model.apply(plan_sort(model, {"r0": 1, "r1": 3, "c0": 0, "c1": 1, "keys": [{"col": 0}]}))
+    assert column(model, 1, range(4)) == [None, "a", "b", "c"]
+    assert column(model, 2, range(4)) == ["h", "x", "y", "z"]
+
+
+def test_sort_recalculates_formulas():
+    model = make_model([[2, 1], ["=A1*10", "=A2*10"]])
+    changes = model.apply(plan_sort(model, {"r0": 0, "r1": 1, "c0": 0, "c1": 0, "keys": [{"col": 0}]}))
+    # 排序不改写公式中的引用，B列的公式引用的A列值改变
+    assert changes == {"0_1": 10, "1_1": 20}
+
+
+@pytest.mark.parametrize("request_data", [
+    {"r0": 0, "r1": 3, "c0": 0, "c1": 1, "keys": []},
+    {"r0": 0, "r1": 3, "c0": 0, "c1": 1, "keys": [{"col": 5}]},
+    {"r0": 3, "r1": 0, "c0": 0, "c1": 1, "keys": [{"col": 0}]},
+    {"r0": 0, "r1": 3, "c0": 0, "c1": 1, "keys": [{"col": "a"}]},
+])
+def test_sort_rejects_invalid_requests(request_data):
+    model = make_model([[1, 2, 3, 4], [1, 2, 3, 4]])
+    with pytest.raises(ValueError):
+        plan_sort(model, request_data)
+
+
+def test_sort_rejects_merged_cells():
+    merge = {"startRow": 1, "endRow": 2, "startColumn": 0, "endColumn": 0}
+    model = make_model([[1, 2, 3, 4]], merges=[merge])
+    with pytest.raises(ValueError):
+        plan_sort(model, {"r0": 0, "r1": 3, "c0": 0, "c1": 0, "keys": [{"col": 0}]})
+
+
+def brute_force_filter(model, rows, predicates):
+    def matches(row, predicate):
+        value = model.cell_value((row, predicate["col"]))
+        key, target = index_key(value), index_key(predicate.get("value"))
+        op = predicate["op"]
+        if op == "empty":
+            return key is None
+        if op == "nonempty":
+            return key is not None
+        if op in ("eq", "ne"):
+            return (key == target) == (op == "eq")
+        if key is None or key.__class__ is not target.__class__:
+            return False
+        return {"gt": key > target, "ge": key >= target, "lt": key < target, "le": key <= target}[op]
+
+    return [row for row in rows if all(matches(row, predicate) for predicate in predicates)]
+
+
+def test_filter_matches_brute_force_after_edits():
+    rng = random.Random(5)
+    values = ["华东", "华南", "华北", 5, "5", 10.5, None, "abc", "ABC"]
+    model = make_model([[rng.choice(values) for _ in range(500)], [rng.randrange(100) for _ in range(500)]])
+    predicates = [
+        [{"col": 0, "op": "eq", "value": "华东"}],
+        [{"col": 0, "op": "eq", "value": "abc"}, {"col": 1, "op": "ge", "value": 50}],
+        [{"col": 0, "op": "ne", "value": 5}],
+        [{"col": 0, "op": "empty"}],
+        [{"col": 1, "op": "lt", "value": "10"}],
+    ]
+    for _ in range(3):
+        for predicate in predicates:
+            rows = [row for row in model.sorted_rows if row <= 499]
+            assert filter_rows(model, 0, 499, predicate) == brute_force_filter(model, rows, predicate)
+        # 修改后索引增量更新
+        for _ in range(100):
+            model.apply({"type": "cell_update", "row": rng.randrange(500), "col": rng.randrange(2),
+                         "value": rng.choice(values)})
+
+
+def test_filter_text_predicates():
+    model = make_model([["Apple", "pineapple", "APRICOT", 120, None]])
+    assert filter_rows(model, 0, 4, [{"col": 0, "op": "begins", "value": "ap"}]) == [0, 2]
+    assert filter_rows(model, 0, 4, [{"col": 0, "op": "contains", "value": "APPLE"}]) == [0, 1]
+    assert filter_rows(model, 0, 4, [{"col": 0, "op": "ends", "value": "20"}]) == [3]
+    with pytest.raises(ValueError):
+        filter_rows(model, 0, 4, [{"col": 0, "op": "like", "value": "a"}])
+
+
+def test_find_substring_and_whole():
+    model = make_model([["apple", "Apple pie", "banana", 123], ["=A1", "grape", None, "apple"]])
+    assert find_cells(model, {"find": "apple"})["cells"] == [[0, 0], [1, 0], [3, 1]]
+    assert find_cells(model, {"find": "apple", "match_case": True})["cells"] == [[0, 0], [3, 1]]
+    assert find_cells(model, {"find": "APPLE", "whole": True})["cells"] == [[0, 0], [3, 1]]
+    assert find_cells(model, {"find": "23"})["cells"] == [[3, 0]]
+    # 公式单元格匹配公式文本
+    assert find_cells(model, {"find": "=a1", "whole": True, "c0": 1, "c1": 1})["cells"] == [[0, 1]]
+
+
+def test_whole_find_with_index_matches_scan(monkeypatch):
+    rng = random.Random(3)
+    values = ["abc", "ABC", "10", "10.0", 10, 10.5, "1e1", True, "true", " 10", "=A1", "ß", "SS", "x"]
+    model = make_model([[rng.choice(values) for _ in range(300)] for _ in range(3)])
+    model.indexes.column(0)
+    model.indexes.column(1)
+    requests = [
+        {"find": find, "whole": True, "match_case": match_case, "c0": c0, "c1": c1}
+        for find in ("abc", "10", "10.0", "1e1", "true", "TRUE", " 10", "=A1", "ss", "x")
+        for match_case in (False, True)
+        for c0, c1 in ((0, 0), (2, 2), (0, 1))
+    ]
+    indexed = [find_cells(model, request) for request in requests]
+    # 没有可用的索引时按单元格扫描
+    monkeypatch.setattr(table_ops, "_indexed_candidates", lambda *args: pytest.fail("不应使用索引"))
+    model.indexes.reset()
+    scanned = [find_cells(model, dict(request, c0=0, c1=2)) for request in requests]
+    for request, result, full in zip(requests, indexed, scanned):
+        expected = [cell for cell in full["cells"] if request["c0"] <= cell[1] <= request["c1"]]
+        assert result["cells"] == expected, request
+
+
+def test_replace_keeps_numbers_numeric():
+    model = make_model([[10, "10", "a10", 1.5]])
+    op = plan_replace(model, {"find": "10", "replace": "20"})
+    assert op["updates"] == [
+        {"row": 0, "col": 0, "value": 20},
+        {"row": 1, "col": 0, "value": "20"},
+        {"row": 2, "col": 0, "value": "a20"},
+    ]
+    model.apply(op)
+    assert column(model, 0, range(4)) == [20, "20", "a20", 1.5]
+    assert filter_rows(model, 0, 3, [{"col": 0, "op": "eq", "value": 20}]) == [0, 1]
+
+
+def test_replace_whole_and_no_match():
+    model = make_model([["foo", "foo bar", "FOO"]])
+    op = plan_replace(model, {"find": "foo", "replace": "baz", "whole": True})
+    assert [(u["row"], u["value"]) for u in op["updates"]] == [(0, "baz"), (2, "baz")]
+    assert plan_replace(model, {"find": "missing", "replace": "x"})["updates"] == []
+    with pytest.raises(ValueError):
+        plan_replace(model, {"find": "", "replace": "x"})